@@ -1,47 +1,42 @@
 from django.contrib import admin
 from django.contrib import messages
 from django.conf import settings
-from unfold.admin import ModelAdmin
-from telegram import Bot as TelegramBotClient
-from telegram.request import HTTPXRequest
+from django.template.response import TemplateResponse
+from unfold.admin import ModelAdmin, TabularInline
+from unfold.decorators import action
 import asyncio
-from .models import TelegramBot, BotUser, BotFlow, BotMessage
+from . import tracing
+from .client import create_telegram_client
+from .models import TelegramBot, BotUser, BotFlow, BotMessage, BotTask, OutgoingMessage, ScheduledJob, MediaFile
+from .webhooks import get_webhook_config
 
 
-def create_telegram_client(token: str) -> TelegramBotClient:
-    """
-    Create Telegram Bot client with proper configuration
-    Clears proxy environment variables to avoid proxy issues
-    """
-    import os
+class BotTaskInline(TabularInline):
+    """Recent background tasks, shows webhook/username setup converging"""
+    model = BotTask
+    extra = 0
+    can_delete = False
+    fields = ['task_type', 'status', 'attempts', 'run_after', 'last_error', 'updated_at']
+    readonly_fields = fields
+    ordering = ['-created_at']
     
-    # Save original proxy env vars
-    original_proxies = {}
-    proxy_vars = ['HTTP_PROXY', 'HTTPS_PROXY', 'ALL_PROXY', 'http_proxy', 'https_proxy', 'all_proxy',
-                  'FTP_PROXY', 'ftp_proxy', 'NO_PROXY', 'no_proxy']
-    
-    # Temporarily clear proxy environment variables
-    for var in proxy_vars:
-        if var in os.environ:
-            original_proxies[var] = os.environ[var]
-            del os.environ[var]
-    
-    try:
-        # Create Telegram client - it will now not use any proxy
-        return TelegramBotClient(token=token)
-    finally:
-        # Restore original proxy env vars
-        for var, value in original_proxies.items():
-            os.environ[var] = value
+    def has_add_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(TelegramBot)
 class TelegramBotAdmin(ModelAdmin):
-    list_display = ['name', 'username', 'bot_type', 'user_count', 'request_count', 'is_webhook_set', 'is_active', 'created_at']
+    list_display = ['name', 'username', 'bot_type', 'user_count', 'request_count', 'is_webhook_set', 'webhook_pending_update_count', 'is_active', 'created_at']
     list_filter = ['is_active', 'is_webhook_set', 'bot_type', 'created_at']
     search_fields = ['name', 'username', 'token']
-    readonly_fields = ['id', 'user_count', 'request_count', 'created_at', 'updated_at']
-    actions = ['setup_webhook_action', 'check_webhook_info', 'delete_webhook_action']
+    readonly_fields = [
+        'id', 'user_count', 'request_count', 'created_at', 'updated_at',
+        'webhook_pending_update_count', 'webhook_last_error_message', 'webhook_last_error_date', 'webhook_checked_at',
+        'sessions_swept_until',
+    ]
+    actions = ['setup_webhook_action', 'check_webhook_info', 'delete_webhook_action', 'rotate_webhook_secret']
+    actions_list = ['slow_updates']
+    inlines = [BotTaskInline]
     
     fieldsets = (
         ('Bot Information', {
@@ -59,7 +54,22 @@ class TelegramBotAdmin(ModelAdmin):
             'fields': ('user_count', 'request_count')
         }),
         ('Webhook Configuration', {
-            'fields': ('auto_setup_webhook', 'is_webhook_set', 'webhook_url')
+            'fields': ('auto_setup_webhook', 'is_webhook_set', 'webhook_url', 'webhook_secret')
+        }),
+        ('Webhook Status', {
+            'fields': (
+                'webhook_pending_update_count', 'webhook_last_error_message',
+                'webhook_last_error_date', 'webhook_checked_at',
+            ),
+            'classes': ('collapse',)
+        }),
+        ('Idle Sessions', {
+            'fields': ('session_idle_hours', 'sessions_swept_until'),
+            'classes': ('collapse',)
+        }),
+        ('Flood Protection', {
+            'fields': ('flood_limit', 'flood_window', 'flood_block_after', 'flood_warning_text'),
+            'classes': ('collapse',)
         }),
         ('Status', {
             'fields': ('is_active', 'created_at', 'updated_at')
@@ -83,12 +93,13 @@ class TelegramBotAdmin(ModelAdmin):
         
         for bot in queryset:
             try:
-                # Construct webhook URL
-                webhook_url = f"{base_url}/api/webhook/{bot.id}"
+                # Desired webhook configuration
+                config = get_webhook_config(bot, base_url=base_url)
+                webhook_url = config['url']
                 
                 # Setup webhook with Telegram
                 bot_client = create_telegram_client(bot.token)
-                result = asyncio.run(bot_client.set_webhook(url=webhook_url))
+                result = asyncio.run(bot_client.set_webhook(**config))
                 
                 # Update bot
                 bot.webhook_url = webhook_url
@@ -215,6 +226,62 @@ class TelegramBotAdmin(ModelAdmin):
             )
     
     delete_webhook_action.short_description = "🗑️ Delete Webhook"
+    
+    def rotate_webhook_secret(self, request, queryset):
+        """Give the selected bots new webhook secrets and register them with Telegram"""
+        from .models import generate_webhook_secret
+        from .tasks import enqueue_bot_task
+        
+        for bot in queryset:
+            bot.webhook_secret = generate_webhook_secret()
+            # Updates carrying the old secret are refused until Telegram has the new one
+            bot.is_webhook_set = False
+            bot.save(update_fields=['webhook_secret', 'is_webhook_set'])
+            enqueue_bot_task(bot, 'setup_webhook')
+        
+        self.message_user(
+            request,
+            f"🔑 New webhook secrets for {queryset.count()} bot(s), webhook setup queued.",
+            level=messages.SUCCESS
+        )
+    
+    rotate_webhook_secret.short_description = "🔑 Rotate Webhook Secret"
+    
+    @action(description="🐢 Slow Updates", url_path="slow-updates")
+    def slow_updates(self, request):
+        """Slowest traced updates of this server process, with their spans"""
+        if request.method == 'POST':
+            tracing.slowest_traces.clear()
+        
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Slow Updates',
+            'opts': self.model._meta,
+            'traces': tracing.slowest_traces.traces(),
+            'sample_rate': getattr(settings, 'TRACING_SAMPLE_RATE', 0),
+            'export_path': getattr(settings, 'TRACING_EXPORT_PATH', None),
+        }
+        return TemplateResponse(request, 'admin/Bot/slow_updates.html', context)
+
+
+@admin.register(BotTask)
+class BotTaskAdmin(ModelAdmin):
+    list_display = ['task_type', 'bot', 'status', 'attempts', 'run_after', 'updated_at']
+    list_filter = ['status', 'task_type', 'bot']
+    search_fields = ['bot__name', 'last_error']
+    readonly_fields = ['created_at', 'updated_at']
+    actions = ['retry_tasks_action']
+    
+    def retry_tasks_action(self, request, queryset):
+        """Reset failed tasks so the worker picks them up again"""
+        from django.utils import timezone
+        
+        count = queryset.exclude(status='running').update(
+            status='pending', attempts=0, run_after=timezone.now()
+        )
+        self.message_user(request, f"Queued {count} task(s) for retry.", level=messages.SUCCESS)
+    
+    retry_tasks_action.short_description = "🔁 Retry Tasks"
 
 
 @admin.register(BotUser)
@@ -242,6 +309,27 @@ class BotUserAdmin(ModelAdmin):
             'fields': ('is_active', 'is_blocked', 'first_interaction', 'last_interaction')
         }),
     )
+    actions = ['unblock_users']
+    
+    def unblock_users(self, request, queryset):
+        """Clear is_blocked and flood protection blocks"""
+        from django.db.models import F
+        from .flood import unblock
+        from .shared_state import SharedStateError
+        
+        # Flood blocks live only in shared state, so every selected user is unblocked there
+        users = list(queryset.values_list('pk', 'bot_id', 'chat_id'))
+        for _, bot_id, chat_id in users:
+            try:
+                unblock(bot_id, chat_id)
+            except SharedStateError as e:
+                self.message_user(request, f"❌ Could not clear flood block of {chat_id}: {e}", level=messages.ERROR)
+        queryset.model.objects.filter(pk__in=[pk for pk, _, _ in users], is_blocked=True).update(
+            is_blocked=False, version=F('version') + 1
+        )
+        self.message_user(request, f"✅ Unblocked {len(users)} user(s).", level=messages.SUCCESS)
+    
+    unblock_users.short_description = "✅ Unblock Users"
 
 
 @admin.register(BotFlow)
@@ -288,3 +376,98 @@ class BotMessageAdmin(ModelAdmin):
             return obj.text[:50] + '...' if len(obj.text) > 50 else obj.text
         return '-'
     text_preview.short_description = 'Text Preview'
+    
+    def get_queryset(self, request):
+        """Messages of the bot filtered on come from its shard (see Bot.sharding)"""
+        from django.http import QueryDict
+        from .sharding import shard_for
+        
+        queryset = super().get_queryset(request)
+        # The change form keeps the list's filters in _changelist_filters
+        bot_id = (
+            request.GET.get('bot__id__exact')
+            or QueryDict(request.GET.get('_changelist_filters', '')).get('bot__id__exact')
+        )
+        return queryset.using(shard_for(bot_id)) if bot_id else queryset
+    
+    def get_list_select_related(self, request):
+        # Bots and users are not in the shards: no joins to them there
+        return () if settings.MESSAGE_SHARD_DATABASES else super().get_list_select_related(request)
+    
+    def get_search_fields(self, request):
+        return ['text'] if settings.MESSAGE_SHARD_DATABASES else super().get_search_fields(request)
+    
+    def changelist_view(self, request, extra_context=None):
+        if settings.MESSAGE_SHARD_DATABASES and 'bot__id__exact' not in request.GET:
+            self.message_user(request, "Messages are stored per bot: filter by bot to see its messages.")
+        return super().changelist_view(request, extra_context)
+
+
+@admin.register(OutgoingMessage)
+class OutgoingMessageAdmin(ModelAdmin):
+    list_display = ['chat_id', 'bot', 'method', 'status', 'attempts', 'error_code', 'run_after', 'created_at']
+    list_filter = ['status', 'method', 'error_code', 'bot', 'created_at']
+    search_fields = ['chat_id', 'idempotency_key', 'last_error']
+    readonly_fields = ['idempotency_key', 'telegram_message_id', 'created_at', 'updated_at', 'sent_at']
+    actions = ['retry_messages_action']
+    
+    fieldsets = (
+        ('Message', {
+            'fields': ('bot', 'user', 'chat_id', 'method', 'payload', 'idempotency_key')
+        }),
+        ('Delivery', {
+            'fields': ('status', 'attempts', 'max_attempts', 'run_after', 'telegram_message_id', 'sent_at')
+        }),
+        ('Last Error', {
+            'fields': ('error_code', 'last_error')
+        }),
+        ('Timestamps', {
+            'fields': ('created_at', 'updated_at')
+        }),
+    )
+    
+    def retry_messages_action(self, request, queryset):
+        """Re-queue failed messages"""
+        from django.utils import timezone
+        
+        count = queryset.filter(status='failed').update(
+            status='pending', attempts=0, run_after=timezone.now()
+        )
+        self.message_user(request, f"Queued {count} message(s) for retry.", level=messages.SUCCESS)
+    
+    retry_messages_action.short_description = "🔁 Retry Failed Messages"
+
+
+@admin.register(ScheduledJob)
+class ScheduledJobAdmin(ModelAdmin):
+    list_display = ['name', 'user', 'bot', 'method', 'status', 'run_at', 'interval', 'runs', 'last_run_at']
+    list_filter = ['status', 'name', 'method', 'bot']
+    search_fields = ['name', 'user__chat_id', 'user__username']
+    readonly_fields = ['runs', 'last_run_at', 'created_at', 'updated_at']
+    actions = ['cancel_jobs_action']
+    
+    def cancel_jobs_action(self, request, queryset):
+        """Cancel pending jobs"""
+        from django.utils import timezone
+        
+        count = queryset.filter(status='pending').update(status='cancelled', updated_at=timezone.now())
+        self.message_user(request, f"Cancelled {count} job(s).", level=messages.SUCCESS)
+    
+    cancel_jobs_action.short_description = "🛑 Cancel Jobs"
+
+
+@admin.register(MediaFile)
+class MediaFileAdmin(ModelAdmin):
+    list_display = ['path', 'kind', 'bot', 'size', 'short_hash', 'updated_at']
+    list_filter = ['kind', 'bot']
+    search_fields = ['path', 'sha256', 'file_id']
+    readonly_fields = ['bot', 'kind', 'sha256', 'file_id', 'path', 'size', 'created_at', 'updated_at']
+    
+    def short_hash(self, obj):
+        return obj.sha256[:12]
+    
+    short_hash.short_description = 'SHA-256'
+    
+    def has_add_permission(self, request):
+        # Rows are created by the outbox after the first upload of a file
+        return False
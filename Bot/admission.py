@@ -0,0 +1,197 @@
+"""
+Webhook admission control - bounded update processing with load shedding
+
+Each process handles at most WEBHOOK_MAX_CONCURRENCY updates at a time.
+Further updates wait in a queue per priority, for at most
+WEBHOOK_QUEUE_TIMEOUT seconds; a freed slot goes to the oldest waiting
+update of the highest priority. When an update's queue is full, or its
+wait runs out, the webhook answers 503 with Retry-After: Telegram keeps
+the update and delivers it again later, so a burst (e.g. the backlog
+after an outage) is worked off at the rate the process can sustain
+instead of all at once. A draining server refuses new and waiting
+updates the same way, so only updates already running delay its exit.
+
+Priorities: ``/start`` and other commands and shared contacts go first,
+then plain messages and button presses, then edits and membership changes.
+"""
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+import threading
+import time
+
+from django.conf import settings
+
+from . import metrics, tracing
+from .updates import Update
+
+# Highest priority first
+PRIORITIES = ('high', 'normal', 'low')
+
+
+class Overloaded(Exception):
+    """The update was not admitted; answer with a retryable status"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def update_priority(update: Update) -> str:
+    """Priority of an update: commands and contacts, chatter, everything else"""
+    message = update.message
+    if message is not None:
+        if message.message_type == 'contact' or message.text.startswith('/'):
+            return 'high'
+        return 'normal'
+    if update.callback_query is not None:
+        return 'normal'
+    return 'low'
+
+
+class Slot:
+    """One admitted update's share of the capacity"""
+    __slots__ = ('controller', 'handed_off', 'released')
+
+    def __init__(self, controller: 'AdmissionController'):
+        self.controller = controller
+        # Set when the service thread took over releasing the slot
+        self.handed_off = False
+        self.released = False
+
+    def release(self) -> None:
+        """Free the slot for the next update (once)"""
+        if not self.released:
+            self.released = True
+            self.controller._release()
+
+
+class AdmissionController:
+    """Bounded capacity with a length-limited waiting queue per priority"""
+
+    def __init__(self, capacity: int, queue_limits: Dict[str, int], queue_timeout: float):
+        """
+        Args:
+            capacity: Updates processed at the same time
+            queue_limits: Priority -> updates allowed to wait for a slot
+            queue_timeout: Seconds an update may wait for a slot
+        """
+        self.capacity = capacity
+        self.queue_limits = queue_limits
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self.closed = False
+        self._waiting = {priority: deque() for priority in PRIORITIES}
+        self._condition = threading.Condition()
+
+    def waiting(self) -> int:
+        """Updates waiting for a slot"""
+        return sum(len(waiters) for waiters in self._waiting.values())
+
+    def _first_waiter(self):
+        for priority in PRIORITIES:
+            if self._waiting[priority]:
+                return self._waiting[priority][0]
+        return None
+
+    def admit(self, priority: str) -> Slot:
+        """
+        Wait for a processing slot
+
+        Raises:
+            Overloaded: The priority's queue is full, or no slot freed up in time
+        """
+        started = time.monotonic()
+        with self._condition:
+            if self.closed:
+                metrics.WEBHOOK_ADMISSIONS.inc((priority, 'shutting_down'))
+                raise Overloaded('shutting_down')
+            if self.running < self.capacity and self._first_waiter() is None:
+                self.running += 1
+                metrics.WEBHOOK_ADMISSIONS.inc((priority, 'admitted'))
+                return Slot(self)
+
+            waiters = self._waiting[priority]
+            if len(waiters) >= self.queue_limits.get(priority, 0):
+                metrics.WEBHOOK_ADMISSIONS.inc((priority, 'queue_full'))
+                raise Overloaded('queue_full')
+
+            waiter = object()
+            waiters.append(waiter)
+            deadline = started + self.queue_timeout
+            try:
+                while not (self.running < self.capacity and self._first_waiter() is waiter):
+                    if self.closed:
+                        metrics.WEBHOOK_ADMISSIONS.inc((priority, 'shutting_down'))
+                        raise Overloaded('shutting_down')
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        metrics.WEBHOOK_ADMISSIONS.inc((priority, 'timeout'))
+                        metrics.STAGE_DEADLINES_EXCEEDED.inc(('queue',))
+                        raise Overloaded('timeout')
+                    self._condition.wait(remaining)
+                self.running += 1
+            finally:
+                waiters.remove(waiter)
+                # The next waiter may now be first in line
+                self._condition.notify_all()
+
+        metrics.WEBHOOK_ADMISSIONS.inc((priority, 'admitted'))
+        metrics.WEBHOOK_QUEUE_WAIT.observe(time.monotonic() - started, (priority,))
+        return Slot(self)
+
+    def _release(self) -> None:
+        with self._condition:
+            self.running -= 1
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        """Refuse new and waiting updates (server shutdown)"""
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+_controller: Optional[AdmissionController] = None
+_controller_lock = threading.Lock()
+
+
+def get_controller() -> AdmissionController:
+    """The process-wide admission controller"""
+    global _controller
+
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController(
+                    capacity=max(1, settings.WEBHOOK_MAX_CONCURRENCY),
+                    queue_limits=settings.WEBHOOK_QUEUE_LIMITS,
+                    queue_timeout=settings.WEBHOOK_QUEUE_TIMEOUT,
+                )
+    return _controller
+
+
+@contextmanager
+def admitted(update: Update):
+    """
+    Hold a processing slot for an update while the block runs
+
+    The service thread may take the slot over (``Slot.handed_off``) and
+    release it when the handler really finishes.
+
+    Raises:
+        Overloaded: Answer with a retryable status
+    """
+    priority = update_priority(update)
+    with tracing.span('admission', priority=priority):
+        slot = get_controller().admit(priority)
+    try:
+        yield slot
+    finally:
+        if not slot.handed_off:
+            slot.release()
+
+
+def waiting() -> int:
+    """Updates waiting for a slot in this process"""
+    return _controller.waiting() if _controller is not None else 0
@@ -6,5 +6,10 @@ class BotConfig(AppConfig):
     name = 'Bot'
     
     def ready(self):
-        """Import signals when app is ready"""
+        """Import signals and start the logging queue listeners when app is ready"""
+        import atexit
         import Bot.signals  # noqa
+        from Bot.log import start_listeners, stop_listeners
+        
+        start_listeners()
+        atexit.register(stop_listeners)
@@ -0,0 +1,148 @@
+"""
+Per-token circuit breaker - revoked bots and users who blocked them
+
+Telegram answers every call made with a revoked token with 401
+Unauthorized. Once an outbox batch gets one, the rest of that bot's
+messages in the batch are not attempted and all its pending messages wait
+BOT_BREAKER_COOLDOWN seconds (the open circuit); after that, one message
+at a time probes the token until one gets through. BOT_BREAKER_THRESHOLD
+trips, counted in shared state so every worker adds to the same count,
+deactivate the bot: its webhook is refused, its pending messages fail and
+the site admins get an email.
+
+A 403 "bot was blocked by the user" sets the user's ``BotUser.is_blocked``.
+Messages to blocked users, like those of inactive bots, are failed without
+a call until the user unblocks the bot (``my_chat_member``) or an admin
+unblocks them.
+"""
+from datetime import timedelta
+from typing import Iterable, Set, Tuple
+import logging
+
+from django.conf import settings
+from django.core.mail import mail_admins
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics
+from .log import event
+from .shared_state import SharedStateError, get_backend as get_shared_state
+
+logger = logging.getLogger(__name__)
+
+# Trips are forgotten after this many seconds without another one
+TRIP_MEMORY = 24 * 3600
+
+# Forbidden descriptions meaning the user can no longer be messaged
+BLOCKED_MARKERS = ('bot was blocked by the user', 'user is deactivated')
+
+
+def trips_key(bot_id) -> str:
+    return f"breaker:{bot_id}"
+
+
+def is_blocked_error(error: Exception) -> bool:
+    """Whether a Forbidden error says the user blocked the bot"""
+    from telegram.error import Forbidden
+
+    description = str(error).lower()
+    return isinstance(error, Forbidden) and any(marker in description for marker in BLOCKED_MARKERS)
+
+
+def trip(bot) -> bool:
+    """
+    Open a bot's circuit after a 401 Unauthorized (once per outbox batch)
+
+    Args:
+        bot: TelegramBot model instance
+
+    Returns:
+        True if the bot was deactivated
+    """
+    from .models import OutgoingMessage
+
+    run_after = timezone.now() + timedelta(seconds=settings.BOT_BREAKER_COOLDOWN)
+    OutgoingMessage.objects.filter(bot_id=bot.pk, status='pending', run_after__lt=run_after).update(
+        run_after=run_after
+    )
+    try:
+        trips = get_shared_state().incr(trips_key(bot.pk), ttl=TRIP_MEMORY)
+    except SharedStateError as e:
+        # The circuit still opens; only deactivating needs the shared count
+        logger.warning(f"Breaker trip of bot {bot.pk} not counted: {e}")
+        return False
+
+    if trips < settings.BOT_BREAKER_THRESHOLD:
+        metrics.BOT_CIRCUIT_TRIPS.inc(('open',))
+        logger.warning(event('bot_circuit_open', bot_id=bot.pk, trips=trips, until=run_after.isoformat()))
+        return False
+    metrics.BOT_CIRCUIT_TRIPS.inc(('deactivated',))
+    return deactivate_bot(bot, f"{trips} deliveries answered 401 Unauthorized")
+
+
+def reset(bot_id) -> None:
+    """Close a bot's circuit (its token was changed or it was reactivated)"""
+    try:
+        get_shared_state().delete(trips_key(bot_id))
+    except SharedStateError as e:
+        logger.warning(f"Breaker reset of bot {bot_id} failed: {e}")
+
+
+def deactivate_bot(bot, reason: str) -> bool:
+    """
+    Deactivate a bot whose token no longer works and alert the admins
+
+    Returns:
+        False if the bot was already inactive
+    """
+    from .models import OutgoingMessage, TelegramBot
+    from .webhooks import active_bots
+
+    # Use update() to avoid triggering post_save signals, so invalidate explicitly
+    if not TelegramBot.objects.filter(pk=bot.pk, is_active=True).update(is_active=False):
+        return False
+    bot.is_active = False
+    active_bots.invalidate()
+
+    failed = OutgoingMessage.objects.filter(bot_id=bot.pk, status='pending').update(
+        status='failed', last_error=f"Bot deactivated: {reason}", error_code=401, updated_at=timezone.now()
+    )
+    logger.error(event('bot_deactivated', bot_id=bot.pk, reason=reason, failed_messages=failed))
+    mail_admins(
+        f"Bot {bot.name} deactivated",
+        f"The bot {bot.name} (@{bot.username or '?'}, id {bot.pk}) was deactivated: {reason}.\n"
+        f"{failed} pending messages were not sent.\n\n"
+        f"Its token was probably revoked in @BotFather. Enter the new token in the admin "
+        f"and activate the bot again.",
+        fail_silently=True,
+    )
+    return True
+
+
+def mark_blocked(bot_id, chat_id: int) -> None:
+    """Mark a user who blocked the bot, so nothing more is sent to them"""
+    from .models import BotUser
+
+    # Versioned like every state change, so a handler holding the user re-reads it
+    if BotUser.objects.filter(bot_id=bot_id, chat_id=chat_id, is_blocked=False).update(
+        is_blocked=True, version=F('version') + 1
+    ):
+        logger.info(event('user_blocked_bot', bot_id=bot_id, chat_id=chat_id))
+
+
+def blocked_chats(messages: Iterable) -> Set[Tuple[int, int]]:
+    """(bot_id, chat_id) of the messages' recipients who blocked the bot"""
+    from .models import BotUser
+
+    messages = list(messages)
+    if not messages:
+        return set()
+    return set(
+        BotUser.objects
+        .filter(
+            is_blocked=True,
+            bot_id__in={message.bot_id for message in messages},
+            chat_id__in={message.chat_id for message in messages},
+        )
+        .values_list('bot_id', 'chat_id')
+    )
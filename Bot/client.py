@@ -0,0 +1,45 @@
+"""
+Telegram Bot API client factory
+"""
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from telegram import Bot as TelegramBotClient
+
+
+def create_telegram_client(token: str) -> 'TelegramBotClient':
+    """
+    Create Telegram Bot client with proper configuration
+    Clears proxy environment variables to avoid proxy issues
+    Talks to TELEGRAM_API_BASE_URL instead of api.telegram.org when set
+    """
+    import os
+    from django.conf import settings
+    from telegram import Bot as TelegramBotClient
+    from .telegram_request import InstrumentedHTTPXRequest
+    
+    options = {}
+    api_base_url = getattr(settings, 'TELEGRAM_API_BASE_URL', None)
+    if api_base_url:
+        options['base_url'] = f"{api_base_url.rstrip('/')}/bot"
+        options['base_file_url'] = f"{api_base_url.rstrip('/')}/file/bot"
+    
+    # Save original proxy env vars
+    original_proxies = {}
+    proxy_vars = ['HTTP_PROXY', 'HTTPS_PROXY', 'ALL_PROXY', 'http_proxy', 'https_proxy', 'all_proxy',
+                  'FTP_PROXY', 'ftp_proxy', 'NO_PROXY', 'no_proxy']
+    
+    # Temporarily clear proxy environment variables
+    for var in proxy_vars:
+        if var in os.environ:
+            original_proxies[var] = os.environ[var]
+            del os.environ[var]
+    
+    try:
+        # Create Telegram client - it will now not use any proxy.
+        # API calls are timed and counted by the instrumented request.
+        return TelegramBotClient(token=token, request=InstrumentedHTTPXRequest(), **options)
+    finally:
+        # Restore original proxy env vars
+        for var, value in original_proxies.items():
+            os.environ[var] = value
@@ -0,0 +1,155 @@
+"""
+Serialized database writer
+
+SQLite allows a single writer at a time. When many webhook requests each
+run several tiny write transactions, they queue on the database lock and
+eventually fail with "database is locked". In SQLite production mode the
+hot-path writes are handed to one writer thread instead, which groups
+whatever is queued into a single transaction (group commit). Each write
+still runs in its own savepoint, so one failing write does not affect the
+others, and callers only get their result once the group is committed.
+
+With several server processes there is one writer per process; the busy
+timeout configured in settings covers the remaining cross-process contention.
+"""
+from concurrent.futures import Future
+import atexit
+import contextvars
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+class SerializedWriter:
+    """Single background thread executing queued write callables in grouped transactions"""
+
+    def __init__(self, using: str = DEFAULT_DB_ALIAS, max_batch: int = 100, max_delay: float = 0.002):
+        """
+        Args:
+            using: Database alias to write to
+            max_batch: Maximum number of writes committed in one transaction
+            max_delay: Seconds to wait for more writes before committing a batch
+        """
+        self.using = using
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = None) -> None:
+        """Commit everything already queued, then stop the writer thread"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Queue ``fn(*args, **kwargs)`` and return a Future resolved after commit"""
+        future = Future()
+        # Run in the caller's context so e.g. tracing spans stay attached to the caller
+        context = contextvars.copy_context()
+        self._queue.put((future, context, fn, args, kwargs))
+        self.start()
+        return future
+
+    def write(self, fn, *args, **kwargs):
+        """Run ``fn`` on the writer thread and wait for the committed result"""
+        if threading.current_thread() is self._thread:
+            return fn(*args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._execute(batch)
+
+        # Message shards written by the batches too (see Bot.sharding)
+        connections.close_all()
+
+    def _execute(self, batch) -> None:
+        results = []
+        try:
+            with transaction.atomic(using=self.using):
+                for future, context, fn, args, kwargs in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with transaction.atomic(using=self.using):
+                            results.append((future, context.run(fn, *args, **kwargs), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+        except Exception as e:
+            # The group commit itself failed, nothing in the batch was written
+            for future, *call in batch:
+                if future.running():
+                    future.set_exception(e)
+            return
+
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Process-wide writer, or None when SQLITE_SERIALIZED_WRITER is off"""
+    global _writer
+
+    if not getattr(settings, 'SQLITE_SERIALIZED_WRITER', False):
+        return None
+
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = SerializedWriter(
+                    max_batch=getattr(settings, 'SQLITE_WRITER_MAX_BATCH', 100),
+                    max_delay=getattr(settings, 'SQLITE_WRITER_MAX_DELAY', 0.002),
+                )
+                atexit.register(_writer.stop)
+    return _writer
+
+
+def write(fn, *args, **kwargs):
+    """
+    Execute a small write, through the serialized writer when enabled
+
+    ``fn`` must be self-contained: it runs on another thread, outside any
+    transaction the caller may have open.
+    """
+    writer = get_writer()
+    if writer is None:
+        return fn(*args, **kwargs)
+    return writer.write(fn, *args, **kwargs)
@@ -0,0 +1,227 @@
+"""
+Local stand-in for a Redis server, for tests and multi-node trials
+
+Implements the subset of the Redis protocol the shared state backend uses
+(GET, SET with EX/PX/NX/XX, DEL, INCR/INCRBY, EXPIRE/PEXPIRE, TTL/PTTL,
+EVAL of the backend's compare-and-delete script, ...). Several app
+processes pointed at it with SHARED_STATE_URL=redis://127.0.0.1:<port>
+share their dedupe windows, locks and counters as they would in production.
+"""
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+import threading
+import time
+
+from Bot.shared_state.redis import COMPARE_AND_DELETE
+
+
+class WrongType(Exception):
+    pass
+
+
+class FakeRedis:
+    """Fake Redis server running on a background thread"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        """
+        Args:
+            host: Interface to listen on
+            port: Port to listen on, 0 picks a free one
+        """
+        self.data = {}
+        self.commands = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+        store = self
+
+        class Handler(FakeRedisHandler):
+            server_store = store
+
+        self.server = FakeRedisServer((host, port), Handler)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'redis://{host}:{port}/0'
+
+    def start(self) -> 'FakeRedis':
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-redis', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def serve_forever(self) -> None:
+        self.server.serve_forever()
+
+    # Storage: key -> (value bytes, expires_at or None)
+
+    def _live(self, key, now):
+        item = self.data.get(key)
+        if item is not None and item[1] is not None and item[1] <= now:
+            del self.data[key]
+            return None
+        return item
+
+    def call(self, args):
+        """Execute one command, returning its reply value"""
+        name = args[0].decode().upper()
+        handler = COMMANDS.get(name)
+        if handler is None:
+            return Exception(f"ERR unknown command '{name}'")
+        with self._lock:
+            self.commands += 1
+            try:
+                return handler(self, time.time(), *args[1:])
+            except WrongType:
+                return Exception('ERR value is not an integer or out of range')
+            except (TypeError, ValueError, IndexError):
+                return Exception(f"ERR wrong number of arguments for '{name.lower()}' command")
+
+    # Commands
+
+    def ping(self, now, *args):
+        return args[0] if args else 'PONG'
+
+    def ok(self, now, *args):
+        return 'OK'
+
+    def get(self, now, key):
+        item = self._live(key, now)
+        return item[0] if item else None
+
+    def set(self, now, key, value, *options):
+        options = [option.decode().upper() for option in options]
+        expires_at = None
+        if 'EX' in options:
+            expires_at = now + int(options[options.index('EX') + 1])
+        if 'PX' in options:
+            expires_at = now + int(options[options.index('PX') + 1]) / 1000
+        exists = self._live(key, now) is not None
+        if ('NX' in options and exists) or ('XX' in options and not exists):
+            return None
+        self.data[key] = (value, expires_at)
+        return 'OK'
+
+    def delete(self, now, *keys):
+        return sum(self._live(key, now) is not None and self.data.pop(key) is not None for key in keys)
+
+    def incrby(self, now, key, amount=b'1'):
+        item = self._live(key, now)
+        try:
+            value = (int(item[0]) if item else 0) + int(amount)
+        except ValueError:
+            raise WrongType()
+        self.data[key] = (str(value).encode(), item[1] if item else None)
+        return value
+
+    def pexpire(self, now, key, milliseconds):
+        item = self._live(key, now)
+        if item is None:
+            return 0
+        self.data[key] = (item[0], now + int(milliseconds) / 1000)
+        return 1
+
+    def expire(self, now, key, seconds):
+        return self.pexpire(now, key, int(seconds) * 1000)
+
+    def pttl(self, now, key):
+        item = self._live(key, now)
+        if item is None:
+            return -2
+        return -1 if item[1] is None else int((item[1] - now) * 1000)
+
+    def ttl(self, now, key):
+        value = self.pttl(now, key)
+        return value if value < 0 else value // 1000
+
+    def dbsize(self, now):
+        return sum(self._live(key, now) is not None for key in list(self.data))
+
+    def flushdb(self, now, *args):
+        self.data.clear()
+        return 'OK'
+
+    def eval(self, now, script, numkeys, *args):
+        # Only scripts with a known Python equivalent can run
+        if script.decode() != COMPARE_AND_DELETE:
+            return Exception('NOSCRIPT Only the shared state compare-and-delete script is supported')
+        keys, argv = args[:int(numkeys)], args[int(numkeys):]
+        item = self._live(keys[0], now)
+        if item is not None and item[0] == argv[0]:
+            del self.data[keys[0]]
+            return 1
+        return 0
+
+
+# Redis command -> FakeRedis method
+COMMANDS = {
+    'PING': FakeRedis.ping,
+    'AUTH': FakeRedis.ok,
+    'SELECT': FakeRedis.ok,
+    'GET': FakeRedis.get,
+    'SET': FakeRedis.set,
+    'DEL': FakeRedis.delete,
+    'INCR': FakeRedis.incrby,
+    'INCRBY': FakeRedis.incrby,
+    'PEXPIRE': FakeRedis.pexpire,
+    'EXPIRE': FakeRedis.expire,
+    'PTTL': FakeRedis.pttl,
+    'TTL': FakeRedis.ttl,
+    'DBSIZE': FakeRedis.dbsize,
+    'FLUSHDB': FakeRedis.flushdb,
+    'EVAL': FakeRedis.eval,
+}
+
+
+class FakeRedisServer(ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class FakeRedisHandler(StreamRequestHandler):
+    server_store = None
+
+    def handle(self):
+        while True:
+            try:
+                args = self.read_command()
+            except (ConnectionError, ValueError):
+                return
+            if args is None:
+                return
+            if not args:
+                continue
+            if args[0].upper() == b'QUIT':
+                self.wfile.write(b'+OK\r\n')
+                return
+            self.wfile.write(encode_reply(self.server_store.call(args)))
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            # Inline command, e.g. typed into telnet
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+
+def encode_reply(value) -> bytes:
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, Exception):
+        return b'-%s\r\n' % str(value).encode()
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, str):
+        return b'+%s\r\n' % value.encode()
+    return b'$%d\r\n%s\r\n' % (len(value), value)
@@ -0,0 +1,330 @@
+"""
+Local stand-in for the Telegram Bot API, for load tests
+
+Serves ``/bot<token>/<method>`` like api.telegram.org for the methods this
+project calls (getMe, setWebhook, deleteWebhook, getWebhookInfo,
+sendMessage, sendPhoto with uploads, ...). Every call can be delayed by a configurable latency and
+a share of calls can be answered with 429 Too Many Requests, so retry and
+flood-wait handling is exercised too. Tokens in ``revoked_tokens`` get
+401 Unauthorized and chats in ``blocked_chats`` 403 (bot blocked by the user).
+
+Point the application at it with TELEGRAM_API_BASE_URL.
+
+``InMemoryTelegramClient`` replaces the client object itself, for
+benchmarks that should not touch the network at all.
+"""
+from collections import Counter
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+import hashlib
+import itertools
+import json
+import random
+import threading
+import time
+import zlib
+
+
+class BadRequest(Exception):
+    """Answered with 400 and the exception text"""
+
+
+class Forbidden(Exception):
+    """Answered with 403 and the exception text"""
+
+
+class FakeTelegramAPI:
+    """Fake Bot API server running on a background thread"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 rate_limit_ratio: float = 0.0, retry_after: int = 1):
+        """
+        Args:
+            host: Interface to listen on
+            port: Port to listen on, 0 picks a free one
+            latency: Seconds every call is delayed
+            jitter: Extra random delay of up to this many seconds
+            rate_limit_ratio: Share of calls answered with 429 (0..1)
+            retry_after: retry_after value of injected 429 responses
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+
+        self.calls = Counter()
+        self.rate_limited = Counter()
+        self.uploads = Counter()
+        self.webhooks = {}
+        self.revoked_tokens = set()
+        self.blocked_chats = set()
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        api = self
+
+        class Handler(FakeTelegramHandler):
+            server_api = api
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'FakeTelegramAPI':
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-telegram-api', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def serve_forever(self) -> None:
+        self.server.serve_forever()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'calls': dict(self.calls), 'rate_limited': dict(self.rate_limited), 'uploads': dict(self.uploads)}
+
+    def call(self, token: str, method: str, params: dict):
+        """
+        Answer one API call
+
+        Returns:
+            (HTTP status, response body)
+        """
+        with self._lock:
+            self.calls[method] += 1
+
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+        if self.rate_limit_ratio and random.random() < self.rate_limit_ratio:
+            with self._lock:
+                self.rate_limited[method] += 1
+            return 429, {
+                'ok': False,
+                'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after},
+            }
+
+        if token in self.revoked_tokens:
+            return 401, {'ok': False, 'error_code': 401, 'description': 'Unauthorized'}
+
+        handler = METHODS.get(method.lower())
+        if handler is None:
+            return 404, {'ok': False, 'error_code': 404, 'description': 'Not Found: method not found'}
+        try:
+            return 200, {'ok': True, 'result': handler(self, token, params)}
+        except BadRequest as e:
+            return 400, {'ok': False, 'error_code': 400, 'description': f'Bad Request: {e}'}
+        except Forbidden as e:
+            return 403, {'ok': False, 'error_code': 403, 'description': f'Forbidden: {e}'}
+
+    # Methods
+
+    def get_me(self, token, params):
+        bot_id = zlib.crc32(token.encode())
+        return {
+            'id': bot_id,
+            'is_bot': True,
+            'first_name': 'Fake Bot',
+            'username': f'fake_{bot_id}_bot',
+            'can_join_groups': True,
+            'can_read_all_group_messages': False,
+            'supports_inline_queries': False,
+        }
+
+    def set_webhook(self, token, params):
+        with self._lock:
+            self.webhooks[token] = params
+        return True
+
+    def delete_webhook(self, token, params):
+        with self._lock:
+            self.webhooks.pop(token, None)
+        return True
+
+    def get_webhook_info(self, token, params):
+        with self._lock:
+            webhook = self.webhooks.get(token, {})
+        info = {
+            'url': webhook.get('url', ''),
+            'has_custom_certificate': False,
+            'pending_update_count': 0,
+        }
+        if webhook.get('max_connections'):
+            info['max_connections'] = int(webhook['max_connections'])
+        if webhook.get('allowed_updates'):
+            info['allowed_updates'] = webhook['allowed_updates']
+        return info
+
+    def send_message(self, token, params):
+        if int(params.get('chat_id', 0)) in self.blocked_chats:
+            raise Forbidden('bot was blocked by the user')
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+            'from': {'id': zlib.crc32(token.encode()), 'is_bot': True, 'first_name': 'Fake Bot'},
+        }
+        for key in ('text', 'caption'):
+            if key in params:
+                message[key] = params[key]
+        return message
+
+    def send_media(self, token, params, kind):
+        """Media message; an uploaded file gets a file_id derived from its content"""
+        message = self.send_message(token, params)
+        media = params.get(kind)
+        if isinstance(media, dict):
+            with self._lock:
+                self.uploads[kind] += 1
+            file_id = 'fake-' + hashlib.sha1(media['content']).hexdigest()
+            size = len(media['content'])
+        elif str(media).startswith('fake-'):
+            file_id, size = str(media), 0
+        else:
+            raise BadRequest('wrong file identifier/HTTP URL specified')
+        info = {'file_id': file_id, 'file_unique_id': file_id[-16:], 'file_size': size}
+        if kind == 'photo':
+            message['photo'] = [dict(info, width=90, height=90), dict(info, width=800, height=800)]
+        elif kind == 'video':
+            message['video'] = dict(info, width=640, height=360, duration=1)
+        elif kind == 'audio':
+            message['audio'] = dict(info, duration=1)
+        else:
+            message['document'] = dict(info, file_name=media.get('filename') if isinstance(media, dict) else None)
+        return message
+
+    def send_photo(self, token, params):
+        return self.send_media(token, params, 'photo')
+
+    def send_document(self, token, params):
+        return self.send_media(token, params, 'document')
+
+    def send_video(self, token, params):
+        return self.send_media(token, params, 'video')
+
+    def send_audio(self, token, params):
+        return self.send_media(token, params, 'audio')
+
+    def answer(self, token, params):
+        return True
+
+
+# Lower-cased Bot API method -> FakeTelegramAPI method
+METHODS = {
+    'getme': FakeTelegramAPI.get_me,
+    'setwebhook': FakeTelegramAPI.set_webhook,
+    'deletewebhook': FakeTelegramAPI.delete_webhook,
+    'getwebhookinfo': FakeTelegramAPI.get_webhook_info,
+    'sendmessage': FakeTelegramAPI.send_message,
+    'sendphoto': FakeTelegramAPI.send_photo,
+    'senddocument': FakeTelegramAPI.send_document,
+    'sendvideo': FakeTelegramAPI.send_video,
+    'sendaudio': FakeTelegramAPI.send_audio,
+    'editmessagetext': FakeTelegramAPI.send_message,
+    'answercallbackquery': FakeTelegramAPI.answer,
+}
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    server_api = None
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.handle_call()
+
+    def do_POST(self):
+        self.handle_call()
+
+    def handle_call(self):
+        # /bot<token>/<method>
+        parts = self.path.split('?', 1)[0].strip('/').split('/')
+        if len(parts) != 2 or not parts[0].startswith('bot'):
+            self.respond(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+            return
+
+        self.respond(*self.server_api.call(parts[0][3:], parts[1], self.read_params()))
+
+    def read_params(self) -> dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        content_type = self.headers.get('Content-Type', '')
+
+        if 'application/json' in content_type:
+            return json.loads(body or b'{}')
+
+        if content_type.startswith('multipart/form-data'):
+            # File uploads: files become {'filename': ..., 'content': bytes}
+            form = BytesParser(policy=HTTP).parsebytes(b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body)
+            params = {}
+            for part in form.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                content = part.get_payload(decode=True)
+                if part.get_filename():
+                    params[name] = {'filename': part.get_filename(), 'content': content}
+                else:
+                    params[name] = content.decode()
+        else:
+            params = dict(parse_qsl(body.decode(), keep_blank_values=True))
+        # Non-string parameters are sent JSON-encoded
+        for key, value in params.items():
+            if isinstance(value, str) and value[:1] in ('[', '{'):
+                try:
+                    params[key] = json.loads(value)
+                except ValueError:
+                    pass
+        return params
+
+    def respond(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class InMemoryTelegramClient:
+    """
+    Stand-in for telegram.Bot that records calls instead of making them
+
+    Any API method (``send_message``, ``get_me``, ...) can be awaited; it is
+    appended to ``calls`` and returns an object with a ``message_id``.
+    """
+
+    def __init__(self, token: str = 'in-memory'):
+        self.token = token
+        self.calls = []
+        self._message_ids = itertools.count(1)
+
+    def __getattr__(self, method: str):
+        if method.startswith('_'):
+            raise AttributeError(method)
+
+        async def call(*args, **kwargs):
+            self.calls.append((method, kwargs))
+            return SentMessage(next(self._message_ids))
+
+        return call
+
+
+class SentMessage:
+    __slots__ = ('message_id',)
+
+    def __init__(self, message_id: int):
+        self.message_id = message_id
@@ -0,0 +1,143 @@
+"""
+Incoming flood protection - per (bot, chat) sliding-window rate limit
+
+Checked by the webhook before an update is stored or reaches the bot's
+service, so a user (or script) flooding a bot costs a few shared state
+operations per update instead of a user save, a message insert and a reply.
+
+The window is a sliding window counter: this window's count plus the
+previous window's, weighted by how much of it still overlaps. The first
+update over the limit in a window is a strike; the first strike also
+sends the bot's slow-down reply. Too many strikes block the user for
+FLOOD_BLOCK_HOURS: their updates are dropped until the block key expires.
+``BotUser.is_blocked`` (the user blocked the bot) is not touched, so replies
+and scheduled messages reach them again once the block is over.
+
+Counters live in shared state: with a cross-process store (Redis, SQLite)
+every worker and node enforces the same limit. With the default memory://
+each process counts on its own, so a user spread over N serve workers may
+send up to N x FLOOD_LIMIT updates per window.
+"""
+from typing import Tuple
+import logging
+import time
+
+from django.conf import settings
+
+from . import metrics
+from .log import event
+from .shared_state import SharedStateError, get_backend as get_shared_state
+
+logger = logging.getLogger(__name__)
+
+# Update types counted; membership changes are not (a blocked user may still leave)
+FLOOD_UPDATE_TYPES = frozenset({'message', 'edited_message', 'callback_query'})
+
+# check_flood results
+ALLOW = 'allow'
+WARN = 'warn'
+DROP = 'drop'
+BLOCK = 'block'
+BLOCKED = 'blocked'
+
+
+def flood_limits(bot) -> Tuple[int, int, int]:
+    """(limit, window seconds, strikes before blocking) of a bot, settings for unset fields"""
+    limit = bot.flood_limit if bot.flood_limit is not None else settings.FLOOD_LIMIT
+    window = bot.flood_window or settings.FLOOD_WINDOW
+    block_after = bot.flood_block_after if bot.flood_block_after is not None else settings.FLOOD_BLOCK_AFTER
+    return limit, max(1, window), block_after
+
+
+def blocked_key(bot_id, chat_id: int) -> str:
+    return f"flood:blocked:{bot_id}:{chat_id}"
+
+
+def check_flood(bot, update) -> str:
+    """
+    Count an incoming update against its user's limit
+
+    Args:
+        bot: TelegramBot model instance
+        update: Decoded update
+
+    Returns:
+        ALLOW to process it; WARN (first strike: send the slow-down reply),
+        DROP, BLOCK (strikes used up: block the user) or BLOCKED to drop it
+    """
+    if update.type not in FLOOD_UPDATE_TYPES or update.chat_id is None:
+        return ALLOW
+    limit, window, block_after = flood_limits(bot)
+    if not limit:
+        return ALLOW
+
+    prefix = f"flood:{bot.id}:{update.chat_id}"
+    now = time.time()
+    index = int(now // window)
+    state = get_shared_state()
+    try:
+        if state.get(blocked_key(bot.id, update.chat_id)):
+            return BLOCKED
+        current = state.incr(f"{prefix}:{index}", ttl=2 * window)
+        if current <= limit:
+            # Under the limit within this window alone: the weighted sum may still be over
+            previous = int(state.get(f"{prefix}:{index - 1}") or 0)
+            if current + previous * (1 - (now % window) / window) <= limit:
+                return ALLOW
+
+        # One strike per window, at its first update over the limit
+        if not state.add(f"{prefix}:strike:{index}", '1', ttl=window):
+            return DROP
+        strikes = state.incr(f"{prefix}:strikes", ttl=settings.FLOOD_STRIKE_HOURS * 3600)
+        if block_after and strikes >= block_after:
+            state.set(blocked_key(bot.id, update.chat_id), '1', ttl=settings.FLOOD_BLOCK_HOURS * 3600)
+            return BLOCK
+        return WARN if strikes == 1 else DROP
+    except SharedStateError as e:
+        # Without shared state there is no limit rather than no service
+        logger.warning(f"Flood check skipped: {e}")
+        return ALLOW
+
+
+def send_flood_warning(bot, chat_id: int) -> None:
+    """Queue the bot's slow-down reply (at most one per strike period)"""
+    from .models import OutgoingMessage
+
+    if not bot.flood_warning_text:
+        return
+    OutgoingMessage.objects.bulk_create(
+        [OutgoingMessage(
+            bot=bot,
+            chat_id=chat_id,
+            payload={'text': bot.flood_warning_text},
+            idempotency_key=f"flood:{bot.id}:{chat_id}:{int(time.time() // 3600)}",
+        )],
+        ignore_conflicts=True,
+    )
+
+
+def unblock(bot_id, chat_id: int) -> None:
+    """Let a flood-blocked user's updates through again"""
+    state = get_shared_state()
+    state.delete(blocked_key(bot_id, chat_id))
+    state.delete(f"flood:{bot_id}:{chat_id}:strikes")
+
+
+def handle_flood(bot, update) -> bool:
+    """
+    Apply flood protection to an incoming update
+
+    Returns:
+        True if the update must be dropped
+    """
+    from .db_writer import write
+
+    action = check_flood(bot, update)
+    if action == ALLOW:
+        return False
+    metrics.FLOOD_UPDATES.inc((bot.bot_type, action))
+    if action == WARN:
+        write(send_flood_warning, bot, update.chat_id)
+    elif action == BLOCK:
+        logger.warning(event('flood_user_blocked', bot_id=bot.id, chat_id=update.chat_id))
+    return True
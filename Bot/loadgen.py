@@ -0,0 +1,138 @@
+"""
+Synthetic Telegram update streams for load tests
+
+Generates realistic webhook payloads: every chat starts with /start, then
+sends a mix of free text, menu/survey answers, commands, shared contacts,
+media, stickers and locations, the way real users of the different bot types do.
+"""
+from typing import Dict, Iterator, List, Tuple
+import random
+import time
+
+
+TEXTS = [
+    'hello', 'hi there', 'I need help with my order', 'where is my package?',
+    'thanks!', 'how does this work?', 'can I talk to a human', 'ok',
+]
+
+# Menu choices, survey scores and yes/no answers
+ANSWERS = ['1', '2', '3', '4', '5', 'yes', 'no']
+
+COMMANDS = ['/start', '/help', '/menu', '/register']
+
+# (kind, weight) for every update after the first /start of a chat
+UPDATE_MIX = [
+    ('text', 40),
+    ('answer', 30),
+    ('command', 12),
+    ('contact', 10),
+    ('photo', 5),
+    ('document', 3),
+    ('sticker', 2),
+    ('location', 1),
+]
+
+
+class ChatState:
+    __slots__ = ('chat_id', 'user', 'message_id', 'started', 'contact_shared')
+
+    def __init__(self, chat_id: int, user: dict):
+        self.chat_id = chat_id
+        self.user = user
+        self.message_id = 0
+        self.started = False
+        self.contact_shared = False
+
+
+class UpdateGenerator:
+    """Endless, reproducible stream of (bot, update) pairs over many chats"""
+
+    def __init__(self, bots: List, chats_per_bot: int = 50, seed: int = 0):
+        """
+        Args:
+            bots: TelegramBot model instances receiving the updates
+            chats_per_bot: Number of distinct users talking to each bot
+            seed: Random seed, the same seed generates the same stream
+        """
+        self.bots = bots
+        self.random = random.Random(seed)
+        self.update_ids = {bot.id: 0 for bot in bots}
+        self.chats = {
+            bot.id: [self.new_chat(index, chat) for chat in range(chats_per_bot)]
+            for index, bot in enumerate(bots)
+        }
+        self.kinds = [kind for kind, weight in UPDATE_MIX]
+        self.weights = [weight for kind, weight in UPDATE_MIX]
+
+    def new_chat(self, bot_index: int, chat: int) -> ChatState:
+        chat_id = 10_000_000 + bot_index * 100_000 + chat
+        user = {
+            'id': chat_id,
+            'is_bot': False,
+            'first_name': self.random.choice(['Ali', 'Sara', 'Reza', 'Mina', 'John', 'Anna']),
+            'username': f'user{chat_id}',
+            'language_code': self.random.choice(['en', 'fa', 'de']),
+        }
+        return ChatState(chat_id, user)
+
+    def __iter__(self) -> Iterator[Tuple[object, Dict]]:
+        while True:
+            yield self.next_update()
+
+    def next_update(self) -> Tuple[object, Dict]:
+        bot = self.random.choice(self.bots)
+        chat = self.random.choice(self.chats[bot.id])
+        self.update_ids[bot.id] += 1
+        chat.message_id += 1
+
+        message = {
+            'message_id': chat.message_id,
+            'from': chat.user,
+            'chat': {'id': chat.chat_id, 'type': 'private', 'first_name': chat.user['first_name']},
+            'date': int(time.time()),
+        }
+        message.update(self.message_content(chat))
+
+        return bot, {'update_id': self.update_ids[bot.id], 'message': message}
+
+    def message_content(self, chat: ChatState) -> Dict:
+        if not chat.started:
+            chat.started = True
+            return command('/start')
+
+        kind = self.random.choices(self.kinds, self.weights)[0]
+        if kind == 'contact' and chat.contact_shared:
+            kind = 'answer'
+
+        if kind == 'text':
+            return {'text': self.random.choice(TEXTS)}
+        if kind == 'answer':
+            return {'text': self.random.choice(ANSWERS)}
+        if kind == 'command':
+            return command(self.random.choice(COMMANDS))
+        if kind == 'contact':
+            chat.contact_shared = True
+            return {'contact': {
+                'phone_number': f'98912{chat.chat_id % 10_000_000:07d}',
+                'first_name': chat.user['first_name'],
+                'user_id': chat.user['id'],
+            }}
+        if kind == 'photo':
+            file_id = f'photo-{chat.chat_id}-{chat.message_id}'
+            return {'photo': [
+                {'file_id': f'{file_id}-s', 'file_unique_id': f'{file_id}-s', 'width': 90, 'height': 90},
+                {'file_id': file_id, 'file_unique_id': file_id, 'width': 1280, 'height': 1280},
+            ]}
+        if kind == 'sticker':
+            file_id = f'sticker-{chat.chat_id}-{chat.message_id}'
+            return {'sticker': {'file_id': file_id, 'file_unique_id': file_id, 'width': 512, 'height': 512,
+                                'is_animated': False, 'is_video': False, 'type': 'regular', 'emoji': '👍'}}
+        if kind == 'location':
+            return {'location': {'latitude': round(self.random.uniform(25, 40), 6),
+                                 'longitude': round(self.random.uniform(44, 63), 6)}}
+        file_id = f'document-{chat.chat_id}-{chat.message_id}'
+        return {'document': {'file_id': file_id, 'file_unique_id': file_id, 'file_name': 'invoice.pdf'}}
+
+
+def command(text: str) -> Dict:
+    return {'text': text, 'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]}
@@ -0,0 +1,193 @@
+"""
+Non-blocking structured logging
+
+- ``QueueHandler`` only puts records on a queue; the real handlers (console,
+  files) run on a background QueueListener thread. It does not pre-format
+  the record, so building the message also happens on that thread.
+- ``event()`` builds a key-value record that is rendered lazily, e.g.
+  ``logger.info(event('webhook_update', bot_id=bot.id, update=update_data))``
+- ``SamplingFilter`` drops a share of low-level records, per bot if wanted
+- ``RedactionFilter`` masks sensitive fields (phone numbers, message text)
+
+All of it is wired up in ``LOGGING`` (MAIN/settings.py); listeners are
+started in BotConfig.ready() and restarted in forked worker processes.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import threading
+
+
+class Event:
+    """Structured log message: an event name plus fields, rendered on demand"""
+    __slots__ = ('name', 'fields')
+
+    def __init__(self, name: str, fields: dict):
+        self.name = name
+        self.fields = fields
+
+    def __str__(self) -> str:
+        parts = [self.name]
+        for key, value in self.fields.items():
+            if isinstance(value, (dict, list, tuple)):
+                value = json.dumps(value, default=str, ensure_ascii=False)
+            else:
+                value = str(value)
+                if not value or ' ' in value or '"' in value:
+                    value = json.dumps(value, ensure_ascii=False)
+            parts.append(f'{key}={value}')
+        return ' '.join(parts)
+
+
+def event(name: str, **fields) -> Event:
+    """Structured log message, e.g. ``logger.info(event('task_done', task=task.pk))``"""
+    return Event(name, fields)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread untouched"""
+
+    def prepare(self, record):
+        # The stdlib version formats the message here, on the request thread.
+        # Records only travel to a thread of this process, so they can be
+        # enqueued as they are.
+        return record
+
+
+def iter_queue_handlers():
+    seen = set()
+    loggers = [logging.getLogger()] + [
+        logger for logger in logging.Logger.manager.loggerDict.values()
+        if isinstance(logger, logging.Logger)
+    ]
+    for logger in loggers:
+        for handler in logger.handlers:
+            if isinstance(handler, logging.handlers.QueueHandler) and id(handler) not in seen:
+                seen.add(id(handler))
+                yield handler
+
+
+_started_pid = None
+_start_lock = threading.Lock()
+
+
+def start_listeners() -> None:
+    """Start the listener threads of all configured queue handlers (once per process)"""
+    global _started_pid
+
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        for handler in iter_queue_handlers():
+            listener = getattr(handler, 'listener', None)
+            if listener is not None:
+                listener.start()
+        _started_pid = os.getpid()
+
+
+def stop_listeners() -> None:
+    """Flush queued records and stop the listener threads"""
+    global _started_pid
+
+    with _start_lock:
+        if _started_pid != os.getpid():
+            return
+        for handler in iter_queue_handlers():
+            listener = getattr(handler, 'listener', None)
+            if listener is not None and listener._thread is not None:
+                listener.stop()
+        _started_pid = None
+
+
+def _after_fork_in_child() -> None:
+    # The listener thread does not survive fork() and the queue's lock may
+    # have been held by it; give the child fresh queues and threads
+    global _started_pid
+
+    if _started_pid is None:
+        return
+    for handler in iter_queue_handlers():
+        handler.queue = queue.Queue()
+        listener = getattr(handler, 'listener', None)
+        if listener is not None:
+            listener.queue = handler.queue
+            listener._thread = None
+    _started_pid = None
+    start_listeners()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a share of records below ``max_level``
+
+    Args:
+        rate: Share of records kept (0..1)
+        bot_rates: Per-bot rates, keyed by the ``bot_id`` field of event() records
+        max_level: Records at this level or above are always kept
+    """
+
+    def __init__(self, rate: float = 1.0, bot_rates: dict = None, max_level: str = 'WARNING'):
+        super().__init__()
+        self.rate = rate
+        self.bot_rates = {str(bot_id): bot_rate for bot_id, bot_rate in (bot_rates or {}).items()}
+        self.max_level = logging._checkLevel(max_level)
+
+    def filter(self, record) -> bool:
+        if record.levelno >= self.max_level:
+            return True
+
+        rate = self.rate
+        if self.bot_rates and isinstance(record.msg, Event):
+            bot_id = record.msg.fields.get('bot_id')
+            if bot_id is not None:
+                rate = self.bot_rates.get(str(bot_id), rate)
+
+        return rate >= 1 or random.random() < rate
+
+
+# International numbers in free text, e.g. "+98 912 123 4567"
+PHONE_PATTERN = re.compile(r'\+\d[\d\s().-]{6,}\d')
+
+
+class RedactionFilter(logging.Filter):
+    """
+    Mask sensitive fields before records are written
+
+    event() fields (and nested dicts, such as a whole update) whose key is in
+    ``fields`` are replaced by ``mask``. Plain string messages get phone
+    numbers masked when ``redact_phone_numbers`` is on.
+    """
+
+    def __init__(self, fields=('phone_number', 'text', 'caption'), mask: str = '[redacted]',
+                 redact_phone_numbers: bool = True):
+        super().__init__()
+        self.fields = frozenset(fields)
+        self.mask = mask
+        self.redact_phone_numbers = redact_phone_numbers
+
+    def redact(self, value):
+        if isinstance(value, dict):
+            return {
+                key: self.mask if key in self.fields and item not in (None, '') else self.redact(item)
+                for key, item in value.items()
+            }
+        if isinstance(value, (list, tuple)):
+            return [self.redact(item) for item in value]
+        return value
+
+    def filter(self, record) -> bool:
+        if isinstance(record.msg, Event):
+            record.msg = Event(record.msg.name, self.redact(record.msg.fields))
+        elif self.redact_phone_numbers:
+            message = record.getMessage()
+            redacted = PHONE_PATTERN.sub(self.mask, message)
+            if redacted != message:
+                record.msg, record.args = redacted, None
+        return True
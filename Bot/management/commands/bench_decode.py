@@ -0,0 +1,110 @@
+"""
+Benchmark webhook update decoding
+
+Compares ``Bot.updates.decode_update`` with the previous parse (json.loads
+followed by the if/elif message classification chain) on a synthetic
+update stream, and checks that both agree wherever the old chain knew the
+message type.
+"""
+from statistics import median
+import json
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Bot.loadgen import UpdateGenerator
+from Bot.updates import decode_update
+
+
+class Command(BaseCommand):
+    help = 'Benchmark webhook update decoding against the previous json.loads + if/elif parse'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--updates', type=int, default=10000, help='Update bodies per run')
+        parser.add_argument('--repeat', type=int, default=7, help='Timed runs; the median is reported')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        bots = [FakeBot()]
+        generator = UpdateGenerator(bots, chats_per_bot=100, seed=options['seed'])
+        bodies = [json.dumps(generator.next_update()[1]).encode() for _ in range(options['updates'])]
+
+        mismatches = 0
+        for body in bodies:
+            before, after = legacy_parse(body), classify(decode_update(body))
+            # The old chain reported stickers and locations as text
+            if before != after and after[0] not in ('sticker', 'location'):
+                mismatches += 1
+        if mismatches:
+            raise CommandError(f'{mismatches} update(s) classified differently')
+
+        results = {
+            'json.loads + if/elif': self.time_runs(legacy_parse, bodies, options['repeat']),
+            'decode_update': self.time_runs(lambda body: classify(decode_update(body)), bodies, options['repeat']),
+        }
+
+        baseline = results['json.loads + if/elif']
+        self.stdout.write(f'{"parser":<24}{"µs/update":>12}{"speedup":>10}')
+        for name, seconds in results.items():
+            self.stdout.write(
+                f'{name:<24}{seconds / len(bodies) * 1e6:>12.2f}{baseline / seconds:>9.2f}x'
+            )
+
+    def time_runs(self, parse, bodies, repeat: int) -> float:
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for body in bodies:
+                parse(body)
+            timings.append(time.perf_counter() - started)
+        return median(timings)
+
+
+class FakeBot:
+    """UpdateGenerator only needs an id"""
+
+    def __init__(self):
+        self.id = uuid.uuid4()
+
+
+def classify(update):
+    incoming = update.message
+    if incoming is None:
+        return None
+    return incoming.message_type, incoming.file_id, incoming.chat_id
+
+
+def legacy_parse(body):
+    """The webhook's parse before Bot.updates, kept for comparison"""
+    update_data = json.loads(body)
+    message = update_data.get('message')
+    if not message:
+        return None
+
+    chat_id = message.get('chat', {}).get('id')
+    if not chat_id:
+        return None
+
+    message_type = 'text'
+    file_url = None
+
+    if 'contact' in message:
+        message_type = 'contact'
+    elif 'photo' in message:
+        message_type = 'photo'
+        file_url = message['photo'][-1].get('file_id') if message['photo'] else None
+    elif 'video' in message:
+        message_type = 'video'
+        file_url = message['video'].get('file_id')
+    elif 'document' in message:
+        message_type = 'document'
+        file_url = message['document'].get('file_id')
+    elif 'audio' in message:
+        message_type = 'audio'
+        file_url = message['audio'].get('file_id')
+    elif 'voice' in message:
+        message_type = 'voice'
+        file_url = message['voice'].get('file_id')
+
+    return message_type, file_url, chat_id
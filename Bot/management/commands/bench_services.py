@@ -0,0 +1,252 @@
+"""
+Microbenchmarks for the bot services and the service factory
+
+Drives every service class through a scripted conversation against an
+in-memory Telegram client and an in-memory SQLite test database, and
+records per step: median wall time, memory allocated (tracemalloc peak)
+and database queries. Results can be saved as a JSON baseline and later
+runs compared against it to catch regressions in BaseBotService or the
+per-type services.
+"""
+from statistics import median
+import asyncio
+import json
+import logging
+import os
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+
+# Service -> (bot type, scripted conversation). A step is (kind, value),
+# kind 'text' sends a message, 'contact' shares a phone number and
+# 'callback' presses an inline keyboard button with that callback data.
+SCRIPTS = {
+    'SimpleBotService': ('simple', [
+        ('text', '/start'),
+        ('text', 'hello'),
+        ('text', '/help'),
+        ('text', 'how are you?'),
+    ]),
+    'RegistrationBotService': ('registration', [
+        ('text', '/start'),
+        ('contact', '989121234567'),
+        ('text', 'hello'),
+        ('text', '/start'),
+    ]),
+    'SurveyBotService': ('survey', [
+        ('text', '/start'),
+        ('contact', '989121234567'),
+        ('text', '5'),
+        ('text', 'yes'),
+        ('text', 'great service'),
+    ]),
+    'SupportBotService': ('support', [
+        ('text', '/start'),
+        ('contact', '989121234567'),
+        ('text', '1'),
+        ('text', 'my order has not arrived'),
+        ('text', 'menu'),
+        ('text', '2'),
+        ('text', '3'),
+        ('callback', 'support:4'),
+        ('callback', 'support:menu'),
+    ]),
+    'CustomBotService': ('custom', [
+        ('text', '/start'),
+        ('text', 'Ali'),
+        ('text', 'ali@example.com'),
+        ('text', 'done'),
+        ('text', '/menu'),
+    ]),
+}
+
+CUSTOM_FLOWS = [
+    {
+        'name': 'Benchmark flow',
+        'is_default': True,
+        'flow_data': {'steps': [
+            {'id': 'step1', 'text': "What's your name?", 'next': 'step2'},
+            {'id': 'step2', 'text': "What's your email?", 'save_to': 'email', 'next': 'step3'},
+            {'id': 'step3', 'text': 'Thanks, you are registered!', 'save_to': 'confirmation'},
+        ]},
+    },
+    {
+        'name': 'Benchmark menu',
+        'trigger_command': '/menu',
+        'flow_data': {'type': 'menu', 'text': 'Choose an option:', 'buttons': [
+            {'text': 'Products'}, {'text': 'Orders'}, {'text': 'Support'},
+        ]},
+    },
+]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark bot services (time, allocations, queries per step) and compare against a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50,
+                            help='Conversations run per service (one warm-up run is not counted)')
+        parser.add_argument('--service', nargs='+', choices=list(SCRIPTS), help='Only benchmark these services')
+        parser.add_argument('--save', type=str, metavar='PATH', help='Save the results as a JSON baseline')
+        parser.add_argument('--compare', type=str, metavar='PATH', help='Compare against a saved baseline')
+        parser.add_argument('--threshold', type=float, default=0.20,
+                            help='Relative increase of time or allocations reported as a regression')
+
+    def handle(self, *args, **options):
+        # Services call the ORM from async code, as in the webhook's service thread
+        os.environ['DJANGO_ALLOW_ASYNC_UNSAFE'] = 'true'
+        if options['verbosity'] < 2:
+            logging.getLogger('Bot').setLevel(logging.WARNING)
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = {
+                name: self.bench_service(name, *SCRIPTS[name], options['iterations'])
+                for name in options['service'] or SCRIPTS
+            }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.report(results)
+
+        if options['save']:
+            with open(options['save'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'\nBaseline saved to {options["save"]}'))
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            regressions = self.compare(baseline, results, options['threshold'])
+            if regressions:
+                raise CommandError(f'{regressions} regression(s) against {options["compare"]}')
+            self.stdout.write(self.style.SUCCESS('\nNo regressions'))
+
+    def bench_service(self, name, bot_type, script, iterations) -> dict:
+        from Bot.models import BotFlow, TelegramBot
+
+        bot = TelegramBot.objects.create(
+            name=f'bench-{bot_type}',
+            token=f'bench:{bot_type}',
+            username=f'bench_{bot_type}_bot',
+            bot_type=bot_type,
+            has_get_number=bot_type in ('registration', 'survey', 'support'),
+            auto_setup_webhook=False,
+        )
+        if bot_type == 'custom':
+            for flow in CUSTOM_FLOWS:
+                BotFlow.objects.create(bot=bot, **flow)
+
+        samples = [{'seconds': [], 'bytes': [], 'queries': []} for _ in script]
+        loop = asyncio.new_event_loop()
+        try:
+            # Iteration 0 warms caches; allocation runs are separate so
+            # tracemalloc's overhead does not skew the timings
+            for iteration in range(iterations + 1):
+                self.run_conversation(loop, bot, script, iteration, samples if iteration else None, trace=False)
+            for iteration in range(iterations + 1, 2 * iterations + 1):
+                self.run_conversation(loop, bot, script, iteration, samples, trace=True)
+        finally:
+            loop.close()
+
+        steps = {}
+        for index, ((kind, value), step) in enumerate(zip(script, samples), 1):
+            steps[f'{index} {kind} {value}'] = {
+                'us': median(step['seconds']) * 1e6,
+                'bytes': median(step['bytes']),
+                'queries': median(step['queries']),
+            }
+        return steps
+
+    def run_conversation(self, loop, bot, script, iteration, samples, trace: bool) -> None:
+        from Bot.fake_telegram import InMemoryTelegramClient
+        from Bot.models import BotUser
+        from Bot.services.factory import BotServiceFactory
+
+        bot_user = BotUser.objects.create(bot=bot, chat_id=1_000_000 + iteration, first_name='Bench')
+        client = InMemoryTelegramClient(bot.token)
+        query_count = [0]
+
+        def count_queries(execute, sql, params, many, context):
+            query_count[0] += 1
+            return execute(sql, params, many, context)
+
+        async def run_step(kind, value, update_id):
+            # Installed inside the loop: the ORM uses a separate connection there
+            with connection.execute_wrapper(count_queries):
+                service = BotServiceFactory.create_service(bot, bot_user, update_id=update_id, telegram_client=client)
+                if kind == 'contact':
+                    await service.dispatch('handle_contact', {'phone_number': value})
+                elif kind == 'callback':
+                    await service.dispatch('handle_callback_query', {
+                        'id': str(update_id),
+                        'data': value,
+                        'message': {'message_id': 1, 'chat': {'id': bot_user.chat_id}},
+                    })
+                else:
+                    await service.dispatch('handle_message', {'text': value, 'chat': {'id': bot_user.chat_id}})
+
+        for index, (kind, value) in enumerate(script):
+            query_count[0] = 0
+            if trace:
+                tracemalloc.start()
+
+            started = time.perf_counter()
+            loop.run_until_complete(run_step(kind, value, iteration * 100 + index))
+            elapsed = time.perf_counter() - started
+
+            if samples is None:
+                continue
+            if trace:
+                samples[index]['bytes'].append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+                samples[index]['queries'].append(query_count[0])
+            else:
+                samples[index]['seconds'].append(elapsed)
+
+    def report(self, results: dict) -> None:
+        self.stdout.write(f'{"service / step":<48}{"µs":>10}{"KiB":>10}{"queries":>9}')
+        for name, steps in results.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for step, row in steps.items():
+                self.stdout.write(
+                    f'  {step[:46]:<46}{row["us"]:>10.0f}{row["bytes"] / 1024:>10.1f}{row["queries"]:>9.0f}'
+                )
+
+    def compare(self, baseline: dict, results: dict, threshold: float) -> int:
+        """Print changes against the baseline, returning the number of regressions"""
+        self.stdout.write('')
+        self.stdout.write(f'{"service / step":<48}{"time":>10}{"alloc":>10}{"queries":>12}')
+        regressions = 0
+
+        for name, steps in results.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for step, row in steps.items():
+                before = baseline.get(name, {}).get(step)
+                if before is None:
+                    self.stdout.write(f'  {step[:46]:<46}{"new":>10}')
+                    continue
+
+                time_change = relative_change(before['us'], row['us'])
+                bytes_change = relative_change(before['bytes'], row['bytes'])
+                regressed = (
+                    time_change > threshold or bytes_change > threshold or row['queries'] > before['queries']
+                )
+                regressions += regressed
+
+                line = (
+                    f'  {step[:46]:<46}{time_change:>+10.1%}{bytes_change:>+10.1%}'
+                    f'{before["queries"]:>6.0f} → {row["queries"]:<3.0f}'
+                )
+                self.stdout.write(self.style.ERROR(line) if regressed else line)
+
+        return regressions
+
+
+def relative_change(before: float, after: float) -> float:
+    if not before:
+        return 0.0 if not after else float('inf')
+    return (after - before) / before
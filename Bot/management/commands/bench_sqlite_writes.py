@@ -0,0 +1,138 @@
+"""
+Benchmark sustained webhook write throughput on SQLite
+
+Runs the webhook's write path (request counter, user upsert, incoming
+message insert) from many threads against a scratch database, once with
+the default SQLite configuration and once in SQLite production mode (WAL,
+tuned pragmas, serialized group-commit writer), and prints both results.
+"""
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections
+
+
+MODES = (
+    ('default', '0'),
+    ('production', '1'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Measure sustained webhook writes per second with default vs production SQLite settings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16,
+                            help='Concurrent writer threads (simulated webhook requests)')
+        parser.add_argument('--duration', type=float, default=10.0,
+                            help='Seconds to run each mode')
+        parser.add_argument('--chats', type=int, default=1000,
+                            help='Number of distinct chats updates are spread over')
+        parser.add_argument('--worker', action='store_true',
+                            help='Internal: run one measurement against the configured database')
+
+    def handle(self, *args, **options):
+        if options['worker']:
+            result = self.run_worker(options['threads'], options['duration'], options['chats'])
+            self.stdout.write(json.dumps(result))
+            return
+
+        results = {}
+        for mode, production in MODES:
+            self.stdout.write(f'Running {mode} mode for {options["duration"]:.0f}s...')
+            with tempfile.TemporaryDirectory() as tmp:
+                env = dict(os.environ, SQLITE_PATH=os.path.join(tmp, 'bench.sqlite3'),
+                           SQLITE_PRODUCTION_MODE=production)
+                output = subprocess.run(
+                    [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'bench_sqlite_writes', '--worker',
+                     '--threads', str(options['threads']), '--duration', str(options['duration']),
+                     '--chats', str(options['chats'])],
+                    env=env, capture_output=True, text=True, check=True,
+                ).stdout
+            results[mode] = json.loads(output.strip().splitlines()[-1])
+
+        self.stdout.write('')
+        self.stdout.write(f'{"mode":<12}{"updates/s":>12}{"writes/s":>12}{"p50 ms":>10}{"p99 ms":>10}{"locked":>10}')
+        for mode, result in results.items():
+            self.stdout.write(
+                f'{mode:<12}{result["updates_per_second"]:>12.1f}{result["writes_per_second"]:>12.1f}'
+                f'{result["p50_ms"]:>10.1f}{result["p99_ms"]:>10.1f}{result["locked_errors"]:>10}'
+            )
+
+        before = results['default']['writes_per_second']
+        after = results['production']['writes_per_second']
+        if before:
+            self.stdout.write(self.style.SUCCESS(f'\nSpeedup: {after / before:.1f}x'))
+
+    def run_worker(self, threads, duration, chats):
+        from Bot.db_writer import get_writer, write
+        from Bot.models import TelegramBot
+        from Bot.views import record_incoming_message
+
+        call_command('migrate', verbosity=0)
+        bot = TelegramBot.objects.create(name='bench', token='bench-token', username='bench',
+                                         auto_setup_webhook=False)
+
+        latencies = []
+        errors = []
+        deadline = time.monotonic() + duration
+
+        def simulate_updates(thread_index):
+            rng = random.Random(thread_index)
+            message_id = 0
+            try:
+                while time.monotonic() < deadline:
+                    chat_id = rng.randrange(chats)
+                    message_id += 1
+                    started = time.perf_counter()
+                    try:
+                        write(bot.increment_request_count)
+                        write(
+                            record_incoming_message,
+                            bot, chat_id, {'first_name': f'user{chat_id}'}, 'text', 'hello', None, message_id
+                        )
+                    except OperationalError as e:
+                        errors.append(str(e))
+                        continue
+                    latencies.append(time.perf_counter() - started)
+            finally:
+                close_old_connections()
+
+        started = time.monotonic()
+        workers = [threading.Thread(target=simulate_updates, args=(i,)) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - started
+
+        writer = get_writer()
+        if writer is not None:
+            writer.stop()
+
+        latencies.sort()
+        updates = len(latencies)
+
+        def percentile(p):
+            return latencies[min(updates - 1, int(updates * p))] * 1000 if updates else 0.0
+
+        # Counter update, user upsert (select + insert/update) and message insert
+        writes_per_update = 3
+        return {
+            'updates': updates,
+            'updates_per_second': updates / elapsed,
+            'writes_per_second': updates * writes_per_update / elapsed,
+            'p50_ms': percentile(0.50),
+            'p99_ms': percentile(0.99),
+            'locked_errors': sum('locked' in error for error in errors),
+            'other_errors': sum('locked' not in error for error in errors),
+        }
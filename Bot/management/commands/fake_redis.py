@@ -0,0 +1,31 @@
+"""
+Run the fake Redis server in the foreground
+
+Start it, then run several application processes or nodes with
+SHARED_STATE_URL=redis://127.0.0.1:6380/0 to try a multi-node deployment
+without installing Redis.
+"""
+from django.core.management.base import BaseCommand
+
+from Bot.fake_redis import FakeRedis
+
+
+class Command(BaseCommand):
+    help = 'Serve a local stand-in for Redis, enough for the shared state backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', type=str, default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=6380)
+
+    def handle(self, *args, **options):
+        server = FakeRedis(host=options['host'], port=options['port'])
+        self.stdout.write(self.style.SUCCESS(f'Fake Redis listening on {server.url}'))
+        self.stdout.write(f'Use it with SHARED_STATE_URL={server.url}')
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server.server_close()
+            self.stdout.write(f'Commands served: {server.commands}')
@@ -0,0 +1,45 @@
+"""
+Run the fake Telegram Bot API server in the foreground
+
+Start it, then run the application with
+TELEGRAM_API_BASE_URL=http://127.0.0.1:8081 to load test a real deployment
+(serve + run_outbox + run_bot_tasks) without talking to Telegram.
+"""
+from django.core.management.base import BaseCommand
+
+from Bot.fake_telegram import FakeTelegramAPI
+
+
+class Command(BaseCommand):
+    help = 'Serve a local stand-in for the Telegram Bot API with configurable latency and 429 injection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', type=str, default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8081)
+        parser.add_argument('--latency', type=float, default=0.05, help='Seconds every call takes')
+        parser.add_argument('--jitter', type=float, default=0.0,
+                            help='Extra random latency of up to this many seconds')
+        parser.add_argument('--rate-limit-ratio', type=float, default=0.0,
+                            help='Share of calls answered with 429 Too Many Requests')
+        parser.add_argument('--retry-after', type=int, default=1,
+                            help='retry_after seconds of injected 429 responses')
+
+    def handle(self, *args, **options):
+        api = FakeTelegramAPI(
+            host=options['host'],
+            port=options['port'],
+            latency=options['latency'],
+            jitter=options['jitter'],
+            rate_limit_ratio=options['rate_limit_ratio'],
+            retry_after=options['retry_after'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Fake Telegram Bot API listening on {api.url}'))
+        self.stdout.write(f'Use it with TELEGRAM_API_BASE_URL={api.url}')
+
+        try:
+            api.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            api.server.server_close()
+            self.stdout.write(f'Calls: {api.stats()}')
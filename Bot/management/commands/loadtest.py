@@ -0,0 +1,308 @@
+"""
+End-to-end load test against a local fake Telegram Bot API
+
+Creates bots of every type in a scratch database, lets the task worker
+register their webhooks with the fake Bot API, then posts a synthetic
+update stream to /api/webhook/{bot_id} from concurrent clients (each
+chat's updates stay in order) while the outbox worker delivers the replies.
+Reports throughput, latency percentiles, error rates and DB queries per
+update for each bot type.
+"""
+from collections import defaultdict
+import json
+import logging
+import queue
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from Bot import metrics
+from Bot.fake_telegram import FakeTelegramAPI
+from Bot.loadgen import UpdateGenerator
+
+
+# Bot types that ask for a phone number before their main flow
+PHONE_BOT_TYPES = ('registration', 'survey', 'support')
+
+CUSTOM_FLOWS = [
+    {
+        'name': 'Load test flow',
+        'is_default': True,
+        'flow_data': {'steps': [
+            {'id': 'step1', 'text': "What's your name?", 'next': 'step2'},
+            {'id': 'step2', 'text': "What's your email?", 'save_to': 'email', 'next': 'step3'},
+            {'id': 'step3', 'text': 'Thanks, you are registered!', 'save_to': 'confirmation'},
+        ]},
+    },
+    {
+        'name': 'Load test menu',
+        'trigger_command': '/menu',
+        'flow_data': {'type': 'menu', 'text': 'Choose an option:', 'buttons': [
+            {'text': 'Products'}, {'text': 'Orders'}, {'text': 'Support'},
+        ]},
+    },
+]
+
+
+class Command(BaseCommand):
+    help = 'Load test the webhook pipeline end to end against a local fake Telegram Bot API'
+
+    def add_arguments(self, parser):
+        from Bot.models import TelegramBot
+
+        parser.add_argument('--bot-types', nargs='+', default=[choice for choice, label in TelegramBot.BOT_TYPE_CHOICES],
+                            help='Bot types to create (default: all)')
+        parser.add_argument('--bots-per-type', type=int, default=1)
+        parser.add_argument('--chats', type=int, default=50, help='Distinct chats per bot')
+        parser.add_argument('--updates', type=int, default=2000, help='Total number of updates to post')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent webhook clients')
+        parser.add_argument('--api-latency', type=float, default=0.05,
+                            help='Seconds the fake Bot API takes per call')
+        parser.add_argument('--api-jitter', type=float, default=0.0,
+                            help='Extra random Bot API latency of up to this many seconds')
+        parser.add_argument('--rate-limit-ratio', type=float, default=0.0,
+                            help='Share of Bot API calls answered with 429 Too Many Requests')
+        parser.add_argument('--retry-after', type=int, default=1,
+                            help='retry_after seconds of injected 429 responses')
+        parser.add_argument('--no-deliver', action='store_true',
+                            help='Do not run the outbox worker (replies stay queued)')
+        parser.add_argument('--drain-timeout', type=float, default=60.0,
+                            help='Seconds to wait for queued tasks and replies to be delivered')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', action='store_true', help='Print the result as JSON')
+
+    def handle(self, *args, **options):
+        if options['verbosity'] < 2:
+            # Per-update INFO logs would dominate the measurement
+            logging.getLogger('Bot').setLevel(logging.WARNING)
+
+        api = FakeTelegramAPI(
+            latency=options['api_latency'],
+            jitter=options['api_jitter'],
+            rate_limit_ratio=options['rate_limit_ratio'],
+            retry_after=options['retry_after'],
+        ).start()
+
+        settings.TELEGRAM_API_BASE_URL = api.url
+        settings.ALLOWED_HOSTS = list(settings.ALLOWED_HOSTS) + ['testserver']
+        if not settings.BASE_URL:
+            settings.BASE_URL = 'https://loadtest.invalid'
+
+        with tempfile.TemporaryDirectory() as tmp:
+            old_name = self.setup_database(tmp)
+            try:
+                bots = self.create_bots(options['bot_types'], options['bots_per_type'])
+                tasks = self.run_bot_tasks(options['drain_timeout'])
+                result = self.run_load(bots, options)
+            finally:
+                connections['default'].creation.destroy_test_db(old_name, verbosity=0)
+                api.stop()
+
+        result['bot_tasks'] = tasks
+        result['fake_api'] = api.stats()
+
+        if options['json']:
+            self.stdout.write(json.dumps(result, indent=2))
+        else:
+            self.report(result)
+
+    def setup_database(self, tmp: str) -> str:
+        """Switch to a freshly migrated scratch database, returning the old name"""
+        connection = connections['default']
+        if connection.vendor == 'sqlite':
+            # On disk rather than in memory so every thread sees the same database
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = f'{tmp}/loadtest.sqlite3'
+        self.stdout.write('Creating scratch database...')
+        return connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+    def create_bots(self, bot_types, bots_per_type):
+        from Bot.models import BotFlow, TelegramBot
+
+        bots = []
+        for bot_type in bot_types:
+            for index in range(bots_per_type):
+                # username left empty and auto setup on: the task worker calls getMe and setWebhook
+                bot = TelegramBot.objects.create(
+                    name=f'loadtest-{bot_type}-{index}',
+                    token=f'{100000 + len(bots)}:loadtest-{bot_type}-{index}',
+                    bot_type=bot_type,
+                    has_get_number=bot_type in PHONE_BOT_TYPES,
+                    auto_setup_webhook=True,
+                )
+                if bot_type in ('custom', 'ecommerce'):
+                    for flow in CUSTOM_FLOWS:
+                        BotFlow.objects.create(bot=bot, **flow)
+                bots.append(bot)
+        return bots
+
+    def run_bot_tasks(self, timeout: float) -> dict:
+        """Run webhook/username setup against the fake API until it converges"""
+        from Bot.models import BotTask
+        from Bot.tasks import process_due_tasks
+
+        self.stdout.write('Registering webhooks with the fake Bot API...')
+        deadline = time.monotonic() + timeout
+        while BotTask.objects.filter(status__in=['pending', 'running']).exists() and time.monotonic() < deadline:
+            if not process_due_tasks(limit=100, concurrency=10):
+                time.sleep(0.2)
+
+        return {
+            status: BotTask.objects.filter(status=status).count()
+            for status in ('done', 'failed', 'pending')
+        }
+
+    def run_load(self, bots, options) -> dict:
+        from django.test import Client
+        from Bot.models import OutgoingMessage
+        from Bot.outbox import process_outbox
+
+        concurrency = max(1, options['concurrency'])
+        generator = UpdateGenerator(bots, chats_per_bot=options['chats'], seed=options['seed'])
+
+        # One queue per client; a chat always goes to the same client so its updates stay ordered
+        queues = [queue.SimpleQueue() for _ in range(concurrency)]
+        for _ in range(options['updates']):
+            bot, update = generator.next_update()
+            chat_id = update['message']['chat']['id']
+            queues[hash((bot.id, chat_id)) % concurrency].put((bot, update))
+        for client_queue in queues:
+            client_queue.put(None)
+
+        samples = defaultdict(list)
+        errors = defaultdict(int)
+        lock = threading.Lock()
+
+        def post_updates(client_queue):
+            client = Client()
+            try:
+                while True:
+                    item = client_queue.get()
+                    if item is None:
+                        return
+                    bot, update = item
+                    started = time.perf_counter()
+                    response = client.post(
+                        f'/api/webhook/{bot.id}', data=json.dumps(update), content_type='application/json',
+                        HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN=bot.webhook_secret,
+                    )
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        samples[bot.bot_type].append(elapsed)
+                        if response.status_code != 200:
+                            errors[bot.bot_type] += 1
+            finally:
+                close_old_connections()
+
+        load_done = threading.Event()
+        delivered = threading.Event()
+
+        def deliver_replies():
+            deadline = None
+            try:
+                while True:
+                    if load_done.is_set():
+                        deadline = deadline or time.monotonic() + options['drain_timeout']
+                        if time.monotonic() > deadline or not OutgoingMessage.objects.filter(
+                            status__in=['pending', 'sending']
+                        ).exists():
+                            return
+                    if not process_outbox(limit=100, concurrency=10):
+                        time.sleep(0.05)
+            finally:
+                close_old_connections()
+                delivered.set()
+
+        queries_before = metrics.UPDATE_DB_QUERIES.collect()
+        self.stdout.write(f'Posting {options["updates"]} updates with {concurrency} client(s)...')
+
+        if not options['no_deliver']:
+            threading.Thread(target=deliver_replies, daemon=True).start()
+
+        started = time.perf_counter()
+        clients = [threading.Thread(target=post_updates, args=(client_queue,)) for client_queue in queues]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.perf_counter() - started
+
+        load_done.set()
+        if not options['no_deliver']:
+            self.stdout.write('Delivering queued replies...')
+            delivered.wait()
+
+        queries_after = metrics.UPDATE_DB_QUERIES.collect()
+
+        by_type = {}
+        for bot_type, latencies in sorted(samples.items()):
+            before = queries_before.get((bot_type,))
+            after = queries_after.get((bot_type,))
+            query_sum = after[-2] - (before[-2] if before else 0) if after else 0
+            query_count = after[-1] - (before[-1] if before else 0) if after else 0
+            by_type[bot_type] = {
+                'updates': len(latencies),
+                'errors': errors[bot_type],
+                'error_rate': errors[bot_type] / len(latencies),
+                'p50_ms': percentile(latencies, 0.50),
+                'p95_ms': percentile(latencies, 0.95),
+                'p99_ms': percentile(latencies, 0.99),
+                'queries_per_update': query_sum / query_count if query_count else 0.0,
+            }
+
+        all_latencies = [latency for latencies in samples.values() for latency in latencies]
+        return {
+            'updates': len(all_latencies),
+            'seconds': elapsed,
+            'updates_per_second': len(all_latencies) / elapsed if elapsed else 0.0,
+            'errors': sum(errors.values()),
+            'p50_ms': percentile(all_latencies, 0.50),
+            'p95_ms': percentile(all_latencies, 0.95),
+            'p99_ms': percentile(all_latencies, 0.99),
+            'by_bot_type': by_type,
+            'outbox': {
+                status: OutgoingMessage.objects.filter(status=status).count()
+                for status in ('sent', 'failed', 'pending', 'sending')
+            },
+        }
+
+    def report(self, result: dict) -> None:
+        self.stdout.write('')
+        self.stdout.write(
+            f'{"bot type":<14}{"updates":>9}{"errors":>8}{"err %":>8}{"p50 ms":>9}{"p95 ms":>9}'
+            f'{"p99 ms":>9}{"queries":>9}'
+        )
+        for bot_type, row in result['by_bot_type'].items():
+            self.stdout.write(
+                f'{bot_type:<14}{row["updates"]:>9}{row["errors"]:>8}{row["error_rate"] * 100:>8.1f}'
+                f'{row["p50_ms"]:>9.1f}{row["p95_ms"]:>9.1f}{row["p99_ms"]:>9.1f}{row["queries_per_update"]:>9.1f}'
+            )
+        self.stdout.write(
+            f'{"total":<14}{result["updates"]:>9}{result["errors"]:>8}'
+            f'{(result["errors"] / result["updates"] * 100 if result["updates"] else 0):>8.1f}'
+            f'{result["p50_ms"]:>9.1f}{result["p95_ms"]:>9.1f}{result["p99_ms"]:>9.1f}'
+        )
+
+        self.stdout.write('')
+        self.stdout.write(f'Bot tasks: {result["bot_tasks"]}')
+        self.stdout.write(f'Outbox: {result["outbox"]}')
+        self.stdout.write(f'Fake Bot API calls: {result["fake_api"]["calls"]}')
+        if result['fake_api']['rate_limited']:
+            self.stdout.write(f'Injected 429s: {result["fake_api"]["rate_limited"]}')
+
+        style = self.style.SUCCESS if not result['errors'] else self.style.ERROR
+        self.stdout.write(style(
+            f'\nThroughput: {result["updates_per_second"]:.1f} updates/s '
+            f'({result["updates"]} updates in {result["seconds"]:.1f}s)'
+        ))
+
+
+def percentile(values, p: float) -> float:
+    """p-th percentile of a list of seconds, in milliseconds"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
@@ -0,0 +1,55 @@
+"""
+Move BotMessage rows to the shard their bot maps to (after adding shards or pins)
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from Bot.models import BotMessage
+from Bot.sharding import message_databases, shard_for
+
+# Columns copied; ids are not, they are only unique within one database
+COPIED_FIELDS = [field for field in BotMessage._meta.concrete_fields if not field.primary_key]
+
+
+class Command(BaseCommand):
+    help = "Move message log rows stored outside their bot's shard (primary database included)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Rows copied and deleted per batch')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be moved without writing')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        moved = 0
+        for source in message_databases():
+            bot_ids = BotMessage.objects.using(source).values_list('bot_id', flat=True).distinct()
+            for bot_id in list(bot_ids):
+                target = shard_for(bot_id)
+                if target == source:
+                    continue
+                rows = BotMessage.objects.using(source).filter(bot_id=bot_id)
+                if options['dry_run']:
+                    count = rows.count()
+                else:
+                    count = self.move(rows, target, batch_size)
+                moved += count
+                self.stdout.write(f"Bot {bot_id}: {count} messages {source} -> {target}")
+
+        prefix = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(self.style.SUCCESS(f"{prefix} {moved} messages"))
+
+    def move(self, rows, target: str, batch_size: int) -> int:
+        """Copy rows to the target database in batches, deleting each batch once copied"""
+        moved = 0
+        while True:
+            batch = list(rows.order_by('id')[:batch_size])
+            if not batch:
+                return moved
+            with transaction.atomic(using=target):
+                # A raw insert, like loaddata: created_at is kept rather than set to now
+                BotMessage.objects._insert(batch, fields=COPIED_FIELDS, raw=True, using=target)
+            # A crash between the two leaves a batch in both; never in neither
+            rows.filter(id__in=[message.id for message in batch]).delete()
+            moved += len(batch)
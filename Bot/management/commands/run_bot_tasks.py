@@ -0,0 +1,51 @@
+"""
+Worker executing queued bot side effects (webhook setup, username fetch)
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from Bot import metrics
+from Bot.tasks import process_due_tasks
+
+
+class Command(BaseCommand):
+    help = 'Run the background worker for queued bot tasks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Process currently due tasks and exit')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Seconds to sleep when no task is due')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Maximum number of tasks claimed per batch')
+        parser.add_argument('--concurrency', type=int, default=5,
+                            help='Maximum number of concurrent Telegram API calls')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Bot task worker started')
+
+        concurrency = max(1, options['concurrency'])
+        metrics.WORKER_CAPACITY.inc(('bot_tasks',), concurrency)
+        metrics.start_exporter()
+
+        try:
+            while True:
+                close_old_connections()
+                processed = process_due_tasks(
+                    limit=options['batch_size'],
+                    concurrency=concurrency,
+                )
+                if processed:
+                    self.stdout.write(f'Processed {processed} task(s)')
+
+                if options['once']:
+                    if not processed:
+                        break
+                    continue
+
+                if not processed:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Bot task worker stopped')
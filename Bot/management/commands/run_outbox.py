@@ -0,0 +1,49 @@
+"""
+Worker delivering queued outgoing Telegram messages
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from Bot import metrics
+from Bot.outbox import process_outbox
+
+
+class Command(BaseCommand):
+    help = 'Run the outbound message outbox worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Deliver currently due messages and exit')
+        parser.add_argument('--interval', type=float, default=0.2,
+                            help='Seconds to sleep when no message is due')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Maximum number of messages claimed per batch')
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help='Maximum number of concurrent Telegram API calls')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Outbox worker started')
+
+        concurrency = max(1, options['concurrency'])
+        metrics.WORKER_CAPACITY.inc(('outbox',), concurrency)
+        metrics.start_exporter()
+
+        try:
+            while True:
+                close_old_connections()
+                processed = process_outbox(
+                    limit=options['batch_size'],
+                    concurrency=concurrency,
+                )
+
+                if options['once']:
+                    if not processed:
+                        break
+                    continue
+
+                if not processed:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Outbox worker stopped')
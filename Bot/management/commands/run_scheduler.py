@@ -0,0 +1,52 @@
+"""
+Worker firing scheduled bot messages into the outbox
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from Bot import metrics
+from Bot.scheduler import Scheduler
+
+
+class Command(BaseCommand):
+    help = 'Run the scheduled message worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Fire currently due jobs and exit')
+        parser.add_argument('--tick', type=float, default=1.0,
+                            help='Timer resolution in seconds')
+        parser.add_argument('--horizon', type=float, default=3600,
+                            help='Seconds ahead whose jobs are held in memory')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Maximum number of jobs read or fired per query')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Scheduler worker started')
+
+        scheduler = Scheduler(
+            tick=options['tick'],
+            horizon=options['horizon'],
+            batch_size=options['batch_size'],
+        )
+        metrics.start_exporter()
+
+        try:
+            while True:
+                close_old_connections()
+                if options['once']:
+                    # Let the wheel reach jobs due in the current tick
+                    time.sleep(options['tick'])
+                result = scheduler.run_once()
+                if result['due']:
+                    self.stdout.write(
+                        f"Fired {result['due']} jobs: {result['sent']} sent, {result['skipped']} skipped"
+                    )
+
+                if options['once']:
+                    break
+                time.sleep(options['tick'])
+        except KeyboardInterrupt:
+            self.stdout.write('Scheduler worker stopped')
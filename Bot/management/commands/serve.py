@@ -0,0 +1,230 @@
+"""
+Production server: pre-forked uvicorn workers serving MAIN.asgi
+
+The parent process sets up Django, warms caches, freezes the GC heap and
+binds the listening socket once; workers are forked from it so they share
+the preloaded memory copy-on-write. SIGTERM/SIGINT drain gracefully: every
+worker stops accepting connections, finishes in-flight updates (up to the
+graceful timeout), flushes pending background writes and exits. Updates
+still waiting for admission are answered 503 right away, so Telegram
+redelivers them to a live worker instead of the drain waiting for them.
+"""
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+import uvicorn
+
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server that stops admitting webhook updates as soon as it starts shutting down"""
+
+    def handle_exit(self, sig, frame):
+        from Bot.admission import get_controller
+
+        get_controller().close()
+        super().handle_exit(sig, frame)
+
+
+class Command(BaseCommand):
+    help = 'Serve the ASGI application with multiple pre-forked uvicorn worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', type=str, default='0.0.0.0')
+        parser.add_argument('--port', type=int, default=8000)
+        parser.add_argument('--workers', type=int,
+                            default=int(os.getenv('WEB_CONCURRENCY', os.cpu_count() or 1)),
+                            help='Number of worker processes (default: $WEB_CONCURRENCY or CPU count)')
+        parser.add_argument('--backlog', type=int, default=2048,
+                            help='Maximum number of pending connections on the listening socket')
+        parser.add_argument('--timeout-keep-alive', type=int, default=5,
+                            help='Seconds to keep idle HTTP keep-alive connections open')
+        parser.add_argument('--graceful-timeout', type=int, default=30,
+                            help='Seconds a worker may spend finishing in-flight requests on shutdown')
+        parser.add_argument('--limit-concurrency', type=int, default=None,
+                            help='Maximum concurrent connections per worker before returning 503')
+        parser.add_argument('--log-level', type=str, default='info')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.shutting_down = False
+        self.children = {}
+
+        application = self.preload()
+
+        self.config = uvicorn.Config(
+            application,
+            lifespan='off',
+            backlog=options['backlog'],
+            timeout_keep_alive=options['timeout_keep_alive'],
+            timeout_graceful_shutdown=options['graceful_timeout'],
+            limit_concurrency=options['limit_concurrency'],
+            log_level=options['log_level'],
+            access_log=False,
+        )
+        self.sock = self.bind_socket()
+        self.reset_metrics_dir()
+
+        # Nothing allocated so far will be collected; keep it out of the
+        # GC's reach so workers never write to (and un-share) those pages
+        gc.collect()
+        gc.freeze()
+
+        self.stdout.write(
+            f"Serving MAIN.asgi on {options['host']}:{options['port']} "
+            f"with {options['workers']} worker(s) (pid {os.getpid()})"
+        )
+        self.stdout.flush()
+
+        signal.signal(signal.SIGTERM, self.handle_shutdown)
+        signal.signal(signal.SIGINT, self.handle_shutdown)
+
+        for _ in range(max(1, options['workers'])):
+            self.spawn_worker()
+
+        self.supervise()
+
+    def preload(self):
+        """Import the application and warm caches shared by all workers"""
+        from django.urls import get_resolver
+        from MAIN.asgi import application
+        from Bot.services.factory import BotServiceFactory
+
+        # Build URL patterns and the API routers
+        get_resolver().url_patterns
+
+        # Service classes are imported lazily; import them all here so
+        # workers share them instead of each importing on its first update
+        for bot_type in BotServiceFactory.get_available_types():
+            BotServiceFactory.get_service_class(bot_type)
+
+        # Connections must never be shared across fork()
+        connections.close_all()
+
+        return application
+
+    def reset_metrics_dir(self) -> None:
+        """Drop metric snapshots left by a previous server run"""
+        from django.conf import settings
+
+        directory = getattr(settings, 'METRICS_MULTIPROCESS_DIR', None)
+        if not directory or not os.path.isdir(directory):
+            return
+        for filename in os.listdir(directory):
+            if filename.endswith('.json'):
+                os.remove(os.path.join(directory, filename))
+
+    def bind_socket(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET6 if ':' in self.options['host'] else socket.AF_INET)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.options['host'], self.options['port']))
+        sock.listen(self.options['backlog'])
+        sock.set_inheritable(True)
+        return sock
+
+    def spawn_worker(self) -> None:
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.monotonic()
+            return
+
+        # Worker process
+        exit_code = 0
+        try:
+            self.run_worker()
+        except BaseException:
+            exit_code = 1
+            # os._exit skips the logging shutdown, so write the reason straight to stderr
+            sys.stderr.write(f"Worker {os.getpid()} crashed:\n")
+            traceback.print_exc()
+            sys.stderr.flush()
+        finally:
+            os._exit(exit_code)
+
+    def run_worker(self) -> None:
+        # uvicorn installs its own SIGTERM/SIGINT handlers for graceful
+        # shutdown and re-raises the signal afterwards; ignore the re-raise
+        # so the drain below still runs
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        from Bot import metrics
+        metrics.start_exporter()
+
+        server = DrainingServer(self.config)
+        server.run(sockets=[self.sock])
+
+        self.drain_worker()
+
+    def drain_worker(self) -> None:
+        """Flush in-process background work before the worker exits"""
+        from Bot import metrics
+        from Bot.db_writer import get_writer
+        from Bot.log import stop_listeners
+
+        writer = get_writer()
+        if writer is not None:
+            writer.stop(timeout=self.options['graceful_timeout'])
+
+        connections.close_all()
+
+        # Final snapshot so this worker's counters survive it
+        metrics.write_snapshot()
+
+        # os._exit() skips atexit, flush queued log records explicitly
+        stop_listeners()
+
+    def handle_shutdown(self, signum, frame) -> None:
+        if self.shutting_down:
+            return
+        self.shutting_down = True
+        self.stdout.write(f'Received signal {signum}, draining {len(self.children)} worker(s)...')
+        self.stdout.flush()
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def supervise(self) -> None:
+        """Restart crashed workers; after shutdown, wait for workers to drain"""
+        drain_deadline = None
+
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+
+            if pid:
+                started = self.children.pop(pid, None)
+                if not self.shutting_down and started is not None:
+                    self.stderr.write(f'Worker {pid} exited with status {status}, restarting')
+                    # Avoid a tight respawn loop when workers die on startup
+                    if time.monotonic() - started < 1:
+                        time.sleep(1)
+                    self.spawn_worker()
+                continue
+
+            if self.shutting_down:
+                if drain_deadline is None:
+                    drain_deadline = time.monotonic() + self.options['graceful_timeout'] + 5
+                elif time.monotonic() > drain_deadline:
+                    for child in list(self.children):
+                        self.stderr.write(f'Worker {child} did not drain in time, killing')
+                        try:
+                            os.kill(child, signal.SIGKILL)
+                        except ProcessLookupError:
+                            pass
+                    drain_deadline = float('inf')
+
+            time.sleep(0.1)
+
+        self.sock.close()
+        self.stdout.write('All workers stopped')
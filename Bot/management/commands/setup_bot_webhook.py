@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from Bot.models import TelegramBot
-from telegram import Bot as TelegramBotClient
+from Bot.webhooks import get_webhook_config
+from Bot.client import create_telegram_client
 import asyncio
 
 
@@ -18,12 +19,13 @@ class Command(BaseCommand):
         try:
             bot = TelegramBot.objects.get(id=bot_id)
             
-            # Construct full webhook URL
-            full_webhook_url = f"{webhook_url}/api/webhook/{bot.id}"
+            # Construct full webhook configuration
+            config = get_webhook_config(bot, base_url=webhook_url)
+            full_webhook_url = config['url']
             
             # Setup webhook
-            bot_client = TelegramBotClient(token=bot.token)
-            asyncio.run(bot_client.set_webhook(url=full_webhook_url))
+            bot_client = create_telegram_client(bot.token)
+            asyncio.run(bot_client.set_webhook(**config))
             
             # Update bot
             bot.webhook_url = full_webhook_url
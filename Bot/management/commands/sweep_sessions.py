@@ -0,0 +1,55 @@
+"""
+Compact the conversation state of idle users (run periodically, e.g. hourly from cron)
+"""
+from django.core.management.base import BaseCommand
+
+from Bot.models import TelegramBot
+from Bot.sessions import idle_cutoff, sweep_bot
+
+
+class Command(BaseCommand):
+    help = "Reset unfinished conversations of users idle longer than their bot's idle TTL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('bot_ids', nargs='*',
+                            help='Only sweep these bots (default: all bots)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Users read and updated per batch')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep between batches')
+        parser.add_argument('--full', action='store_true',
+                            help='Also re-read users swept before')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be compacted without writing')
+
+    def handle(self, *args, **options):
+        bots = TelegramBot.objects.order_by('name')
+        if options['bot_ids']:
+            bots = bots.filter(pk__in=options['bot_ids'])
+
+        totals = {'scanned': 0, 'compacted': 0, 'bytes': 0}
+        for bot in bots:
+            cutoff = idle_cutoff(bot)
+            if cutoff is None:
+                self.stdout.write(f"{bot.name}: idle sweeping disabled")
+                continue
+
+            stats = sweep_bot(
+                bot,
+                batch_size=max(1, options['batch_size']),
+                pause=options['pause'],
+                full=options['full'],
+                dry_run=options['dry_run'],
+            )
+            for key in totals:
+                totals[key] += stats[key]
+            self.stdout.write(
+                f"{bot.name}: {stats['compacted']} of {stats['scanned']} idle users compacted, "
+                f"{stats['bytes']} bytes reclaimed"
+            )
+
+        prefix = 'Would compact' if options['dry_run'] else 'Compacted'
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} {totals['compacted']} of {totals['scanned']} idle users, "
+            f"{totals['bytes']} bytes of state reclaimed"
+        ))
@@ -0,0 +1,154 @@
+"""
+Reconcile webhook registrations of every active bot with Telegram
+"""
+from dataclasses import dataclass, field
+from typing import List, Optional
+import asyncio
+
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.utils import timezone
+
+from Bot.models import TelegramBot
+from Bot.client import create_telegram_client
+from Bot.webhooks import get_webhook_config, diff_webhook_info
+
+
+@dataclass
+class WebhookSyncResult:
+    """Outcome of checking (and possibly repairing) one bot's webhook"""
+    bot: TelegramBot
+    webhook_url: Optional[str] = None
+    pending_update_count: int = 0
+    last_error_message: Optional[str] = None
+    last_error_date: Optional[object] = None
+    drift: List[str] = field(default_factory=list)
+    repaired: bool = False
+    error: Optional[str] = None
+
+    @property
+    def in_sync(self) -> bool:
+        return not self.error and (not self.drift or self.repaired)
+
+
+class Command(BaseCommand):
+    help = 'Check webhooks of all active bots against the desired configuration and repair drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report drift, do not call setWebhook')
+        parser.add_argument('--force', action='store_true',
+                            help='Re-register every webhook even if no drift is detected')
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help='Maximum number of concurrent Telegram API calls')
+        parser.add_argument('--base-url', type=str, default=None,
+                            help='Public base URL (defaults to settings.BASE_URL)')
+
+    def handle(self, *args, **options):
+        base_url = options['base_url'] or getattr(settings, 'BASE_URL', None)
+        if not base_url:
+            self.stdout.write(self.style.ERROR('BASE_URL not configured in settings.'))
+            return
+
+        bots = list(TelegramBot.objects.filter(is_active=True).exclude(token=''))
+        if not bots:
+            self.stdout.write('No active bots.')
+            return
+
+        results = asyncio.run(self.sync_all(
+            bots,
+            base_url=base_url,
+            concurrency=max(1, options['concurrency']),
+            dry_run=options['dry_run'],
+            force=options['force'],
+        ))
+
+        self.save_results(results)
+        self.report(results)
+
+    async def sync_all(self, bots, base_url, concurrency, dry_run, force):
+        """Check all bots concurrently, bounded by a semaphore"""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def sync_one(bot):
+            async with semaphore:
+                return await self.sync_bot(bot, base_url, dry_run, force)
+
+        return await asyncio.gather(*(sync_one(bot) for bot in bots))
+
+    async def sync_bot(self, bot, base_url, dry_run, force) -> WebhookSyncResult:
+        """Fetch webhook info for one bot and repair drift"""
+        result = WebhookSyncResult(bot=bot)
+        config = get_webhook_config(bot, base_url=base_url)
+
+        try:
+            bot_client = create_telegram_client(bot.token)
+            webhook_info = await bot_client.get_webhook_info()
+
+            result.webhook_url = webhook_info.url or None
+            result.pending_update_count = webhook_info.pending_update_count
+            result.last_error_message = webhook_info.last_error_message
+            result.last_error_date = webhook_info.last_error_date
+            result.drift = diff_webhook_info(webhook_info, config)
+            if force and not result.drift:
+                result.drift = ['forced re-registration']
+
+            if result.drift and not dry_run:
+                await bot_client.set_webhook(**config)
+                result.webhook_url = config['url']
+                result.repaired = True
+        except Exception as e:
+            result.error = str(e)
+
+        return result
+
+    def save_results(self, results: List[WebhookSyncResult]) -> None:
+        """Record webhook status and backlog numbers on each bot"""
+        checked_at = timezone.now()
+
+        for result in results:
+            if result.error:
+                continue
+            # Use update() to avoid triggering post_save signals
+            TelegramBot.objects.filter(pk=result.bot.pk).update(
+                webhook_url=result.webhook_url,
+                is_webhook_set=result.in_sync and bool(result.webhook_url),
+                webhook_pending_update_count=result.pending_update_count,
+                webhook_last_error_message=result.last_error_message,
+                webhook_last_error_date=result.last_error_date,
+                webhook_checked_at=checked_at,
+            )
+
+    def report(self, results: List[WebhookSyncResult]) -> None:
+        """Print a per-bot summary"""
+        backlog_warning = getattr(settings, 'TELEGRAM_WEBHOOK_BACKLOG_WARNING', 100)
+        counts = {'ok': 0, 'repaired': 0, 'drift': 0, 'error': 0}
+
+        for result in sorted(results, key=lambda r: -r.pending_update_count):
+            name = result.bot.name
+            if result.error:
+                counts['error'] += 1
+                self.stdout.write(self.style.ERROR(f'❌ {name}: {result.error}'))
+                continue
+
+            if result.repaired:
+                counts['repaired'] += 1
+                self.stdout.write(self.style.SUCCESS(f'🔧 {name}: repaired ({"; ".join(result.drift)})'))
+            elif result.drift:
+                counts['drift'] += 1
+                self.stdout.write(self.style.WARNING(f'⚠️ {name}: drift ({"; ".join(result.drift)})'))
+            else:
+                counts['ok'] += 1
+                self.stdout.write(f'✅ {name}: in sync')
+
+            if result.pending_update_count >= backlog_warning:
+                self.stdout.write(self.style.WARNING(
+                    f'   Backlog: {result.pending_update_count} pending updates'
+                ))
+            if result.last_error_message:
+                self.stdout.write(f'   Last error: {result.last_error_message} ({result.last_error_date})')
+
+        self.stdout.write(
+            f"\n{len(results)} bot(s): {counts['ok']} in sync, {counts['repaired']} repaired, "
+            f"{counts['drift']} drifted, {counts['error']} failed"
+        )
@@ -0,0 +1,215 @@
+"""
+Media sending - local files uploaded once, then sent by file_id
+
+Services queue ``send_photo``/``send_document``/... calls with a
+``media_path`` relative to BOT_MEDIA_ROOT. Before a batch is delivered
+the outbox hashes each file (memoized by size and mtime, so a changed file
+gets a new hash) and looks up the file_id Telegram returned for the same
+content to the same bot. Cached files are sent by file_id; the first send
+of new content uploads it, and concurrent sends in the batch wait for that
+upload instead of uploading again. New file_ids are stored after the batch.
+"""
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import asyncio
+import hashlib
+import os
+import threading
+
+from django.conf import settings
+from telegram.error import BadRequest
+
+from . import metrics
+from .models import MediaFile
+
+# Outbox method -> media kind (its argument name and MediaFile.kind)
+MEDIA_METHODS = {
+    'send_photo': 'photo',
+    'send_document': 'document',
+    'send_video': 'video',
+    'send_audio': 'audio',
+}
+
+# Parts of Telegram's error text when a stored file_id can no longer be used
+STALE_FILE_ID_ERRORS = ('wrong file identifier', 'wrong remote file identifier', 'file_reference')
+
+# path -> (size, mtime_ns, sha256)
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+class MediaError(Exception):
+    """A media file that cannot be sent (missing, outside BOT_MEDIA_ROOT, ...)"""
+
+
+class MediaUpload:
+    """One file to send in an outbox batch, shared by every message sending it"""
+
+    __slots__ = ('bot_id', 'kind', 'path', 'relative_path', 'sha256', 'size', 'file_id', 'uploaded', 'lock')
+
+    def __init__(self, bot_id, kind: str, path: Path, relative_path: str, sha256: str, size: int):
+        self.bot_id = bot_id
+        self.kind = kind
+        self.path = path
+        self.relative_path = relative_path
+        self.sha256 = sha256
+        self.size = size
+        self.file_id = None
+        # Set when this batch uploaded the file; stored by remember_uploads
+        self.uploaded = False
+        self.lock = asyncio.Lock()
+
+
+def resolve_path(relative_path: str) -> Path:
+    """
+    Absolute path of a media file
+
+    Raises:
+        MediaError: The path leaves BOT_MEDIA_ROOT or is not a file
+    """
+    root = Path(settings.BOT_MEDIA_ROOT).resolve()
+    path = (root / relative_path).resolve()
+    if not path.is_relative_to(root):
+        raise MediaError(f"Media path {relative_path!r} is outside BOT_MEDIA_ROOT")
+    if not path.is_file():
+        raise MediaError(f"Media file {relative_path!r} not found in {root}")
+    return path
+
+
+def file_digest(path: Path) -> Tuple[str, int]:
+    """SHA-256 and size of a file, rehashed only when its size or mtime changed"""
+    stat = os.stat(path)
+    key = str(path)
+    memo = _digests.get(key)
+    if memo is not None and memo[0] == stat.st_size and memo[1] == stat.st_mtime_ns:
+        return memo[2], stat.st_size
+
+    with open(path, 'rb') as f:
+        sha256 = hashlib.file_digest(f, 'sha256').hexdigest()
+    with _digests_lock:
+        _digests[key] = (stat.st_size, stat.st_mtime_ns, sha256)
+    return sha256, stat.st_size
+
+
+def prepare_media(messages) -> Dict[int, object]:
+    """
+    Hash the files of a batch's media messages and look up their file_ids
+
+    Returns:
+        Message ID -> MediaUpload, or MediaError for a file that cannot be sent
+    """
+    uploads = {}
+    shared = {}
+    for message in messages:
+        kind = MEDIA_METHODS.get(message.method)
+        relative_path = message.payload.get('media_path') if kind else None
+        if not relative_path:
+            continue
+        try:
+            path = resolve_path(relative_path)
+            sha256, size = file_digest(path)
+        except OSError as e:
+            uploads[message.pk] = MediaError(f"Media file {relative_path!r} unreadable: {e}")
+            continue
+        except MediaError as e:
+            uploads[message.pk] = e
+            continue
+
+        key = (message.bot_id, kind, sha256)
+        if key not in shared:
+            shared[key] = MediaUpload(message.bot_id, kind, path, relative_path, sha256, size)
+        uploads[message.pk] = shared[key]
+
+    if shared:
+        for bot_id, kind, sha256, file_id in (
+            MediaFile.objects
+            .filter(bot_id__in={key[0] for key in shared}, sha256__in={key[2] for key in shared})
+            .values_list('bot_id', 'kind', 'sha256', 'file_id')
+        ):
+            upload = shared.get((bot_id, kind, sha256))
+            if upload is not None:
+                upload.file_id = file_id
+    return uploads
+
+
+def sent_file_id(result, kind: str) -> Optional[str]:
+    """file_id of the media in a sent message (the largest size of a photo)"""
+    media = getattr(result, kind, None)
+    if kind == 'photo':
+        media = media[-1] if media else None
+    return getattr(media, 'file_id', None)
+
+
+async def send_media(method, kwargs: Dict, upload: MediaUpload):
+    """
+    Send a media message by cached file_id, uploading the file when there is none
+
+    Args:
+        method: Bound client method (send_photo, ...)
+        kwargs: Other API call arguments
+        upload: The batch's MediaUpload for this file
+
+    Returns:
+        The sent message
+    """
+    kwargs.pop('media_path', None)
+    kind = upload.kind
+
+    if upload.file_id is None:
+        # One upload per file and batch: later senders wait and reuse its file_id
+        async with upload.lock:
+            if upload.file_id is None:
+                metrics.MEDIA_CACHE_LOOKUPS.inc((kind, 'miss'))
+                return await upload_file(method, kwargs, upload)
+
+    metrics.MEDIA_CACHE_LOOKUPS.inc((kind, 'hit'))
+    file_id = upload.file_id
+    try:
+        return await method(**{kind: file_id}, **kwargs)
+    except BadRequest as e:
+        if not any(text in str(e).lower() for text in STALE_FILE_ID_ERRORS):
+            raise
+        # Telegram no longer accepts the stored file_id: upload again (once per batch)
+        metrics.MEDIA_CACHE_LOOKUPS.inc((kind, 'stale'))
+        async with upload.lock:
+            if upload.file_id != file_id:
+                return await method(**{kind: upload.file_id}, **kwargs)
+            return await upload_file(method, kwargs, upload)
+
+
+async def upload_file(method, kwargs: Dict, upload: MediaUpload):
+    """Upload the file with the call and keep the file_id Telegram assigned"""
+    with open(upload.path, 'rb') as f:
+        result = await method(**{upload.kind: f}, **kwargs)
+    metrics.MEDIA_UPLOAD_BYTES.inc((upload.kind,), upload.size)
+    file_id = sent_file_id(result, upload.kind)
+    if file_id:
+        upload.file_id = file_id
+        upload.uploaded = True
+    return result
+
+
+def remember_uploads(uploads: Dict[int, object]) -> None:
+    """Store the file_ids of files uploaded in a batch"""
+    uploaded = {
+        id(upload): upload for upload in uploads.values()
+        if isinstance(upload, MediaUpload) and upload.uploaded
+    }
+    if not uploaded:
+        return
+    MediaFile.objects.bulk_create(
+        [
+            MediaFile(
+                bot_id=upload.bot_id,
+                kind=upload.kind,
+                sha256=upload.sha256,
+                file_id=upload.file_id,
+                path=upload.relative_path,
+                size=upload.size,
+            )
+            for upload in uploaded.values()
+        ],
+        update_conflicts=True,
+        unique_fields=['bot', 'kind', 'sha256'],
+        update_fields=['file_id', 'path', 'size', 'updated_at'],
+    )
@@ -0,0 +1,403 @@
+"""
+Prometheus-style metrics for the update pipeline
+
+Collection is lock-free on the hot path: every thread writes to its own
+shard (a plain dict reached through a thread-local), and shards are only
+merged when /api/metrics is scraped. The lock is taken once per thread, the
+first time it records a given metric, and at scrape time.
+
+With several processes (``serve`` workers, outbox and task workers) set
+METRICS_MULTIPROCESS_DIR: each process then dumps its values to
+``<dir>/<pid>.json`` every METRICS_FLUSH_INTERVAL seconds and the endpoint
+sums the snapshots of all processes.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Queries per update
+QUERY_COUNT_BUCKETS = (1, 2, 4, 6, 8, 10, 15, 20, 30, 50, 100)
+
+REGISTRY = []
+
+
+class Metric:
+    """Base class: per-thread shards of {label values: value}"""
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), multiprocess: bool = True):
+        """
+        Args:
+            name: Metric name
+            documentation: HELP text
+            labelnames: Names of the labels, values are passed positionally as a tuple
+            multiprocess: Include snapshots of other processes when rendering
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.multiprocess = multiprocess
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.values
+        except AttributeError:
+            values = {}
+            with self._lock:
+                # Threads come and go (one per update): registering is when shards are bounded
+                self._fold_finished()
+                self._shards.append((threading.current_thread(), values))
+            self._local.values = values
+            return values
+
+    def _fold_finished(self) -> None:
+        """Fold shards of finished threads into _retired (with the lock held)"""
+        alive = []
+        for thread, values in self._shards:
+            if thread.is_alive():
+                alive.append((thread, values))
+            else:
+                self._merge(self._retired, values)
+        self._shards = alive
+
+    def _merge(self, target: dict, values: dict) -> None:
+        for labels, value in values.items():
+            target[labels] = target.get(labels, 0) + value
+
+    def collect(self) -> dict:
+        """Merged {label values: value} of all threads"""
+        with self._lock:
+            self._fold_finished()
+            merged = {}
+            self._merge(merged, self._retired)
+            for thread, values in self._shards:
+                self._merge(merged, dict(values))
+        return merged
+
+    def render(self, samples: dict) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for labels, value in sorted(samples.items()):
+            lines.append(f'{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, labels: tuple = (), amount: float = 1) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """Up/down gauge; per-thread deltas summed at scrape time"""
+    kind = 'gauge'
+
+    def inc(self, labels: tuple = (), amount: float = 1) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def dec(self, labels: tuple = (), amount: float = 1) -> None:
+        self.inc(labels, -amount)
+
+    @contextmanager
+    def track_inprogress(self, labels: tuple = ()):
+        self.inc(labels)
+        try:
+            yield
+        finally:
+            self.dec(labels)
+
+
+class CallbackGauge(Metric):
+    """Gauge computed at scrape time, e.g. queue depths read from the database"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames, multiprocess=False)
+        self.callback = callback
+
+    def collect(self) -> dict:
+        try:
+            return dict(self.callback())
+        except Exception:
+            return {}
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, **kwargs):
+        super().__init__(name, documentation, labelnames, **kwargs)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, labels: tuple = ()) -> None:
+        shard = self._shard()
+        data = shard.get(labels)
+        if data is None:
+            # One count per bucket plus +Inf, then sum and count
+            data = shard[labels] = [0] * (len(self.buckets) + 3)
+        data[bisect_left(self.buckets, value)] += 1
+        data[-2] += value
+        data[-1] += 1
+
+    @contextmanager
+    def time(self, labels: tuple = ()):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, labels)
+
+    def _merge(self, target: dict, values: dict) -> None:
+        for labels, data in values.items():
+            current = target.get(labels)
+            if current is None:
+                target[labels] = list(data)
+            else:
+                target[labels] = [a + b for a, b in zip(current, data)]
+
+    def render(self, samples: dict) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for labels, data in sorted(samples.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), data):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else format_value(bound)
+                lines.append(
+                    f'{self.name}_bucket{format_labels(self.labelnames + ("le",), labels + (le,))} {cumulative}'
+                )
+            label_text = format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_text} {format_value(data[-2])}')
+            lines.append(f'{self.name}_count{label_text} {data[-1]}')
+        return lines
+
+
+def format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def format_value(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+# Update pipeline
+WEBHOOK_REQUESTS = Counter(
+    'telegram_webhook_requests_total', 'Webhook requests by bot and outcome', ['bot_id', 'status'])
+WEBHOOK_DURATION = Histogram(
+    'telegram_webhook_duration_seconds', 'Webhook handling time per update', ['bot_id'])
+WEBHOOK_REJECTS = Counter(
+    'telegram_webhook_rejected_total', 'Webhook requests refused before loading the bot', ['reason'])
+WEBHOOK_ADMISSIONS = Counter(
+    'telegram_webhook_admissions_total',
+    'Updates admitted or shed by admission control (queue_full, timeout, shutting_down)', ['priority', 'result'])
+WEBHOOK_QUEUE_WAIT = Histogram(
+    'telegram_webhook_queue_wait_seconds', 'Time updates waited for a processing slot', ['priority'])
+STAGE_DEADLINES_EXCEEDED = Counter(
+    'telegram_update_deadlines_exceeded_total', 'Updates that ran out of time in a stage', ['stage'])
+FLOOD_UPDATES = Counter(
+    'bot_flood_updates_total', 'Updates dropped by flood protection (warn, drop, block, blocked)',
+    ['bot_type', 'action'])
+UPDATES_IGNORED = Counter(
+    'telegram_updates_ignored_total', 'Updates of types the bot service does not handle', ['bot_type', 'update_type'])
+UPDATES_IN_PROGRESS = Gauge(
+    'telegram_updates_in_progress', 'Updates currently being processed', ['bot_type'])
+SERVICE_HANDLER_DURATION = Histogram(
+    'bot_service_handler_duration_seconds', 'Bot service handler time', ['bot_type', 'handler'])
+UPDATE_DB_QUERIES = Histogram(
+    'telegram_update_db_queries', 'Database queries per update', ['bot_type'], buckets=QUERY_COUNT_BUCKETS)
+UPDATE_DB_TIME = Histogram(
+    'telegram_update_db_seconds', 'Database time per update', ['bot_type'])
+USER_STATE_SAVES = Counter(
+    'bot_user_state_saves_total', 'Versioned BotUser state saves by result (ok, conflict)', ['bot_type', 'result'])
+SERVICE_HANDLER_RETRIES = Counter(
+    'bot_service_handler_retries_total', 'Handlers re-run after a state conflict, by outcome (retried, gave_up)',
+    ['bot_type', 'outcome'])
+
+# Telegram Bot API
+TELEGRAM_API_DURATION = Histogram(
+    'telegram_api_request_duration_seconds', 'Telegram Bot API call latency', ['endpoint'])
+TELEGRAM_API_ERRORS = Counter(
+    'telegram_api_errors_total', 'Telegram Bot API calls that did not return 2xx', ['endpoint', 'code'])
+BOT_CIRCUIT_TRIPS = Counter(
+    'telegram_bot_circuit_trips_total', 'Bot circuits opened by 401 Unauthorized, by outcome (open, deactivated)',
+    ['outcome'])
+OUTBOX_UNDELIVERABLE = Counter(
+    'telegram_outbox_undeliverable_total', 'Outgoing messages failed without a call (bot_inactive, user_blocked)',
+    ['reason'])
+MEDIA_CACHE_LOOKUPS = Counter(
+    'bot_media_cache_lookups_total', 'Media sends by file_id cache result (hit, miss, stale)', ['kind', 'result'])
+MEDIA_UPLOAD_BYTES = Counter(
+    'bot_media_upload_bytes_total', 'Bytes of media files uploaded to Telegram', ['kind'])
+
+# Background workers
+WORKER_BUSY = Gauge('bot_worker_busy', 'Work items currently being executed', ['worker'])
+WORKER_CAPACITY = Gauge('bot_worker_capacity', 'Maximum concurrent work items', ['worker'])
+SCHEDULED_JOBS_FIRED = Counter(
+    'bot_scheduled_jobs_fired_total', 'Due scheduled jobs by outcome (sent, skipped)', ['outcome'])
+SCHEDULER_WHEEL_JOBS = Gauge('bot_scheduler_wheel_jobs', 'Scheduled jobs held in the timer wheel')
+
+
+def _queue_depths():
+    from . import admission
+    from .db_writer import get_writer
+    from django.utils import timezone
+    from .models import BotTask, OutgoingMessage, ScheduledJob
+
+    depths = {
+        ('outgoing_messages',): OutgoingMessage.objects.filter(status='pending').count(),
+        ('bot_tasks',): BotTask.objects.filter(status='pending').count(),
+        # Overdue jobs only: the scheduler's lag, not everything scheduled
+        ('scheduled_jobs',): ScheduledJob.objects.filter(status='pending', run_at__lte=timezone.now()).count(),
+    }
+    writer = get_writer()
+    if writer is not None:
+        depths[('db_writer',)] = writer.qsize()
+    depths[('webhook_admission',)] = admission.waiting()
+    return depths
+
+
+QUEUE_DEPTH = CallbackGauge('bot_queue_depth', 'Items waiting in each queue', ['queue'], _queue_depths)
+
+
+class QueryStats:
+    """Number of queries and total database time, accumulated across threads of one update"""
+    __slots__ = ('count', 'time')
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+
+@contextmanager
+def track_queries(stats: QueryStats):
+    """Count queries run on this thread's database connection into ``stats``"""
+    from django.db import connection
+
+    def wrapper(execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            stats.count += 1
+            stats.time += time.perf_counter() - started
+
+    with connection.execute_wrapper(wrapper):
+        yield stats
+
+
+# Multi-process support
+
+def _snapshot() -> dict:
+    snapshot = {}
+    for metric in REGISTRY:
+        if metric.multiprocess:
+            snapshot[metric.name] = [[list(labels), value] for labels, value in metric.collect().items()]
+    return snapshot
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _multiprocess_dir():
+    return getattr(settings, 'METRICS_MULTIPROCESS_DIR', None)
+
+
+def write_snapshot() -> None:
+    """Dump this process's values for other processes to aggregate"""
+    directory = _multiprocess_dir()
+    if not directory:
+        return
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(_snapshot(), f)
+    os.replace(tmp_path, path)
+
+
+_exporter_pid = None
+
+
+def start_exporter() -> None:
+    """Start the background snapshot writer of this process (no-op without a directory)"""
+    global _exporter_pid
+
+    directory = _multiprocess_dir()
+    if not directory or _exporter_pid == os.getpid():
+        return
+    os.makedirs(directory, exist_ok=True)
+    _exporter_pid = os.getpid()
+    interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+
+    def export():
+        while True:
+            time.sleep(interval)
+            try:
+                write_snapshot()
+            except OSError:
+                pass
+
+    threading.Thread(target=export, name='metrics-exporter', daemon=True).start()
+
+
+def render() -> str:
+    """Render all metrics in the Prometheus text exposition format"""
+    start_exporter()
+
+    other_processes = []
+    directory = _multiprocess_dir()
+    if directory and os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            # Only <pid>.json snapshots; skip strays such as temporary files
+            if not filename.endswith('.json') or not filename[:-5].isdigit() or filename == f'{os.getpid()}.json':
+                continue
+            pid = int(filename[:-5])
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    other_processes.append((_pid_alive(pid), json.load(f)))
+            except (OSError, ValueError):
+                continue
+
+    lines = []
+    for metric in REGISTRY:
+        samples = metric.collect()
+        if metric.multiprocess:
+            for alive, snapshot in other_processes:
+                # Counters of exited processes stay; their gauges do not
+                if not alive and metric.kind == 'gauge':
+                    continue
+                metric._merge(samples, {
+                    tuple(labels): value for labels, value in snapshot.get(metric.name, [])
+                })
+        lines.extend(metric.render(samples))
+    return '\n'.join(lines) + '\n'
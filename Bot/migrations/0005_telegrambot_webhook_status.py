@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Bot', '0004_telegrambot_after_phone_number_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='telegrambot',
+            name='webhook_checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='telegrambot',
+            name='webhook_last_error_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='telegrambot',
+            name='webhook_last_error_message',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='telegrambot',
+            name='webhook_pending_update_count',
+            field=models.IntegerField(default=0, help_text='Updates waiting to be delivered at last webhook check'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:16
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Bot', '0005_telegrambot_webhook_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BotTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_type', models.CharField(choices=[('setup_webhook', 'Setup Webhook'), ('fetch_username', 'Fetch Username')], max_length=50)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('max_attempts', models.IntegerField(default=8)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('bot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tasks', to='Bot.telegrambot')),
+            ],
+            options={
+                'verbose_name': 'Bot Task',
+                'verbose_name_plural': 'Bot Tasks',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'run_after'], name='Bot_bottask_status_ce1e09_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:18
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Bot', '0006_bottask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutgoingMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.BigIntegerField()),
+                ('method', models.CharField(choices=[('send_message', 'Send Message')], default='send_message', max_length=50)),
+                ('payload', models.JSONField(default=dict, help_text='Keyword arguments for the API call')),
+                ('idempotency_key', models.CharField(max_length=255, unique=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('max_attempts', models.IntegerField(default=10)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('error_code', models.IntegerField(blank=True, help_text='Telegram error code of the last failure', null=True)),
+                ('telegram_message_id', models.BigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('bot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outgoing_messages', to='Bot.telegrambot')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='outgoing_messages', to='Bot.botuser')),
+            ],
+            options={
+                'verbose_name': 'Outgoing Message',
+                'verbose_name_plural': 'Outgoing Messages',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'run_after'], name='Bot_outgoin_status_b6bb70_idx'), models.Index(fields=['bot', 'status'], name='Bot_outgoin_bot_id_61c59d_idx')],
+            },
+        ),
+    ]
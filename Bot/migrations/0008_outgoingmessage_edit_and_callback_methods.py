@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Bot', '0007_outgoingmessage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outgoingmessage',
+            name='method',
+            field=models.CharField(choices=[('send_message', 'Send Message'), ('edit_message_text', 'Edit Message Text'), ('answer_callback_query', 'Answer Callback Query')], default='send_message', max_length=50),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Bot', '0008_outgoingmessage_edit_and_callback_methods'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='botuser',
+            name='version',
+            field=models.PositiveIntegerField(default=0, help_text='Incremented by every state save, for optimistic concurrency'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Bot', '0009_botuser_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Per-user job name, e.g. survey_nudge', max_length=100)),
+                ('method', models.CharField(choices=[('send_message', 'Send Message'), ('edit_message_text', 'Edit Message Text'), ('answer_callback_query', 'Answer Callback Query')], default='send_message', max_length=50)),
+                ('payload', models.JSONField(default=dict, help_text='Keyword arguments for the API call')),
+                ('only_in_state', models.CharField(blank=True, help_text='Skip the job unless the user is still in this state when it fires', max_length=50, null=True)),
+                ('run_at', models.DateTimeField()),
+                ('interval', models.PositiveIntegerField(blank=True, help_text='Seconds between runs of a recurring job', null=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('skipped', 'Skipped'), ('cancelled', 'Cancelled')], default='pending', max_length=20)),
+                ('runs', models.IntegerField(default=0)),
+                ('last_run_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('bot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scheduled_jobs', to='Bot.telegrambot')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scheduled_jobs', to='Bot.botuser')),
+            ],
+            options={
+                'verbose_name': 'Scheduled Job',
+                'verbose_name_plural': 'Scheduled Jobs',
+                'ordering': ['run_at'],
+                'indexes': [models.Index(fields=['status', 'run_at'], name='Bot_schedul_status_4cfbf1_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('user', 'name'), name='unique_pending_job_name')],
+            },
+        ),
+    ]
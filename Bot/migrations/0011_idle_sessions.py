@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Bot', '0010_scheduledjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='telegrambot',
+            name='session_idle_hours',
+            field=models.PositiveIntegerField(blank=True, help_text='Reset unfinished conversations of users idle this many hours (empty: SESSION_IDLE_HOURS setting, 0: never)', null=True),
+        ),
+        migrations.AddField(
+            model_name='telegrambot',
+            name='sessions_swept_until',
+            field=models.DateTimeField(blank=True, help_text='Users idle since before this have already been swept', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='botuser',
+            index=models.Index(fields=['bot', 'last_interaction'], name='botuser_bot_idle_idx'),
+        ),
+    ]
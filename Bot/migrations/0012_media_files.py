@@ -0,0 +1,44 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Bot', '0011_idle_sessions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outgoingmessage',
+            name='method',
+            field=models.CharField(choices=[('send_message', 'Send Message'), ('send_photo', 'Send Photo'), ('send_document', 'Send Document'), ('send_video', 'Send Video'), ('send_audio', 'Send Audio'), ('edit_message_text', 'Edit Message Text'), ('answer_callback_query', 'Answer Callback Query')], default='send_message', max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='scheduledjob',
+            name='method',
+            field=models.CharField(choices=[('send_message', 'Send Message'), ('send_photo', 'Send Photo'), ('send_document', 'Send Document'), ('send_video', 'Send Video'), ('send_audio', 'Send Audio'), ('edit_message_text', 'Edit Message Text'), ('answer_callback_query', 'Answer Callback Query')], default='send_message', max_length=50),
+        ),
+        migrations.CreateModel(
+            name='MediaFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('photo', 'Photo'), ('document', 'Document'), ('video', 'Video'), ('audio', 'Audio')], max_length=20)),
+                ('sha256', models.CharField(help_text='SHA-256 of the file content', max_length=64)),
+                ('file_id', models.CharField(max_length=255)),
+                ('path', models.CharField(help_text='Path the file was uploaded from, relative to BOT_MEDIA_ROOT', max_length=500)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('bot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='media_files', to='Bot.telegrambot')),
+            ],
+            options={
+                'verbose_name': 'Media File',
+                'verbose_name_plural': 'Media Files',
+                'ordering': ['-updated_at'],
+                'constraints': [models.UniqueConstraint(fields=('bot', 'kind', 'sha256'), name='unique_media_file')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-19 05:02
+
+import Bot.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Bot', '0012_media_files'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='telegrambot',
+            name='bot_type',
+            field=models.CharField(choices=Bot.models.bot_type_choices, default='simple', help_text='Type of bot determines the flow handling strategy', max_length=50),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-19 05:04
+
+import Bot.models
+from django.db import migrations, models
+
+
+def generate_secrets(apps, schema_editor):
+    """AddField gives every existing bot the same default: give each its own secret"""
+    TelegramBot = apps.get_model('Bot', 'TelegramBot')
+    for bot in TelegramBot.objects.only('id'):
+        TelegramBot.objects.filter(pk=bot.pk).update(webhook_secret=Bot.models.generate_webhook_secret())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Bot', '0013_bot_type_choices'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='telegrambot',
+            name='webhook_secret',
+            field=models.CharField(blank=True, default=Bot.models.generate_webhook_secret, help_text='Sent by Telegram with every update; requests without it are rejected (empty: no check, changes need the webhook registered again)', max_length=256),
+        ),
+        migrations.RunPython(generate_secrets, migrations.RunPython.noop),
+    ]
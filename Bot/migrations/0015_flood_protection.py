@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-19 05:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Bot', '0014_webhook_secret'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='telegrambot',
+            name='flood_block_after',
+            field=models.PositiveIntegerField(blank=True, help_text='Block users exceeding the limit this many times within FLOOD_STRIKE_HOURS (empty: FLOOD_BLOCK_AFTER setting, 0: never)', null=True),
+        ),
+        migrations.AddField(
+            model_name='telegrambot',
+            name='flood_limit',
+            field=models.PositiveIntegerField(blank=True, help_text='Updates a user may send per flood window, more are dropped (empty: FLOOD_LIMIT setting, 0: no limit)', null=True),
+        ),
+        migrations.AddField(
+            model_name='telegrambot',
+            name='flood_warning_text',
+            field=models.TextField(blank=True, default="⏳ You're sending messages too fast. Please slow down.", help_text='Sent once when a user first exceeds the limit (empty: no reply)'),
+        ),
+        migrations.AddField(
+            model_name='telegrambot',
+            name='flood_window',
+            field=models.PositiveIntegerField(blank=True, help_text='Flood window in seconds (empty: FLOOD_WINDOW setting)', null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-19 05:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Bot', '0015_flood_protection'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='botmessage',
+            name='bot',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='Bot.telegrambot'),
+        ),
+        migrations.AlterField(
+            model_name='botmessage',
+            name='flow',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='Bot.botflow'),
+        ),
+        migrations.AlterField(
+            model_name='botmessage',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='Bot.botuser'),
+        ),
+    ]
@@ -1,8 +1,20 @@
 from django.db import models
+import secrets
 import uuid
 from django.utils import timezone
 
 
+def bot_type_choices():
+    """Built-in bot types and those registered with the service factory (plugins)"""
+    from .services.factory import BotServiceFactory
+    return BotServiceFactory.get_type_choices()
+
+
+def generate_webhook_secret() -> str:
+    """Secret token for a webhook (Telegram allows 1-256 characters of A-Z, a-z, 0-9, _ and -)"""
+    return secrets.token_urlsafe(32)
+
+
 class TelegramBot(models.Model):
     """Main bot configuration"""
     
@@ -23,7 +35,7 @@ class TelegramBot(models.Model):
     # Bot Type and Configuration
     bot_type = models.CharField(
         max_length=50, 
-        choices=BOT_TYPE_CHOICES, 
+        choices=bot_type_choices,
         default='simple',
         help_text="Type of bot determines the flow handling strategy"
     )
@@ -68,7 +80,60 @@ class TelegramBot(models.Model):
     )
     is_webhook_set = models.BooleanField(default=False)
     webhook_url = models.URLField(blank=True, null=True)
-    
+    webhook_secret = models.CharField(
+        max_length=256,
+        blank=True,
+        default=generate_webhook_secret,
+        help_text="Sent by Telegram with every update; requests without it are rejected "
+                  "(empty: no check, changes need the webhook registered again)"
+    )
+
+    # Webhook status as last reported by Telegram (see sync_webhooks command)
+    webhook_pending_update_count = models.IntegerField(
+        default=0,
+        help_text="Updates waiting to be delivered at last webhook check"
+    )
+    webhook_last_error_message = models.TextField(blank=True, null=True)
+    webhook_last_error_date = models.DateTimeField(blank=True, null=True)
+    webhook_checked_at = models.DateTimeField(blank=True, null=True)
+
+    # Idle conversations (see sweep_sessions command)
+    session_idle_hours = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text="Reset unfinished conversations of users idle this many hours "
+                  "(empty: SESSION_IDLE_HOURS setting, 0: never)"
+    )
+    sessions_swept_until = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text="Users idle since before this have already been swept"
+    )
+
+    # Incoming flood protection (see Bot.flood)
+    flood_limit = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text="Updates a user may send per flood window, more are dropped "
+                  "(empty: FLOOD_LIMIT setting, 0: no limit)"
+    )
+    flood_window = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text="Flood window in seconds (empty: FLOOD_WINDOW setting)"
+    )
+    flood_block_after = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text="Block users exceeding the limit this many times within FLOOD_STRIKE_HOURS "
+                  "(empty: FLOOD_BLOCK_AFTER setting, 0: never)"
+    )
+    flood_warning_text = models.TextField(
+        blank=True,
+        default="⏳ You're sending messages too fast. Please slow down.",
+        help_text="Sent once when a user first exceeds the limit (empty: no reply)"
+    )
+
     # Status
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -83,8 +148,13 @@ class TelegramBot(models.Model):
         return f"{self.name} (@{self.username})"
     
     def increment_request_count(self):
+        # Atomic increment, concurrent webhooks must not lose counts
+        TelegramBot.objects.filter(pk=self.pk).update(request_count=models.F('request_count') + 1)
         self.request_count += 1
-        self.save(update_fields=['request_count'])
+
+
+class StaleUserState(Exception):
+    """Raised when a BotUser's state was saved by someone else since it was loaded"""
 
 
 class BotUser(models.Model):
@@ -125,6 +195,10 @@ class BotUser(models.Model):
         blank=True,
         help_text="Additional state data for flow processing"
     )
+    version = models.PositiveIntegerField(
+        default=0,
+        help_text="Incremented by every state save, for optimistic concurrency"
+    )
     
     # Status
     is_blocked = models.BooleanField(default=False)
@@ -139,9 +213,31 @@ class BotUser(models.Model):
         verbose_name_plural = "Bot Users"
         unique_together = ['bot', 'chat_id']
         ordering = ['-last_interaction']
+        indexes = [
+            # Idle session sweeps walk each bot's users by last_interaction
+            models.Index(fields=['bot', 'last_interaction'], name='botuser_bot_idle_idx'),
+        ]
     
     def __str__(self):
         return f"{self.first_name or ''} {self.last_name or ''} (@{self.username}) - {self.chat_id}"
+    
+    def save_state(self, update_fields) -> None:
+        """
+        Save fields with a compare-and-swap on ``version``
+        
+        Args:
+            update_fields: Names of the fields to write
+        
+        Raises:
+            StaleUserState: The row was saved since this instance was loaded
+        """
+        values = {field: getattr(self, field) for field in update_fields}
+        updated = BotUser.objects.filter(pk=self.pk, version=self.version).update(
+            version=models.F('version') + 1, **values
+        )
+        if not updated:
+            raise StaleUserState(f"BotUser {self.pk} changed since version {self.version}")
+        self.version += 1
 
 
 class BotFlow(models.Model):
@@ -173,6 +269,25 @@ class BotFlow(models.Model):
         return f"{self.bot.name} - {self.name}"
 
 
+class BotMessageQuerySet(models.QuerySet):
+    """Messages live in their bot's shard database (see Bot.sharding)"""
+    
+    def for_bot(self, bot) -> 'BotMessageQuerySet':
+        """A bot's messages, from its shard"""
+        from .sharding import shard_for
+        
+        return self.using(shard_for(bot.pk)).filter(bot=bot)
+    
+    def create(self, **kwargs):
+        if self._db is None:
+            bot_id = kwargs['bot'].pk if 'bot' in kwargs else kwargs.get('bot_id')
+            if bot_id is not None:
+                from .sharding import shard_for
+                
+                return super().using(shard_for(bot_id)).create(**kwargs)
+        return super().create(**kwargs)
+
+
 class BotMessage(models.Model):
     """Store bot messages for analytics"""
     MESSAGE_TYPE_CHOICES = [
@@ -192,8 +307,9 @@ class BotMessage(models.Model):
         ('outgoing', 'Outgoing'),
     ]
     
-    bot = models.ForeignKey(TelegramBot, on_delete=models.CASCADE, related_name='messages')
-    user = models.ForeignKey(BotUser, on_delete=models.CASCADE, related_name='messages')
+    # No database constraints: the rows may live in a shard without these tables
+    bot = models.ForeignKey(TelegramBot, on_delete=models.CASCADE, related_name='messages', db_constraint=False)
+    user = models.ForeignKey(BotUser, on_delete=models.CASCADE, related_name='messages', db_constraint=False)
     
     message_type = models.CharField(max_length=20, choices=MESSAGE_TYPE_CHOICES, default='text')
     direction = models.CharField(max_length=10, choices=DIRECTION_CHOICES)
@@ -204,10 +320,12 @@ class BotMessage(models.Model):
     
     # Metadata
     telegram_message_id = models.BigIntegerField()
-    flow = models.ForeignKey(BotFlow, on_delete=models.SET_NULL, null=True, blank=True)
+    flow = models.ForeignKey(BotFlow, on_delete=models.SET_NULL, null=True, blank=True, db_constraint=False)
     
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = BotMessageQuerySet.as_manager()
+    
     class Meta:
         verbose_name = "Bot Message"
         verbose_name_plural = "Bot Messages"
@@ -218,3 +336,195 @@ class BotMessage(models.Model):
     
     def __str__(self):
         return f"{self.direction} - {self.message_type} - {self.created_at}"
+
+
+class BotTask(models.Model):
+    """
+    Outbox of bot side effects (webhook setup, username fetch)
+
+    Rows are written in the same transaction as the TelegramBot save and
+    executed later by the ``run_bot_tasks`` worker with retry and backoff.
+    """
+    TASK_TYPE_CHOICES = [
+        ('setup_webhook', 'Setup Webhook'),
+        ('fetch_username', 'Fetch Username'),
+    ]
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    bot = models.ForeignKey(TelegramBot, on_delete=models.CASCADE, related_name='tasks')
+    task_type = models.CharField(max_length=50, choices=TASK_TYPE_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+
+    # Retry bookkeeping
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=8)
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, null=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Bot Task"
+        verbose_name_plural = "Bot Tasks"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_task_type_display()} - {self.bot.name} ({self.status})"
+
+
+class OutgoingMessage(models.Model):
+    """
+    Durable outbox of Telegram API calls made on behalf of a bot user
+
+    Services enqueue rows and return immediately; the ``run_outbox`` worker
+    delivers them with retry. ``idempotency_key`` is unique so a redelivered
+    update never produces a second copy of the same reply.
+    """
+    METHOD_CHOICES = [
+        ('send_message', 'Send Message'),
+        ('send_photo', 'Send Photo'),
+        ('send_document', 'Send Document'),
+        ('send_video', 'Send Video'),
+        ('send_audio', 'Send Audio'),
+        ('edit_message_text', 'Edit Message Text'),
+        ('answer_callback_query', 'Answer Callback Query'),
+    ]
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    bot = models.ForeignKey(TelegramBot, on_delete=models.CASCADE, related_name='outgoing_messages')
+    user = models.ForeignKey(
+        BotUser, on_delete=models.CASCADE, null=True, blank=True, related_name='outgoing_messages'
+    )
+    chat_id = models.BigIntegerField()
+
+    method = models.CharField(max_length=50, choices=METHOD_CHOICES, default='send_message')
+    payload = models.JSONField(default=dict, help_text="Keyword arguments for the API call")
+    idempotency_key = models.CharField(max_length=255, unique=True)
+
+    # Delivery bookkeeping
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=10)
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, null=True)
+    error_code = models.IntegerField(blank=True, null=True, help_text="Telegram error code of the last failure")
+    telegram_message_id = models.BigIntegerField(blank=True, null=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Outgoing Message"
+        verbose_name_plural = "Outgoing Messages"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+            models.Index(fields=['bot', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.method} -> {self.chat_id} ({self.status})"
+
+
+class ScheduledJob(models.Model):
+    """
+    API call to a bot user at a later time, optionally repeating
+
+    Created by services through ``Bot.scheduler.schedule``; the
+    ``run_scheduler`` worker fires due jobs into the outbox. A user has at
+    most one pending job per ``name``, scheduling the name again replaces it.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('skipped', 'Skipped'),
+        ('cancelled', 'Cancelled'),
+    ]
+
+    bot = models.ForeignKey(TelegramBot, on_delete=models.CASCADE, related_name='scheduled_jobs')
+    user = models.ForeignKey(BotUser, on_delete=models.CASCADE, related_name='scheduled_jobs')
+    name = models.CharField(max_length=100, help_text="Per-user job name, e.g. survey_nudge")
+
+    method = models.CharField(max_length=50, choices=OutgoingMessage.METHOD_CHOICES, default='send_message')
+    payload = models.JSONField(default=dict, help_text="Keyword arguments for the API call")
+    only_in_state = models.CharField(
+        max_length=50, blank=True, null=True,
+        help_text="Skip the job unless the user is still in this state when it fires"
+    )
+
+    run_at = models.DateTimeField()
+    interval = models.PositiveIntegerField(
+        blank=True, null=True, help_text="Seconds between runs of a recurring job"
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    runs = models.IntegerField(default=0)
+    last_run_at = models.DateTimeField(blank=True, null=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Scheduled Job"
+        verbose_name_plural = "Scheduled Jobs"
+        ordering = ['run_at']
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'name'], condition=models.Q(status='pending'), name='unique_pending_job_name'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} -> {self.user.chat_id} at {self.run_at} ({self.status})"
+
+
+class MediaFile(models.Model):
+    """Telegram file_id of an uploaded local file, per bot and file content"""
+
+    KIND_CHOICES = [
+        ('photo', 'Photo'),
+        ('document', 'Document'),
+        ('video', 'Video'),
+        ('audio', 'Audio'),
+    ]
+
+    # file_ids are only valid for the bot that uploaded the file
+    bot = models.ForeignKey(TelegramBot, on_delete=models.CASCADE, related_name='media_files')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    sha256 = models.CharField(max_length=64, help_text="SHA-256 of the file content")
+    file_id = models.CharField(max_length=255)
+    path = models.CharField(max_length=500, help_text="Path the file was uploaded from, relative to BOT_MEDIA_ROOT")
+    size = models.PositiveBigIntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Media File"
+        verbose_name_plural = "Media Files"
+        ordering = ['-updated_at']
+        constraints = [
+            models.UniqueConstraint(fields=['bot', 'kind', 'sha256'], name='unique_media_file'),
+        ]
+
+    def __str__(self):
+        return f"{self.path} ({self.kind}, {self.sha256[:12]})"
@@ -0,0 +1,387 @@
+"""
+Outbound message outbox
+
+Every Telegram call made on behalf of a bot user is stored as an
+OutgoingMessage and delivered by the ``run_outbox`` worker:
+
+- bounded concurrency per worker
+- RetryAfter (429) is honoured exactly, for every pending message of the bot
+- transient network errors are retried with jittered exponential backoff
+- rows are claimed at most once; a row left in 'sending' by a crashed
+  worker is marked failed instead of being resent, so a reply is never
+  delivered twice
+- a 401 Unauthorized opens the bot's circuit and, repeated, deactivates
+  the bot; nothing is sent for inactive bots or to users who blocked the
+  bot (see ``Bot.breaker``)
+"""
+from datetime import timedelta
+from typing import Dict, Any, List, Optional, Tuple
+import asyncio
+import logging
+import uuid
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from telegram import (
+    ForceReply,
+    InlineKeyboardMarkup,
+    ReplyKeyboardMarkup,
+    ReplyKeyboardRemove,
+    TelegramObject,
+)
+from telegram.error import BadRequest, Forbidden, InvalidToken, RetryAfter
+
+from . import breaker
+from .models import OutgoingMessage
+from .client import create_telegram_client
+from .media import MediaError, prepare_media, remember_uploads, send_media
+from .metrics import OUTBOX_UNDELIVERABLE, WORKER_BUSY
+from .tasks import retry_delay, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+# A row still in 'sending' after this long belongs to a crashed worker
+DELIVERY_LEASE = timedelta(minutes=5)
+
+# reply_markup is stored as JSON; the first matching key tells us its class
+REPLY_MARKUP_CLASSES = (
+    ('inline_keyboard', InlineKeyboardMarkup),
+    ('keyboard', ReplyKeyboardMarkup),
+    ('remove_keyboard', ReplyKeyboardRemove),
+    ('force_reply', ForceReply),
+)
+
+# Error class -> Telegram error code recorded on the row
+ERROR_CODES = (
+    (RetryAfter, 429),
+    (InvalidToken, 401),
+    (Forbidden, 403),
+    (BadRequest, 400),
+)
+
+PERMANENT_ERRORS = (BadRequest, Forbidden, InvalidToken, MediaError)
+
+# API methods that do not take a chat_id argument
+CHATLESS_METHODS = frozenset({'answer_callback_query'})
+
+# Why a claimed message is failed without a call
+UNDELIVERABLE_ERRORS = {
+    'bot_inactive': ('Bot is not active', None),
+    'user_blocked': ('User has blocked the bot', 403),
+}
+
+# Result of a message not attempted because an earlier one to its chat failed
+SKIPPED = object()
+
+
+def serialize_payload(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert API call keyword arguments into JSON-storable values"""
+    payload = {}
+    for key, value in kwargs.items():
+        if isinstance(value, TelegramObject):
+            value = value.to_dict()
+        payload[key] = value
+    return payload
+
+
+def deserialize_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Rebuild telegram objects (reply markup) from a stored payload"""
+    kwargs = dict(payload)
+    markup = kwargs.get('reply_markup')
+    if isinstance(markup, dict):
+        for key, markup_class in REPLY_MARKUP_CLASSES:
+            if key in markup:
+                kwargs['reply_markup'] = markup_class.de_json(markup)
+                break
+    return kwargs
+
+
+def enqueue(bot, chat_id: int, method: str = 'send_message', user=None,
+            idempotency_key: Optional[str] = None, **kwargs) -> Tuple[OutgoingMessage, bool]:
+    """
+    Store an outgoing API call for delivery
+
+    Args:
+        bot: TelegramBot model instance
+        chat_id: Target chat
+        method: One of OutgoingMessage.METHOD_CHOICES
+        user: Optional BotUser model instance
+        idempotency_key: Unique key; enqueueing the same key twice is a no-op
+        **kwargs: API call arguments (text, reply_markup, ...)
+
+    Returns:
+        (OutgoingMessage, created)
+    """
+    idempotency_key = idempotency_key or uuid.uuid4().hex
+    try:
+        with transaction.atomic():
+            message = OutgoingMessage.objects.create(
+                bot=bot,
+                user=user,
+                chat_id=chat_id,
+                method=method,
+                payload=serialize_payload(kwargs),
+                idempotency_key=idempotency_key,
+            )
+        return message, True
+    except IntegrityError:
+        return OutgoingMessage.objects.get(idempotency_key=idempotency_key), False
+
+
+def enqueue_many(bot, chat_id: int, calls: List[Tuple[str, Optional[str], Dict[str, Any]]], user=None) -> None:
+    """
+    Store several outgoing API calls for one chat in a single insert
+
+    Args:
+        bot: TelegramBot model instance
+        chat_id: Target chat
+        calls: (method, idempotency key or None, API call arguments) in send order;
+            a key that is already stored is skipped
+        user: Optional BotUser model instance
+    """
+    OutgoingMessage.objects.bulk_create(
+        [
+            OutgoingMessage(
+                bot=bot,
+                user=user,
+                chat_id=chat_id,
+                method=method,
+                payload=serialize_payload(kwargs),
+                idempotency_key=idempotency_key or uuid.uuid4().hex,
+            )
+            for method, idempotency_key, kwargs in calls
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def claim_due_messages(limit: int) -> List[OutgoingMessage]:
+    """Claim up to ``limit`` due messages for this worker"""
+    now = timezone.now()
+
+    # Deliveries in doubt are not retried (at-most-once)
+    OutgoingMessage.objects.filter(status='sending', updated_at__lt=now - DELIVERY_LEASE).update(
+        status='failed', last_error='Delivery interrupted, not retried to avoid a duplicate', updated_at=now
+    )
+
+    candidates = list(
+        OutgoingMessage.objects
+        .filter(status='pending', run_after__lte=now)
+        .select_related('bot')
+        .order_by('id')[:limit]
+    )
+    if not candidates:
+        return []
+
+    # Keep replies in order: skip chats with an older message still waiting for a retry
+    waiting = {}
+    for bot_id, chat_id, waiting_id in (
+        OutgoingMessage.objects
+        .filter(
+            status='pending',
+            run_after__gt=now,
+            id__lt=candidates[-1].id,
+            chat_id__in={message.chat_id for message in candidates},
+        )
+        .values_list('bot_id', 'chat_id', 'id')
+    ):
+        key = (bot_id, chat_id)
+        waiting[key] = min(waiting_id, waiting.get(key, waiting_id))
+
+    blocked = breaker.blocked_chats(candidates)
+    undeliverable = {}
+    # A bot whose messages got 401 Unauthorized is half-open: one message probes its token
+    probing = {message.bot_id for message in candidates if message.error_code == 401}
+    probed = set()
+
+    claimed = []
+    for message in candidates:
+        if waiting.get((message.bot_id, message.chat_id), message.id) < message.id:
+            continue
+        if not message.bot.is_active:
+            undeliverable.setdefault('bot_inactive', []).append(message.pk)
+            continue
+        if (message.bot_id, message.chat_id) in blocked:
+            undeliverable.setdefault('user_blocked', []).append(message.pk)
+            continue
+        if message.bot_id in probing:
+            if message.bot_id in probed:
+                continue
+            probed.add(message.bot_id)
+        updated = OutgoingMessage.objects.filter(pk=message.pk, status='pending').update(
+            status='sending',
+            attempts=message.attempts + 1,
+            updated_at=now,
+        )
+        if updated:
+            message.status = 'sending'
+            message.attempts += 1
+            claimed.append(message)
+
+    for reason, ids in undeliverable.items():
+        last_error, error_code = UNDELIVERABLE_ERRORS[reason]
+        failed = OutgoingMessage.objects.filter(pk__in=ids, status='pending').update(
+            status='failed', last_error=last_error, error_code=error_code, updated_at=now
+        )
+        OUTBOX_UNDELIVERABLE.inc((reason,), failed)
+
+    return claimed
+
+
+def error_code_for(error: Exception) -> Optional[int]:
+    for error_class, code in ERROR_CODES:
+        if isinstance(error, error_class):
+            return code
+    return None
+
+
+async def deliver_message(message: OutgoingMessage, clients: Dict[str, Any], media: Optional[Dict] = None):
+    """Perform the API call for one message, returning (result, error)"""
+    client = clients.get(message.bot.token)
+    if client is None:
+        client = clients[message.bot.token] = create_telegram_client(message.bot.token)
+
+    try:
+        method = getattr(client, message.method)
+        kwargs = deserialize_payload(message.payload)
+        if message.method not in CHATLESS_METHODS:
+            kwargs['chat_id'] = message.chat_id
+        upload = media.get(message.pk) if media else None
+        if isinstance(upload, MediaError):
+            raise upload
+        if upload is not None:
+            return await send_media(method, kwargs, upload), None
+        result = await method(**kwargs)
+        return result, None
+    except Exception as e:
+        return None, e
+
+
+async def deliver_messages(messages: List[OutgoingMessage], concurrency: int, media: Optional[Dict] = None):
+    """
+    Deliver messages, chats in parallel and each chat's messages in order
+
+    Once a message fails, the rest of that chat's messages in the batch are
+    not attempted (result SKIPPED) so they stay queued behind it; after a
+    401 Unauthorized, neither are the rest of that bot's messages.
+    ``media`` is the batch's prepared media files (see ``Bot.media``).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    clients = {}
+    results = {}
+    revoked = set()
+
+    chats = {}
+    for message in messages:
+        chats.setdefault((message.bot_id, message.chat_id), []).append(message)
+
+    async def run_chat(chat_messages):
+        async with semaphore:
+            with WORKER_BUSY.track_inprogress(('outbox',)):
+                for index, message in enumerate(chat_messages):
+                    if message.bot_id in revoked:
+                        for skipped in chat_messages[index:]:
+                            results[skipped.pk] = (SKIPPED, None)
+                        break
+                    results[message.pk] = await deliver_message(message, clients, media)
+                    error = results[message.pk][1]
+                    if error is not None:
+                        if isinstance(error, InvalidToken):
+                            revoked.add(message.bot_id)
+                        for skipped in chat_messages[index + 1:]:
+                            results[skipped.pk] = (SKIPPED, None)
+                        break
+
+    await asyncio.gather(*(run_chat(chat_messages) for chat_messages in chats.values()))
+    return [results[message.pk] for message in messages]
+
+
+def record_result(message: OutgoingMessage, result, error: Optional[Exception]) -> None:
+    """Persist the outcome of a delivery attempt"""
+    now = timezone.now()
+    rows = OutgoingMessage.objects.filter(pk=message.pk)
+
+    if result is SKIPPED:
+        # Not attempted because an earlier message to the same chat failed
+        rows.update(status='pending', attempts=message.attempts - 1, updated_at=now)
+        return
+
+    # Editing a message to the text it already has (a button pressed twice)
+    if isinstance(error, BadRequest) and 'message is not modified' in str(error).lower():
+        error = None
+
+    if error is None:
+        rows.update(
+            status='sent',
+            sent_at=now,
+            updated_at=now,
+            last_error=None,
+            telegram_message_id=getattr(result, 'message_id', None),
+        )
+        return
+
+    error_code = error_code_for(error)
+
+    if isinstance(error, RetryAfter):
+        # Honour Telegram's flood wait exactly for every pending message of this bot;
+        # a flood wait is not a failed attempt
+        run_after = now + timedelta(seconds=retry_after_seconds(error))
+        rows.update(
+            status='pending', attempts=message.attempts - 1, run_after=run_after,
+            last_error=str(error), error_code=error_code, updated_at=now,
+        )
+        OutgoingMessage.objects.filter(
+            bot_id=message.bot_id, status='pending', run_after__lt=run_after
+        ).update(run_after=run_after)
+        logger.warning(f"Flood wait for bot {message.bot.name}: retry after {run_after}")
+
+    elif isinstance(error, InvalidToken):
+        # Not the message's fault: it waits for the bot's circuit (see process_outbox)
+        rows.update(
+            status='pending', attempts=message.attempts - 1,
+            last_error=str(error), error_code=error_code, updated_at=now,
+        )
+
+    elif isinstance(error, PERMANENT_ERRORS) or message.attempts >= message.max_attempts:
+        rows.update(status='failed', last_error=str(error), error_code=error_code, updated_at=now)
+        logger.error(f"Outgoing message {message.pk} to {message.chat_id} failed: {error}")
+        if breaker.is_blocked_error(error):
+            breaker.mark_blocked(message.bot_id, message.chat_id)
+
+    else:
+        delay = retry_delay(message.attempts)
+        rows.update(
+            status='pending', run_after=now + timedelta(seconds=delay),
+            last_error=str(error), error_code=error_code, updated_at=now,
+        )
+        logger.warning(
+            f"Outgoing message {message.pk} attempt {message.attempts} failed, "
+            f"retrying in {delay:.1f}s: {error}"
+        )
+
+
+def process_outbox(limit: int = 100, concurrency: int = 10) -> int:
+    """
+    Claim and deliver due outgoing messages
+
+    Returns:
+        Number of messages processed
+    """
+    messages = claim_due_messages(limit)
+    if not messages:
+        return 0
+
+    media = prepare_media(messages)
+    results = asyncio.run(deliver_messages(messages, concurrency, media))
+    remember_uploads(media)
+
+    revoked = {}
+    for message, (result, error) in zip(messages, results):
+        record_result(message, result, error)
+        if isinstance(error, InvalidToken):
+            revoked[message.bot_id] = message.bot
+
+    for bot in revoked.values():
+        breaker.trip(bot)
+
+    return len(messages)
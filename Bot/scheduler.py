@@ -0,0 +1,305 @@
+"""
+Scheduled messages - durable jobs fired by a hierarchical timer wheel
+
+Services call ``schedule``/``cancel`` to store ScheduledJob rows. The
+``run_scheduler`` worker keeps the jobs due within the next ``horizon``
+seconds in a TimerWheel, so inserting is O(1) and a tick only touches
+the jobs that are due, however many are pending. Due jobs are handed to
+the outbox in bulk with idempotency keys derived from the job and its
+run number, so two schedulers (or a crash between the two writes) never
+send a job twice.
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Union
+import logging
+import time
+
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from . import metrics
+from .models import OutgoingMessage, ScheduledJob
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    """
+    Hierarchical timing wheel
+
+    Level 0 has ``2 ** bits`` buckets of one tick each; a bucket of every
+    higher level spans a full revolution of the level below. An item goes
+    into the bucket of the lowest level whose range covers its deadline
+    (O(1)); whenever a level wraps, the next bucket of the level above is
+    cascaded into the finer levels.
+    """
+
+    def __init__(self, tick: float = 1.0, bits: int = 8, levels: int = 4, now: Optional[float] = None):
+        """
+        Args:
+            tick: Seconds per tick (the timer resolution)
+            bits: log2 of the buckets per level
+            levels: Number of levels; the wheel spans 2 ** (bits * levels) ticks
+            now: Start time (seconds since the epoch), defaults to the current time
+        """
+        self.tick = tick
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.levels = levels
+        self.wheels = [[[] for _ in range(1 << bits)] for _ in range(levels)]
+        self.current = int((time.time() if now is None else now) // tick)
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, when: float, item: Any) -> None:
+        """Add an item due at ``when`` (seconds since the epoch); overdue items fire on the next tick"""
+        self._insert(max(int(when // self.tick), self.current + 1), item)
+        self.size += 1
+
+    def _insert(self, expires: int, item: Any) -> None:
+        # Lowest level where the deadline falls within the current revolution
+        for level in range(self.levels - 1):
+            if expires >> (self.bits * (level + 1)) == self.current >> (self.bits * (level + 1)):
+                break
+        else:
+            level = self.levels - 1
+        self.wheels[level][(expires >> (self.bits * level)) & self.mask].append((expires, item))
+
+    def _cascade(self, level: int) -> None:
+        bucket_index = (self.current >> (self.bits * level)) & self.mask
+        bucket = self.wheels[level][bucket_index]
+        self.wheels[level][bucket_index] = []
+        for expires, item in bucket:
+            self._insert(expires, item)
+
+    def advance(self, now: Optional[float] = None) -> List[Any]:
+        """Move the wheel to ``now`` and return the items that became due"""
+        target = int((time.time() if now is None else now) // self.tick)
+        due = []
+        while self.current < target:
+            self.current += 1
+            # When levels wrap, refill the finer levels from the coarsest one down
+            wrapped = 0
+            while wrapped < self.levels - 1 and not (self.current >> (self.bits * wrapped)) & self.mask:
+                wrapped += 1
+            for level in range(wrapped, 0, -1):
+                self._cascade(level)
+
+            bucket_index = self.current & self.mask
+            bucket = self.wheels[0][bucket_index]
+            if bucket:
+                self.wheels[0][bucket_index] = []
+                for expires, item in bucket:
+                    if expires <= self.current:
+                        due.append(item)
+                    else:
+                        # Items beyond the wheel's span come round again
+                        self._insert(expires, item)
+        self.size -= len(due)
+        return due
+
+
+def schedule(bot_user, name: str, when: Union[datetime, timedelta, float], text: Optional[str] = None,
+             method: str = 'send_message', interval: Optional[float] = None,
+             only_in_state: Optional[str] = None, **kwargs) -> ScheduledJob:
+    """
+    Schedule an API call to a user, replacing a pending job of the same name
+
+    Args:
+        bot_user: BotUser model instance
+        name: Per-user job name
+        when: Datetime, or delay as a timedelta or seconds
+        text: Message text (send_message)
+        method: One of OutgoingMessage.METHOD_CHOICES
+        interval: Seconds between runs for a recurring job
+        only_in_state: Skip unless the user is still in this state when the job fires
+        **kwargs: Further API call arguments
+
+    Returns:
+        The new ScheduledJob
+    """
+    from .outbox import serialize_payload
+
+    if isinstance(when, (int, float)):
+        when = timedelta(seconds=when)
+    if isinstance(when, timedelta):
+        when = timezone.now() + when
+    if text is not None:
+        kwargs['text'] = text
+
+    with transaction.atomic():
+        cancel(bot_user, name)
+        return ScheduledJob.objects.create(
+            bot_id=bot_user.bot_id,
+            user=bot_user,
+            name=name,
+            method=method,
+            payload=serialize_payload(kwargs),
+            only_in_state=only_in_state,
+            run_at=when,
+            interval=int(interval) if interval else None,
+        )
+
+
+def cancel(bot_user, name: str) -> bool:
+    """Cancel the user's pending job of this name; True if there was one"""
+    return bool(
+        ScheduledJob.objects.filter(user=bot_user, name=name, status='pending').update(
+            status='cancelled', updated_at=timezone.now()
+        )
+    )
+
+
+def fire_jobs(job_ids: List[int], now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Hand due jobs to the outbox
+
+    Jobs that were cancelled, rescheduled or fired by another scheduler
+    meanwhile are left alone.
+
+    Returns:
+        {'sent': count, 'skipped': count, 'reschedule': [(job_id, run_at), ...]}
+        where ``reschedule`` lists recurring or moved jobs still pending
+    """
+    now = now or timezone.now()
+    result = {'sent': 0, 'skipped': 0, 'reschedule': []}
+
+    jobs = list(
+        ScheduledJob.objects
+        .filter(pk__in=job_ids, status='pending')
+        .select_related('user')
+    )
+    messages, done, skipped, recurring = [], [], [], []
+    for job in jobs:
+        if job.run_at > now:
+            # Loaded for an earlier run_at; wait for the current one
+            result['reschedule'].append((job.pk, job.run_at))
+            continue
+
+        user = job.user
+        if user.is_blocked or (job.only_in_state and user.user_state != job.only_in_state):
+            skipped.append(job.pk)
+            continue
+
+        messages.append(OutgoingMessage(
+            bot_id=job.bot_id,
+            user=user,
+            chat_id=user.chat_id,
+            method=job.method,
+            payload=job.payload,
+            idempotency_key=f"job:{job.pk}:{job.runs + 1}",
+        ))
+        if job.interval:
+            run_at = job.run_at + timedelta(seconds=job.interval)
+            # A scheduler that was down skips the missed runs instead of sending them all
+            while run_at <= now:
+                run_at += timedelta(seconds=job.interval)
+            recurring.append((job, run_at))
+            result['reschedule'].append((job.pk, run_at))
+        else:
+            done.append(job.pk)
+
+    # Messages and the jobs' next runs are committed together: a run is never
+    # moved on without its message queued
+    with transaction.atomic():
+        OutgoingMessage.objects.bulk_create(messages, ignore_conflicts=True)
+        for job, run_at in recurring:
+            ScheduledJob.objects.filter(pk=job.pk, status='pending', run_at=job.run_at).update(
+                run_at=run_at, runs=F('runs') + 1, last_run_at=now, updated_at=now
+            )
+        if done:
+            ScheduledJob.objects.filter(pk__in=done, status='pending').update(
+                status='done', runs=F('runs') + 1, last_run_at=now, updated_at=now
+            )
+        if skipped:
+            ScheduledJob.objects.filter(pk__in=skipped, status='pending').update(
+                status='skipped', last_run_at=now, updated_at=now
+            )
+
+    result['sent'] = len(messages)
+    result['skipped'] = len(skipped)
+    metrics.SCHEDULED_JOBS_FIRED.inc(('sent',), len(messages))
+    metrics.SCHEDULED_JOBS_FIRED.inc(('skipped',), len(skipped))
+    return result
+
+
+class Scheduler:
+    """
+    Keeps pending jobs due within ``horizon`` seconds in a TimerWheel
+
+    Jobs further out are loaded as the horizon moves forward; jobs created
+    by services meanwhile are picked up by polling for new IDs.
+    """
+
+    def __init__(self, tick: float = 1.0, horizon: float = 3600, batch_size: int = 5000):
+        """
+        Args:
+            tick: Timer resolution in seconds
+            horizon: Seconds ahead whose jobs are held in memory
+            batch_size: Rows read per query when loading jobs
+        """
+        self.wheel = TimerWheel(tick=tick)
+        self.horizon = horizon
+        self.batch_size = batch_size
+        self.loaded_until = None
+        self.last_id = 0
+        self._reported_size = 0
+
+    def _report_size(self) -> None:
+        metrics.SCHEDULER_WHEEL_JOBS.inc(amount=len(self.wheel) - self._reported_size)
+        self._reported_size = len(self.wheel)
+
+    def add(self, job_id: int, run_at: datetime) -> None:
+        if self.loaded_until is None or run_at < self.loaded_until:
+            self.wheel.add(run_at.timestamp(), job_id)
+
+    def load(self, now: datetime) -> int:
+        """Load jobs entering the horizon and jobs created since the last call"""
+        loaded = 0
+
+        # New jobs first, so none created during the window load is missed
+        newest = ScheduledJob.objects.aggregate(newest=Max('id'))['newest'] or 0
+        if self.loaded_until is not None:
+            for job_id, run_at in (
+                ScheduledJob.objects
+                .filter(pk__gt=self.last_id, pk__lte=newest, status='pending', run_at__lt=self.loaded_until)
+                .values_list('id', 'run_at')
+                .iterator(chunk_size=self.batch_size)
+            ):
+                self.wheel.add(run_at.timestamp(), job_id)
+                loaded += 1
+        self.last_id = newest
+
+        # Move the horizon in half steps so each window is read once
+        until = now + timedelta(seconds=self.horizon)
+        if self.loaded_until is None or until - self.loaded_until >= timedelta(seconds=self.horizon / 2):
+            window = ScheduledJob.objects.filter(status='pending', run_at__lt=until)
+            if self.loaded_until is not None:
+                window = window.filter(run_at__gte=self.loaded_until)
+            for job_id, run_at in window.values_list('id', 'run_at').iterator(chunk_size=self.batch_size):
+                self.wheel.add(run_at.timestamp(), job_id)
+                loaded += 1
+            self.loaded_until = until
+
+        self._report_size()
+        return loaded
+
+    def run_once(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Load new jobs, then fire everything that is due"""
+        now = now or timezone.now()
+        loaded = self.load(now)
+
+        due = self.wheel.advance(now.timestamp())
+        sent = skipped = 0
+        for start in range(0, len(due), self.batch_size):
+            result = fire_jobs(due[start:start + self.batch_size], now)
+            sent += result['sent']
+            skipped += result['skipped']
+            for job_id, run_at in result['reschedule']:
+                self.add(job_id, run_at)
+
+        self._report_size()
+        return {'loaded': loaded, 'due': len(due), 'sent': sent, 'skipped': skipped}
@@ -1,4 +1,11 @@
 from .factory import BotServiceFactory
-from .base import BaseBotService
 
 __all__ = ['BotServiceFactory', 'BaseBotService']
+
+
+def __getattr__(name):
+    # BaseBotService imports the Telegram library: only when asked for
+    if name == 'BaseBotService':
+        from .base import BaseBotService
+        return BaseBotService
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -2,25 +2,151 @@
 Base Bot Service - Abstract class for all bot type handlers
 """
 from abc import ABC, abstractmethod
-from telegram import Bot as TelegramBotClient, ReplyKeyboardMarkup, KeyboardButton
-from typing import Dict, Any, Optional
+from telegram import ReplyKeyboardMarkup, KeyboardButton
+from typing import TYPE_CHECKING, Dict, Any, Optional, Tuple
+
+from Bot import metrics, templating, tracing
+from Bot.log import event
+
+if TYPE_CHECKING:
+    from telegram import Bot as TelegramBotClient
+
+
+def optional_hook(method):
+    """Mark a base class no-op: update types only it would handle are not requested from Telegram"""
+    method.is_optional_hook = True
+    return method
 
 
 class BaseBotService(ABC):
     """Base class for bot service handlers"""
     
-    def __init__(self, bot, bot_user, telegram_client: TelegramBotClient):
+    # Update type -> entry point handler run by ``dispatch``
+    UPDATE_HANDLERS = {
+        'message': 'handle_message',
+        'edited_message': 'handle_edited_message',
+        'callback_query': 'handle_callback_query',
+        'my_chat_member': 'handle_my_chat_member',
+    }
+    # Update type -> the method subclasses override to handle it, when not the entry point
+    UPDATE_HOOKS = {
+        'callback_query': 'handle_callback',
+    }
+    
+    # Idle session compaction (see Bot.sessions): users idle in one of
+    # SESSION_STATES are moved to IDLE_USER_STATE and lose the partial data
+    # in SESSION_STATE_KEYS; TRANSIENT_STATE_KEYS are dropped from every idle user
+    SESSION_STATES = frozenset()
+    SESSION_STATE_KEYS = frozenset()
+    TRANSIENT_STATE_KEYS = frozenset()
+    IDLE_USER_STATE = 'welcomed'
+    
+    def __init__(self, bot, bot_user, update_id: Optional[int] = None,
+                 telegram_client: Optional['TelegramBotClient'] = None):
         """
         Initialize bot service
         
         Args:
             bot: TelegramBot model instance
             bot_user: BotUser model instance
-            telegram_client: Telegram Bot API client
+            update_id: Telegram update being handled, used for outbox idempotency keys
+            telegram_client: Telegram Bot API client (default: created on first use)
         """
         self.bot = bot
         self.bot_user = bot_user
-        self.telegram_client = telegram_client
+        self._telegram_client = telegram_client
+        self.update_id = update_id
+        self._outgoing_count = 0
+        # API calls made by the running handler, stored by flush_api_calls
+        self.pending_calls = []
+        # Set while handling an inline keyboard press: the message to edit
+        self.callback_message_id = None
+    
+    @classmethod
+    def compact_idle_state(cls, user_state: str, state_data: Optional[Dict]) -> Tuple[str, Dict]:
+        """
+        State of a user who abandoned the conversation
+        
+        Args:
+            user_state: Current user_state
+            state_data: Current state_data
+        
+        Returns:
+            (user_state, state_data) to store
+        """
+        drop = cls.TRANSIENT_STATE_KEYS
+        if user_state in cls.SESSION_STATES:
+            user_state = cls.IDLE_USER_STATE
+            drop = drop | cls.SESSION_STATE_KEYS
+        return user_state, {key: value for key, value in (state_data or {}).items() if key not in drop}
+    
+    @classmethod
+    def handled_update_types(cls) -> Tuple[str, ...]:
+        """
+        Update types this service handles, registered as the webhook's allowed_updates
+        
+        A type is handled unless its handler (or hook) is still the base
+        class no-op marked with ``optional_hook``.
+        """
+        handled = cls.__dict__.get('_handled_update_types')
+        if handled is None:
+            handled = tuple(
+                update_type for update_type, handler in cls.UPDATE_HANDLERS.items()
+                if not getattr(getattr(cls, cls.UPDATE_HOOKS.get(update_type, handler)), 'is_optional_hook', False)
+            )
+            cls._handled_update_types = handled
+        return handled
+    
+    async def dispatch(self, handler: str, argument: Any) -> None:
+        """
+        Run an entry point handler, then store the API calls it made
+        
+        A handler interrupted by a state conflict leaves nothing in the
+        outbox, so it can be re-run on a reloaded user (see ``reloaded``).
+        
+        Args:
+            handler: One of UPDATE_HANDLERS, or handle_contact
+            argument: The handler's argument
+        """
+        await getattr(self, handler)(argument)
+        self.flush_api_calls()
+    
+    def reloaded(self) -> 'BaseBotService':
+        """A fresh service for the same update, with the user's current state"""
+        from Bot.models import BotUser
+        
+        bot_user = BotUser.objects.get(pk=self.bot_user.pk)
+        return type(self)(self.bot, bot_user, update_id=self.update_id, telegram_client=self._telegram_client)
+    
+    @property
+    def telegram_client(self) -> 'TelegramBotClient':
+        """
+        Bot API client for calls that cannot wait for the outbox
+        
+        Replies go through the outbox, so most updates never need one; it is
+        created the first time a handler asks for it.
+        """
+        if self._telegram_client is None:
+            from Bot.client import create_telegram_client
+            
+            self._telegram_client = create_telegram_client(self.bot.token)
+        return self._telegram_client
+    
+    def save_state(self, *fields: str) -> None:
+        """
+        Save user fields, failing if another update saved the user meanwhile
+        
+        Raises:
+            StaleUserState: Reload the user and re-run the handler
+        """
+        from Bot.models import StaleUserState
+        
+        try:
+            self.bot_user.save_state(fields)
+        except StaleUserState:
+            metrics.USER_STATE_SAVES.inc((self.bot.bot_type, 'conflict'))
+            raise
+        metrics.USER_STATE_SAVES.inc((self.bot.bot_type, 'ok'))
     
     async def handle_message(self, message_data: Dict[str, Any]) -> None:
         """
@@ -32,10 +158,47 @@ class BaseBotService(ABC):
         text = message_data.get('text', '')
         
         # Check if it's a command
-        if text.startswith('/'):
-            await self.handle_command(text, message_data)
-        else:
-            await self.handle_text(text, message_data)
+        with tracing.span('handle_message', command=text.startswith('/')):
+            if text.startswith('/'):
+                await self.handle_command(text, message_data)
+            else:
+                await self.handle_text(text, message_data)
+    
+    async def handle_callback_query(self, callback_query: Dict[str, Any]) -> None:
+        """
+        Main entry point for inline keyboard button presses
+        
+        The query is answered right away so Telegram stops the button's
+        loading indicator; replies made while handling it through
+        ``respond`` edit the message carrying the keyboard in place.
+        
+        Args:
+            callback_query: Telegram callback query data
+        """
+        data = callback_query.get('data') or ''
+        self.callback_message_id = (callback_query.get('message') or {}).get('message_id')
+        
+        with tracing.span('handle_callback_query'):
+            await self.call_api('answer_callback_query', callback_query_id=callback_query.get('id'))
+            await self.handle_callback(data, callback_query)
+    
+    @optional_hook
+    async def handle_edited_message(self, message_data: Dict[str, Any]) -> None:
+        """Handle an edited message - can be overridden by subclasses"""
+        pass
+    
+    async def handle_my_chat_member(self, chat_member: Dict[str, Any]) -> None:
+        """
+        Track whether the user blocked the bot, so nothing is sent to them meanwhile
+        
+        Args:
+            chat_member: Telegram chat member updated data
+        """
+        status = (chat_member.get('new_chat_member') or {}).get('status')
+        is_blocked = status in ('kicked', 'left')
+        if is_blocked != self.bot_user.is_blocked:
+            self.bot_user.is_blocked = is_blocked
+            self.save_state('is_blocked')
     
     async def handle_command(self, command: str, message_data: Dict[str, Any]) -> None:
         """Handle bot commands"""
@@ -55,9 +218,9 @@ class BaseBotService(ABC):
             # Combine welcome message with phone request in one message
             combined_message = ""
             if self.bot.has_welcome_message and self.bot.welcome_message_text:
-                combined_message = self.bot.welcome_message_text + "\n\n"
+                combined_message = self.render(self.bot.welcome_message_text) + "\n\n"
             
-            combined_message += self.bot.get_number_text or "Please share your phone number to continue."
+            combined_message += self.render(self.bot.get_number_text or "Please share your phone number to continue.")
             
             # Send combined message with phone button
             from telegram import ReplyKeyboardMarkup, KeyboardButton
@@ -67,14 +230,10 @@ class BaseBotService(ABC):
                 one_time_keyboard=True
             )
             
-            await self.telegram_client.send_message(
-                chat_id=self.bot_user.chat_id,
-                text=combined_message,
-                reply_markup=keyboard
-            )
+            await self.send_message(combined_message, reply_markup=keyboard)
             
             self.bot_user.user_state = 'awaiting_phone'
-            self.bot_user.save(update_fields=['user_state'])
+            self.save_state('user_state')
         else:
             # Phone already provided or not required - show welcome or registered message
             if self.bot_user.phone_number:
@@ -82,12 +241,12 @@ class BaseBotService(ABC):
                 welcome_back = f"Welcome back! 👋\n\nYour phone: {self.bot_user.phone_number}"
                 await self.send_message(welcome_back)
                 self.bot_user.user_state = 'registered'
-                self.bot_user.save(update_fields=['user_state'])
+                self.save_state('user_state')
             elif self.bot.has_welcome_message and self.bot.welcome_message_text:
                 # Just send welcome message
-                await self.send_message(self.bot.welcome_message_text)
+                await self.send_message(self.render(self.bot.welcome_message_text))
                 self.bot_user.user_state = 'welcomed'
-                self.bot_user.save(update_fields=['user_state'])
+                self.save_state('user_state')
     
     async def handle_help(self, message_data: Dict[str, Any]) -> None:
         """Handle /help command"""
@@ -102,16 +261,12 @@ class BaseBotService(ABC):
             one_time_keyboard=True
         )
         
-        text = self.bot.get_number_text or "Please share your phone number to continue."
+        text = self.render(self.bot.get_number_text or "Please share your phone number to continue.")
         
-        await self.telegram_client.send_message(
-            chat_id=self.bot_user.chat_id,
-            text=text,
-            reply_markup=keyboard
-        )
+        await self.send_message(text, reply_markup=keyboard)
         
         self.bot_user.user_state = 'awaiting_phone'
-        self.bot_user.save(update_fields=['user_state'])
+        self.save_state('user_state')
     
     async def handle_contact(self, contact_data: Dict[str, Any]) -> None:
         """Handle contact (phone number) sharing"""
@@ -119,17 +274,20 @@ class BaseBotService(ABC):
         import logging
         logger = logging.getLogger(__name__)
         
-        logger.info(f"handle_contact called with: {contact_data}")
         phone_number = contact_data.get('phone_number')
-        logger.info(f"Extracted phone number: {phone_number}")
+        logger.info(event(
+            'contact_received', bot_id=self.bot.id, chat_id=self.bot_user.chat_id, phone_number=phone_number
+        ))
         
         if phone_number:
             self.bot_user.phone_number = phone_number
             self.bot_user.user_state = 'registered'
-            self.bot_user.save(update_fields=['phone_number', 'user_state'])
+            self.save_state('phone_number', 'user_state')
             
             # Get custom message or use default
-            thank_you_message = self.bot.after_phone_number_text or "✅ Thank you! Your phone number has been saved."
+            thank_you_message = self.render(
+                self.bot.after_phone_number_text or "✅ Thank you! Your phone number has been saved."
+            )
             
             # Send message and remove keyboard
             await self.send_message(
@@ -138,19 +296,99 @@ class BaseBotService(ABC):
             )
             await self.after_phone_number_received()
     
+    def render(self, text: Optional[str], **extra) -> str:
+        """Render a bot or flow text for this user (see ``Bot.templating``)"""
+        return templating.render(text, self.bot_user, self.bot, **extra)
+    
     async def send_message(self, text: str, **kwargs) -> None:
-        """Send message to user"""
-        await self.telegram_client.send_message(
-            chat_id=self.bot_user.chat_id,
-            text=text,
-            **kwargs
-        )
+        """Queue a message to the user (delivered by the outbox worker)"""
+        with tracing.span('send_message'):
+            await self.call_api('send_message', text=text, **kwargs)
+    
+    async def send_media(self, kind: str, path: str, caption: Optional[str] = None, **kwargs) -> None:
+        """
+        Queue a photo, document, video or audio file from BOT_MEDIA_ROOT
+        
+        The file is uploaded on its first send only (see ``Bot.media``).
+        
+        Args:
+            kind: photo, document, video or audio
+            path: File path relative to BOT_MEDIA_ROOT
+            caption: Optional caption
+        """
+        if caption:
+            kwargs['caption'] = caption
+        with tracing.span('send_media', kind=kind):
+            await self.call_api(f'send_{kind}', media_path=path, **kwargs)
+    
+    async def edit_message(self, text: str, **kwargs) -> None:
+        """Queue an edit of the message whose inline keyboard was pressed"""
+        with tracing.span('edit_message'):
+            await self.call_api('edit_message_text', message_id=self.callback_message_id, text=text, **kwargs)
+    
+    async def respond(self, text: str, **kwargs) -> None:
+        """Edit the pressed menu in place when handling a button, otherwise send a new message"""
+        if self.callback_message_id is not None:
+            await self.edit_message(text, **kwargs)
+        else:
+            await self.send_message(text, **kwargs)
+    
+    async def call_api(self, method: str, **kwargs) -> None:
+        """
+        Queue a Telegram API call for this user in the outbound outbox
+        
+        Calls made while handling the same update get stable idempotency keys,
+        so a redelivered update never sends the same reply twice. They are
+        stored when the handler completes (see ``dispatch``).
+        """
+        idempotency_key = None
+        if self.update_id is not None:
+            self._outgoing_count += 1
+            idempotency_key = f"{self.bot.id}:{self.update_id}:{self._outgoing_count}"
+        
+        self.pending_calls.append((method, idempotency_key, kwargs))
+    
+    def flush_api_calls(self) -> None:
+        """Store the queued API calls in the outbox, in one insert"""
+        from Bot.outbox import enqueue_many
+        
+        if self.pending_calls:
+            enqueue_many(self.bot, self.bot_user.chat_id, self.pending_calls, user=self.bot_user)
+            self.pending_calls = []
+    
+    def schedule(self, name: str, delay: float, text: Optional[str] = None, **kwargs) -> None:
+        """
+        Send this user a message later (see ``Bot.scheduler.schedule``)
+        
+        Scheduling a name again replaces the pending job, so re-entering a
+        state moves its reminder instead of adding another one.
+        
+        Args:
+            name: Per-user job name
+            delay: Seconds from now
+            text: Message text
+            **kwargs: interval, only_in_state, method and API call arguments
+        """
+        from Bot.scheduler import schedule
+        
+        schedule(self.bot_user, name, delay, text, **kwargs)
+    
+    def cancel_scheduled(self, name: str) -> bool:
+        """Cancel this user's pending job of this name"""
+        from Bot.scheduler import cancel
+        
+        return cancel(self.bot_user, name)
     
     @abstractmethod
     async def handle_text(self, text: str, message_data: Dict[str, Any]) -> None:
         """Handle regular text messages - must be implemented by subclasses"""
         pass
     
+    @optional_hook
+    async def handle_callback(self, data: str, callback_query: Dict[str, Any]) -> None:
+        """Handle inline keyboard button data - can be overridden by subclasses"""
+        pass
+    
     async def handle_custom_command(self, command: str, message_data: Dict[str, Any]) -> None:
         """Handle custom commands - can be overridden by subclasses"""
         await self.send_message(f"Unknown command: {command}")
@@ -2,12 +2,22 @@
 Custom Bot Service - Uses flow-based configuration
 """
 from .base import BaseBotService
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from typing import Dict, Any
 
+# Callback data prefix of menu flow buttons: "menu:<flow id>[:<button index>]"
+MENU_CALLBACK_PREFIX = 'menu'
+
+# Flow keys naming a media file to send, e.g. {"photo": "menu.jpg", "text": "..."}
+MEDIA_KINDS = ('photo', 'document', 'video', 'audio')
+
 
 class CustomBotService(BaseBotService):
     """Custom bot that uses BotFlow configurations"""
     
+    # Position in a multi-step flow; an idle user starts the flow over
+    TRANSIENT_STATE_KEYS = frozenset({'current_step'})
+    
     async def handle_text(self, text: str, message_data: Dict[str, Any]) -> None:
         """Handle text using flow configuration"""
         
@@ -54,7 +64,7 @@ class CustomBotService(BaseBotService):
         
         # Simple response flow
         if 'response' in flow_data:
-            await self.send_message(flow_data['response'])
+            await self.send_flow_message(flow_data, flow_data['response'])
         
         # Multi-step flow
         elif 'steps' in flow_data:
@@ -62,7 +72,15 @@ class CustomBotService(BaseBotService):
         
         # Menu flow
         elif flow_data.get('type') == 'menu':
-            await self.execute_menu_flow(flow_data)
+            await self.execute_menu_flow(flow, flow_data)
+    
+    async def send_flow_message(self, data: Dict, text: str) -> None:
+        """Send a flow text, as the caption of the flow's media file if it has one"""
+        for kind in MEDIA_KINDS:
+            if data.get(kind):
+                await self.send_media(kind, data[kind], caption=self.render(text))
+                return
+        await self.send_message(self.render(text))
     
     async def execute_multi_step_flow(self, flow_data: Dict, user_input: str) -> None:
         """Execute multi-step flow"""
@@ -78,7 +96,7 @@ class CustomBotService(BaseBotService):
         
         if current_step:
             # Send message
-            await self.send_message(current_step.get('text', ''))
+            await self.send_flow_message(current_step, current_step.get('text', ''))
             
             # Save data if needed
             if 'save_to' in current_step:
@@ -94,15 +112,61 @@ class CustomBotService(BaseBotService):
                 self.bot_user.user_state = 'registered'
             
             self.bot_user.state_data = state_data
-            self.bot_user.save(update_fields=['state_data', 'user_state'])
+            self.save_state('state_data', 'user_state')
+    
+    async def execute_menu_flow(self, flow, flow_data: Dict) -> None:
+        """Show a menu flow as an inline keyboard (edited in place when navigating back)"""
+        text = self.render(flow_data.get('text', 'Choose an option:'))
+        
+        rows = []
+        for index, button in enumerate(flow_data.get('buttons', [])):
+            if button.get('url'):
+                rows.append([InlineKeyboardButton(button.get('text', ''), url=button['url'])])
+            else:
+                # The button's position, not its configured callback_data: always under
+                # Telegram's 64 byte limit and stays valid when the flow is renamed
+                rows.append([InlineKeyboardButton(
+                    button.get('text', ''), callback_data=f"{MENU_CALLBACK_PREFIX}:{flow.id}:{index}"
+                )])
+        
+        await self.respond(text, reply_markup=InlineKeyboardMarkup(rows))
     
-    async def execute_menu_flow(self, flow_data: Dict) -> None:
-        """Execute menu flow"""
-        text = flow_data.get('text', 'Choose an option:')
-        buttons = flow_data.get('buttons', [])
+    async def handle_callback(self, data: str, callback_query: Dict[str, Any]) -> None:
+        """Navigate menu flows"""
+        from Bot.models import BotFlow
+        
+        prefix, _, rest = data.partition(':')
+        if prefix != MENU_CALLBACK_PREFIX:
+            return
+        
+        flow_id, _, index = rest.partition(':')
+        flow = None
+        if flow_id.isdigit():
+            flow = BotFlow.objects.filter(bot=self.bot, is_active=True, pk=int(flow_id)).first()
+        if flow is None or flow.flow_data.get('type') != 'menu':
+            await self.respond("This menu is no longer available.")
+            return
+        
+        buttons = flow.flow_data.get('buttons', [])
+        if not index.isdigit() or int(index) >= len(buttons):
+            # "Back" button, or a button removed since the menu was sent
+            await self.execute_menu_flow(flow, flow.flow_data)
+            return
+        
+        button = buttons[int(index)]
         
-        menu_text = text + "\n\n"
-        for i, button in enumerate(buttons, 1):
-            menu_text += f"{i}. {button.get('text', '')}\n"
+        # Button opening another flow by its trigger command
+        if button.get('flow'):
+            target = BotFlow.objects.filter(
+                bot=self.bot,
+                is_active=True,
+                trigger_command=button['flow']
+            ).first()
+            if target:
+                await self.execute_flow(target, button['flow'])
+                return
         
-        await self.send_message(menu_text)
+        back = InlineKeyboardMarkup([[
+            InlineKeyboardButton("⬅️ Back", callback_data=f"{MENU_CALLBACK_PREFIX}:{flow.id}")
+        ]])
+        await self.respond(self.render(button.get('response') or button.get('text', '')), reply_markup=back)
@@ -1,58 +1,143 @@
 """
 Bot Service Factory - Creates appropriate bot service based on bot type
+
+Service classes are registered by dotted path and imported the first time
+a bot of their type handles an update, so importing the factory (and the
+API that uses it) does not import every service and the Telegram library.
+
+Other packages can add bot types through the ``telegram_service.bot_types``
+entry point group, naming the type and its service class::
+
+    [project.entry-points."telegram_service.bot_types"]
+    shop = "shop_bots.services:ShopBotService"
 """
-from telegram import Bot as TelegramBotClient
-from .base import BaseBotService
-from .simple_bot import SimpleBotService
-from .registration_bot import RegistrationBotService
-from .survey_bot import SurveyBotService
-from .support_bot import SupportBotService
-from .custom_bot import CustomBotService
+from importlib.metadata import entry_points
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+import logging
+import threading
+
+from django.utils.module_loading import import_string
+
+if TYPE_CHECKING:
+    from telegram import Bot as TelegramBotClient
+    from .base import BaseBotService
+
+logger = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = 'telegram_service.bot_types'
+DEFAULT_SERVICE = 'Bot.services.simple_bot.SimpleBotService'
 
 
 class BotServiceFactory:
     """Factory for creating bot service instances based on bot type"""
-    
-    # Map bot types to service classes
+
+    # Map bot types to service classes (dotted paths, imported when first used)
     SERVICE_MAP = {
-        'simple': SimpleBotService,
-        'registration': RegistrationBotService,
-        'survey': SurveyBotService,
-        'support': SupportBotService,
-        'ecommerce': CustomBotService,  # Use custom for ecommerce
-        'custom': CustomBotService,
+        'simple': 'Bot.services.simple_bot.SimpleBotService',
+        'registration': 'Bot.services.registration_bot.RegistrationBotService',
+        'survey': 'Bot.services.survey_bot.SurveyBotService',
+        'support': 'Bot.services.support_bot.SupportBotService',
+        'ecommerce': 'Bot.services.custom_bot.CustomBotService',  # Use custom for ecommerce
+        'custom': 'Bot.services.custom_bot.CustomBotService',
     }
-    
+
+    # Bot type -> imported service class
+    _classes: Dict[str, type] = {}
+    _plugins_loaded = False
+    _lock = threading.Lock()
+
     @classmethod
-    def create_service(cls, bot, bot_user, telegram_client: TelegramBotClient) -> BaseBotService:
+    def create_service(cls, bot, bot_user, update_id: Optional[int] = None,
+                       telegram_client: Optional['TelegramBotClient'] = None) -> 'BaseBotService':
         """
         Create appropriate bot service based on bot type
-        
+
         Args:
             bot: TelegramBot model instance
             bot_user: BotUser model instance
-            telegram_client: Telegram Bot API client
-        
+            update_id: Telegram update being handled
+            telegram_client: Telegram Bot API client (default: created when a handler first uses it)
+
         Returns:
             BaseBotService instance
         """
-        bot_type = bot.bot_type
-        service_class = cls.SERVICE_MAP.get(bot_type, SimpleBotService)
-        
-        return service_class(bot, bot_user, telegram_client)
-    
+        service_class = cls.get_service_class(bot.bot_type)
+
+        return service_class(bot, bot_user, update_id=update_id, telegram_client=telegram_client)
+
     @classmethod
-    def register_service(cls, bot_type: str, service_class: type):
+    def get_service_class(cls, bot_type: str) -> type:
+        """Service class handling a bot type (SimpleBotService for unknown types)"""
+        service_class = cls._classes.get(bot_type)
+        if service_class is not None:
+            return service_class
+
+        cls.load_plugins()
+        with cls._lock:
+            service_class = cls._classes.get(bot_type)
+            if service_class is None:
+                service_class = cls._resolve(cls.SERVICE_MAP.get(bot_type, DEFAULT_SERVICE))
+                cls._classes[bot_type] = service_class
+        return service_class
+
+    @classmethod
+    def _resolve(cls, service: Union[str, type, object]) -> type:
+        """Import a service class given as a dotted path or entry point"""
+        if isinstance(service, str):
+            return import_string(service)
+        if hasattr(service, 'load'):
+            return service.load()
+        return service
+
+    @classmethod
+    def load_plugins(cls) -> None:
+        """
+        Register the bot types of installed packages' entry points (once)
+
+        Plugins do not replace built-in or explicitly registered types.
+        Their classes are imported when first used, like the built-in ones.
+        """
+        if cls._plugins_loaded:
+            return
+        with cls._lock:
+            if cls._plugins_loaded:
+                return
+            for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+                if entry_point.name in cls.SERVICE_MAP:
+                    logger.warning(
+                        f"Bot type {entry_point.name!r} of {entry_point.value} is already registered, ignored"
+                    )
+                    continue
+                cls.SERVICE_MAP[entry_point.name] = entry_point
+            cls._plugins_loaded = True
+
+    @classmethod
+    def register_service(cls, bot_type: str, service_class: Union[str, type]):
         """
         Register a new bot service type
-        
+
         Args:
             bot_type: Type identifier
-            service_class: Service class to handle this type
+            service_class: Service class to handle this type, or its dotted path
         """
-        cls.SERVICE_MAP[bot_type] = service_class
-    
+        with cls._lock:
+            cls.SERVICE_MAP[bot_type] = service_class
+            cls._classes.pop(bot_type, None)
+
     @classmethod
-    def get_available_types(cls):
+    def get_available_types(cls) -> List[str]:
         """Get list of available bot types"""
+        cls.load_plugins()
         return list(cls.SERVICE_MAP.keys())
+
+    @classmethod
+    def get_type_choices(cls) -> List[Tuple[str, str]]:
+        """Choices for TelegramBot.bot_type: the model's types and the registered ones"""
+        from Bot.models import TelegramBot
+
+        choices = list(TelegramBot.BOT_TYPE_CHOICES)
+        known = {value for value, _ in choices}
+        for bot_type in cls.get_available_types():
+            if bot_type not in known:
+                choices.append((bot_type, bot_type.replace('_', ' ').title()))
+        return choices
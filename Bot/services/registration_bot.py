@@ -8,6 +8,8 @@ from typing import Dict, Any
 class RegistrationBotService(BaseBotService):
     """Bot that handles user registration with multiple steps"""
     
+    SESSION_STATES = frozenset({'awaiting_name'})
+    
     async def handle_text(self, text: str, message_data: Dict[str, Any]) -> None:
         """Handle text based on registration state"""
         
@@ -38,7 +40,7 @@ class RegistrationBotService(BaseBotService):
         """Ask user for their name"""
         await self.send_message("What's your name?")
         self.bot_user.user_state = 'awaiting_name'
-        self.bot_user.save(update_fields=['user_state'])
+        self.save_state('user_state')
     
     async def after_phone_number_received(self) -> None:
         """Called after phone number is received"""
@@ -47,7 +49,7 @@ class RegistrationBotService(BaseBotService):
     async def complete_registration(self) -> None:
         """Complete the registration process"""
         self.bot_user.user_state = 'registered'
-        self.bot_user.save(update_fields=['user_state'])
+        self.save_state('user_state')
         
         message = f"✅ Registration complete!\n\n"
         message += f"Name: {self.bot_user.first_name or 'Not provided'}\n"
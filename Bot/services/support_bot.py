@@ -2,12 +2,26 @@
 Support Bot Service - Handles customer support interactions
 """
 from .base import BaseBotService
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from typing import Dict, Any
 
+# (option, button label) of the support menu; options can also be typed
+SUPPORT_MENU_OPTIONS = [
+    ('1', "📝 Create a ticket"),
+    ('2', "📋 Check ticket status"),
+    ('3', "❓ FAQ"),
+    ('4', "📞 Contact support"),
+]
+
+TICKET_CREATED_TEMPLATE = "✅ Ticket created!\n\nTicket ID: {ticket.id}\nStatus: Open\n\nOur team will respond shortly."
+TICKET_STATUS_TEMPLATE = "ID: {ticket.id}\nStatus: {ticket.status}\nDescription: {description}...\n\n"
+
 
 class SupportBotService(BaseBotService):
     """Bot that handles customer support tickets"""
     
+    SESSION_STATES = frozenset({'support_menu', 'creating_ticket'})
+    
     async def handle_text(self, text: str, message_data: Dict[str, Any]) -> None:
         """Handle support messages"""
         
@@ -40,24 +54,38 @@ class SupportBotService(BaseBotService):
     
     async def show_support_menu(self) -> None:
         """Show support menu options"""
-        menu = "🎧 Support Menu\n\n"
-        menu += "1. Create a ticket\n"
-        menu += "2. Check ticket status\n"
-        menu += "3. FAQ\n"
-        menu += "4. Contact support\n\n"
-        menu += "Please enter a number (1-4):"
-        
-        await self.send_message(menu)
-        self.bot_user.user_state = 'support_menu'
-        self.bot_user.save(update_fields=['user_state'])
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton(label, callback_data=f"support:{option}")]
+            for option, label in SUPPORT_MENU_OPTIONS
+        ])
+        
+        await self.respond("🎧 Support Menu\n\nHow can we help you?", reply_markup=keyboard)
+        if self.bot_user.user_state != 'support_menu':
+            self.bot_user.user_state = 'support_menu'
+            self.save_state('user_state')
+    
+    def back_to_menu(self) -> InlineKeyboardMarkup:
+        """Keyboard leading back to the support menu"""
+        return InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="support:menu")]])
+    
+    async def handle_callback(self, data: str, callback_query: Dict[str, Any]) -> None:
+        """Handle support menu buttons"""
+        prefix, _, option = data.partition(':')
+        if prefix != 'support':
+            return
+        
+        if option == 'menu':
+            await self.show_support_menu()
+        else:
+            await self.handle_menu_selection(option)
     
     async def handle_menu_selection(self, text: str) -> None:
         """Handle menu selection"""
         
         if text == '1':
-            await self.send_message("Please describe your issue:")
+            await self.respond("Please describe your issue:")
             self.bot_user.user_state = 'creating_ticket'
-            self.bot_user.save(update_fields=['user_state'])
+            self.save_state('user_state')
         
         elif text == '2':
             await self.check_ticket_status()
@@ -69,7 +97,7 @@ class SupportBotService(BaseBotService):
             await self.show_contact_info()
         
         else:
-            await self.send_message("Invalid option. Please enter 1-4.")
+            await self.respond("Invalid option. Please enter 1-4.", reply_markup=self.back_to_menu())
     
     async def create_support_ticket(self, issue_description: str) -> None:
         """Create a support ticket"""
@@ -89,14 +117,9 @@ class SupportBotService(BaseBotService):
         
         self.bot_user.state_data = state_data
         self.bot_user.user_state = 'registered'
-        self.bot_user.save(update_fields=['state_data', 'user_state'])
-        
-        message = f"✅ Ticket created!\n\n"
-        message += f"Ticket ID: {ticket_id}\n"
-        message += f"Status: Open\n\n"
-        message += "Our team will respond shortly."
+        self.save_state('state_data', 'user_state')
         
-        await self.send_message(message)
+        await self.send_message(self.render(TICKET_CREATED_TEMPLATE, ticket=ticket))
     
     async def check_ticket_status(self) -> None:
         """Check status of user's tickets"""
@@ -104,15 +127,14 @@ class SupportBotService(BaseBotService):
         tickets = state_data.get('tickets', [])
         
         if not tickets:
-            await self.send_message("You don't have any tickets.")
+            await self.respond("You don't have any tickets.", reply_markup=self.back_to_menu())
         else:
-            message = "Your tickets:\n\n"
-            for ticket in tickets:
-                message += f"ID: {ticket['id']}\n"
-                message += f"Status: {ticket['status']}\n"
-                message += f"Description: {ticket['description'][:50]}...\n\n"
+            message = "Your tickets:\n\n" + "".join(
+                self.render(TICKET_STATUS_TEMPLATE, ticket=ticket, description=ticket['description'][:50])
+                for ticket in tickets
+            )
             
-            await self.send_message(message)
+            await self.respond(message, reply_markup=self.back_to_menu())
     
     async def show_faq(self) -> None:
         """Show FAQ"""
@@ -124,7 +146,7 @@ class SupportBotService(BaseBotService):
         faq += "Q: How do I contact support?\n"
         faq += "A: Select option 4 from the menu."
         
-        await self.send_message(faq)
+        await self.respond(faq, reply_markup=self.back_to_menu())
     
     async def show_contact_info(self) -> None:
         """Show contact information"""
@@ -133,4 +155,4 @@ class SupportBotService(BaseBotService):
         contact += "Phone: +1-234-567-8900\n"
         contact += "Hours: Mon-Fri 9AM-5PM"
         
-        await self.send_message(contact)
+        await self.respond(contact, reply_markup=self.back_to_menu())
@@ -4,10 +4,23 @@ Survey Bot Service - Handles survey/questionnaire flows
 from .base import BaseBotService
 from typing import Dict, Any
 
+# Re-ask a question left unanswered for this long (seconds)
+SURVEY_NUDGE_DELAY = 24 * 60 * 60
+
+SURVEY_RESULTS_TEMPLATE = (
+    "Your responses:\n\n"
+    "Satisfaction: {answers.q1_satisfaction|N/A}\n"
+    "Recommend: {answers.q2_recommend|N/A}\n"
+    "Comments: {answers.q3_comments|N/A}\n"
+)
+
 
 class SurveyBotService(BaseBotService):
     """Bot that conducts surveys with multiple questions"""
     
+    SESSION_STATES = frozenset({'survey_q1', 'survey_q2', 'survey_q3'})
+    SESSION_STATE_KEYS = frozenset({'q1_satisfaction', 'q2_recommend', 'q3_comments'})
+    
     async def handle_text(self, text: str, message_data: Dict[str, Any]) -> None:
         """Handle text based on survey state"""
         
@@ -43,21 +56,36 @@ class SurveyBotService(BaseBotService):
     
     async def ask_question_1(self) -> None:
         """Ask first survey question"""
-        await self.send_message("Question 1: How satisfied are you with our service? (1-5)")
+        question = "Question 1: How satisfied are you with our service? (1-5)"
+        await self.send_message(question)
         self.bot_user.user_state = 'survey_q1'
-        self.bot_user.save(update_fields=['user_state'])
+        self.save_state('user_state')
+        self.schedule_nudge(question)
     
     async def ask_question_2(self) -> None:
         """Ask second survey question"""
-        await self.send_message("Question 2: Would you recommend us to others? (Yes/No)")
+        question = "Question 2: Would you recommend us to others? (Yes/No)"
+        await self.send_message(question)
         self.bot_user.user_state = 'survey_q2'
-        self.bot_user.save(update_fields=['user_state'])
+        self.save_state('user_state')
+        self.schedule_nudge(question)
     
     async def ask_question_3(self) -> None:
         """Ask third survey question"""
-        await self.send_message("Question 3: Any additional comments?")
+        question = "Question 3: Any additional comments?"
+        await self.send_message(question)
         self.bot_user.user_state = 'survey_q3'
-        self.bot_user.save(update_fields=['user_state'])
+        self.save_state('user_state')
+        self.schedule_nudge(question)
+    
+    def schedule_nudge(self, question: str) -> None:
+        """Re-ask the current question if the user is still on it a day later"""
+        self.schedule(
+            'survey_nudge',
+            SURVEY_NUDGE_DELAY,
+            f"Still there? {question}",
+            only_in_state=self.bot_user.user_state,
+        )
     
     async def handle_survey_response(self, text: str, state: str, state_data: Dict) -> None:
         """Handle survey responses"""
@@ -66,14 +94,14 @@ class SurveyBotService(BaseBotService):
             # Save answer to question 1
             state_data['q1_satisfaction'] = text
             self.bot_user.state_data = state_data
-            self.bot_user.save(update_fields=['state_data'])
+            self.save_state('state_data')
             await self.ask_question_2()
         
         elif state == 'survey_q2':
             # Save answer to question 2
             state_data['q2_recommend'] = text
             self.bot_user.state_data = state_data
-            self.bot_user.save(update_fields=['state_data'])
+            self.save_state('state_data')
             await self.ask_question_3()
         
         elif state == 'survey_q3':
@@ -81,16 +109,12 @@ class SurveyBotService(BaseBotService):
             state_data['q3_comments'] = text
             self.bot_user.state_data = state_data
             self.bot_user.user_state = 'registered'
-            self.bot_user.save(update_fields=['state_data', 'user_state'])
+            self.save_state('state_data', 'user_state')
+            self.cancel_scheduled('survey_nudge')
             
             await self.send_message("✅ Thank you for completing the survey!")
             await self.show_survey_results(state_data)
     
     async def show_survey_results(self, state_data: Dict) -> None:
         """Show survey results to user"""
-        results = "Your responses:\n\n"
-        results += f"Satisfaction: {state_data.get('q1_satisfaction', 'N/A')}\n"
-        results += f"Recommend: {state_data.get('q2_recommend', 'N/A')}\n"
-        results += f"Comments: {state_data.get('q3_comments', 'N/A')}\n"
-        
-        await self.send_message(results)
+        await self.send_message(self.render(SURVEY_RESULTS_TEMPLATE, answers=state_data))
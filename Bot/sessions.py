@@ -0,0 +1,123 @@
+"""
+Idle sessions - compact the conversation state of users who walked away
+
+Users who abandon a flow keep their step and partial answers in
+``BotUser.state_data``, which is read and written on every message. The
+sweeper walks each bot's users idle longer than the bot's idle TTL in
+(bot, last_interaction) index order and writes what the bot's service
+says an idle user should keep (``BaseBotService.compact_idle_state``).
+
+Every batch is a few bulk UPDATEs in autocommit, one per distinct
+compacted state, so no write lock is held for longer than one batch.
+Updates bump ``version``, so a handler that loaded the user before the
+sweep re-runs on the compacted state instead of overwriting it.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .log import event
+from .models import BotUser, TelegramBot
+
+logger = logging.getLogger(__name__)
+
+
+def idle_cutoff(bot: TelegramBot, now: Optional[datetime] = None) -> Optional[datetime]:
+    """Users whose last interaction is before this are idle; None if the bot never sweeps"""
+    hours = bot.session_idle_hours if bot.session_idle_hours is not None else settings.SESSION_IDLE_HOURS
+    if not hours:
+        return None
+    return (now or timezone.now()) - timedelta(hours=hours)
+
+
+def state_size(user_state: str, state_data) -> int:
+    """Bytes the state takes in the row (JSON as Django stores it)"""
+    return len(user_state.encode()) + len(json.dumps(state_data).encode())
+
+
+def sweep_bot(bot: TelegramBot, batch_size: int = 500, pause: float = 0.0, full: bool = False,
+              dry_run: bool = False, now: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    Compact the state of one bot's idle users
+
+    Only users who went idle since the previous sweep are read, unless
+    ``full`` is set (e.g. after changing what a service keeps).
+
+    Args:
+        bot: TelegramBot model instance
+        batch_size: Users read per batch
+        pause: Seconds to sleep between batches, leaving the database to others
+        full: Re-read users already swept
+        dry_run: Count what would be compacted without writing
+        now: Current time
+
+    Returns:
+        {'scanned': users read, 'compacted': users updated, 'bytes': state bytes reclaimed}
+    """
+    from .services.factory import BotServiceFactory
+
+    stats = {'scanned': 0, 'compacted': 0, 'bytes': 0}
+    cutoff = idle_cutoff(bot, now)
+    if cutoff is None:
+        return stats
+
+    service_class = BotServiceFactory.get_service_class(bot.bot_type)
+    idle = BotUser.objects.filter(bot=bot, last_interaction__lt=cutoff)
+    if not full and bot.sessions_swept_until is not None:
+        idle = idle.filter(last_interaction__gte=bot.sessions_swept_until)
+    idle = idle.order_by('last_interaction', 'id')
+
+    position = Q()
+    while True:
+        rows = list(
+            idle.filter(position)
+            .values_list('id', 'last_interaction', 'user_state', 'state_data')[:batch_size]
+        )
+        if not rows:
+            break
+        stats['scanned'] += len(rows)
+        # Keyset pagination: the next batch starts after the last row of this one
+        last_id, last_interaction = rows[-1][0], rows[-1][1]
+        position = Q(last_interaction__gt=last_interaction) | Q(last_interaction=last_interaction, id__gt=last_id)
+
+        # Users ending up with the same state are written by one UPDATE
+        groups = defaultdict(lambda: {'ids': [], 'bytes': 0})
+        for user_id, _, user_state, state_data in rows:
+            new_state, new_data = service_class.compact_idle_state(user_state, state_data)
+            if new_state == user_state and new_data == (state_data or {}):
+                continue
+            group = groups[(new_state, json.dumps(new_data, sort_keys=True))]
+            group['ids'].append(user_id)
+            group['bytes'] += state_size(user_state, state_data) - state_size(new_state, new_data)
+
+        for (new_state, new_data), group in groups.items():
+            if dry_run:
+                updated = len(group['ids'])
+            else:
+                # Users who came back since the batch was read keep their state
+                updated = BotUser.objects.filter(pk__in=group['ids'], last_interaction__lt=cutoff).update(
+                    user_state=new_state,
+                    state_data=json.loads(new_data),
+                    version=F('version') + 1,
+                )
+            stats['compacted'] += updated
+            stats['bytes'] += group['bytes'] * updated // len(group['ids'])
+
+        if len(rows) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+
+    if not dry_run:
+        # update(), not save(): saving a bot queues webhook setup
+        TelegramBot.objects.filter(pk=bot.pk).update(sessions_swept_until=cutoff)
+        bot.sessions_swept_until = cutoff
+        logger.info(event('sessions_swept', bot=str(bot.pk), **stats))
+    return stats
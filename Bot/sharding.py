@@ -0,0 +1,121 @@
+"""
+Message log sharding - BotMessage rows in per-bot-group databases
+
+With MESSAGE_SHARDS set, every bot's BotMessage rows are stored in one of
+the ``messages_<n>`` databases (one SQLite file each), chosen by consistent
+hashing of the bot id, or pinned with MESSAGE_SHARD_PINS. A busy bot's log
+then only competes with the bots of its own shard for the SQLite write
+lock, and adding a shard moves only about 1/n of the bots. Bots, users and
+all other hot-path state stay in the primary database.
+
+Messages of one bot are reached through the router (``bot.messages``,
+``BotMessage.objects.create(bot=...)``, ``.for_bot(bot)``). Queries not
+tied to a bot, and per-bot statistics and exports, run on every database
+holding messages (``fan_out``): the shards, and the primary for rows
+written before sharding or before ``rebalance_messages`` moved them.
+
+A shard is another database, so its writes are not part of the primary's
+transactions: an incoming message is inserted once its user is committed
+(``record_incoming_message``), and deleting a bot or user deletes its
+shard rows after the cascade (``Bot.signals``).
+"""
+from bisect import bisect
+from functools import lru_cache
+from typing import Dict, Iterator, List, Tuple
+import hashlib
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# Points per shard on the hash ring; more points spread bots more evenly
+RING_POINTS = 128
+
+
+def message_shards() -> List[str]:
+    """Aliases of the message shard databases (empty when not sharded)"""
+    return list(settings.MESSAGE_SHARD_DATABASES)
+
+
+def message_databases() -> List[str]:
+    """Every database that may hold messages: the primary and the shards"""
+    return [DEFAULT_DB_ALIAS, *message_shards()]
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+
+@lru_cache(maxsize=8)
+def _ring(shards: Tuple[str, ...]) -> Tuple[List[int], List[str]]:
+    points = sorted((_hash(f"{shard}:{index}"), shard) for shard in shards for index in range(RING_POINTS))
+    return [point for point, _ in points], [shard for _, shard in points]
+
+
+def shard_for(bot_id) -> str:
+    """Database alias storing a bot's messages"""
+    bot_id = str(bot_id)
+    pinned = settings.MESSAGE_SHARD_PINS.get(bot_id)
+    if pinned:
+        return pinned
+    shards = tuple(settings.MESSAGE_SHARD_DATABASES)
+    if not shards:
+        return DEFAULT_DB_ALIAS
+    points, owners = _ring(shards)
+    return owners[bisect(points, _hash(bot_id)) % len(points)]
+
+
+def fan_out(queryset) -> Iterator:
+    """The queryset evaluated on every message database, one after the other"""
+    for alias in message_databases():
+        yield from queryset.using(alias)
+
+
+def aggregate(queryset, **aggregates) -> Dict[str, int]:
+    """Sum of count-like aggregates over every message database"""
+    totals = dict.fromkeys(aggregates, 0)
+    for alias in message_databases():
+        for name, value in queryset.using(alias).aggregate(**aggregates).items():
+            totals[name] += value or 0
+    return totals
+
+
+def is_message_model(model) -> bool:
+    return model._meta.label == 'Bot.BotMessage'
+
+
+class MessageShardRouter:
+    """Routes BotMessage to its bot's shard; everything else stays in the primary"""
+
+    def _db_for(self, model, hints):
+        instance = hints.get('instance')
+        if not is_message_model(model):
+            # A related object read from a shard row still lives in the primary
+            if instance is not None and instance._state.db in settings.MESSAGE_SHARD_DATABASES:
+                return DEFAULT_DB_ALIAS
+            return None
+        if instance is None:
+            return None
+        if is_message_model(type(instance)):
+            if not instance._state.adding:
+                return instance._state.db
+            return shard_for(instance.bot_id) if instance.bot_id else None
+        # bot.messages, user.messages: hinted with the bot or user
+        bot_id = instance.pk if instance._meta.label == 'Bot.TelegramBot' else getattr(instance, 'bot_id', None)
+        return shard_for(bot_id) if bot_id else None
+
+    def db_for_read(self, model, **hints):
+        return self._db_for(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_message_model(type(obj1)) or is_message_model(type(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Shards hold only the message table (data migrations name no model and are skipped)
+        if db in settings.MESSAGE_SHARD_DATABASES:
+            return app_label == 'Bot' and model_name == 'botmessage'
+        return None
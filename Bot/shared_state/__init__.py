@@ -0,0 +1,83 @@
+"""
+Shared state - ephemeral state every node serving the bots must agree on
+
+Update dedupe windows, per-chat locks, rate-limit counters and cache
+invalidation go through ``get_backend()``, configured by SHARED_STATE_URL:
+
+- ``memory://``           one process (development, a single worker)
+- ``sqlite:///path/file``  every process on one host
+- ``redis://[:password@]host:port/db``  every node behind a load balancer
+"""
+from urllib.parse import unquote, urlsplit
+import os
+import threading
+
+from django.conf import settings
+
+from .base import LockTimeout, SharedStateBackend, SharedStateError
+
+_backend = None
+_backend_pid = None
+_backend_lock = threading.Lock()
+
+
+def backend_from_url(url: str, key_prefix: str = '') -> SharedStateBackend:
+    """
+    Create a backend from a SHARED_STATE_URL value
+
+    Raises:
+        ValueError: Unknown scheme
+    """
+    parts = urlsplit(url)
+
+    if parts.scheme == 'memory':
+        from .memory import MemoryBackend
+        return MemoryBackend(key_prefix=key_prefix)
+
+    if parts.scheme == 'sqlite':
+        from .sqlite import SQLiteBackend
+        return SQLiteBackend(unquote(parts.path), key_prefix=key_prefix)
+
+    if parts.scheme == 'redis':
+        from .redis import RedisBackend
+        db = parts.path.strip('/')
+        return RedisBackend(
+            host=parts.hostname or '127.0.0.1',
+            port=parts.port or 6379,
+            db=int(db) if db else 0,
+            password=unquote(parts.password) if parts.password else None,
+            key_prefix=key_prefix,
+        )
+
+    raise ValueError(f"Unsupported SHARED_STATE_URL scheme: {parts.scheme!r}")
+
+
+def get_backend() -> SharedStateBackend:
+    """The process-wide backend (recreated in forked children, which must not share sockets)"""
+    global _backend, _backend_pid
+
+    if _backend is None or _backend_pid != os.getpid():
+        with _backend_lock:
+            if _backend is None or _backend_pid != os.getpid():
+                _backend = backend_from_url(settings.SHARED_STATE_URL, settings.SHARED_STATE_KEY_PREFIX)
+                _backend_pid = os.getpid()
+    return _backend
+
+
+def reset_backend() -> None:
+    """Drop the process-wide backend, e.g. after changing SHARED_STATE_URL"""
+    global _backend
+    with _backend_lock:
+        if _backend is not None:
+            _backend.close()
+        _backend = None
+
+
+__all__ = [
+    'LockTimeout',
+    'SharedStateBackend',
+    'SharedStateError',
+    'backend_from_url',
+    'get_backend',
+    'reset_backend',
+]
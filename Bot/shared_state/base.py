@@ -0,0 +1,106 @@
+"""
+Base Shared State Backend - Abstract class for ephemeral cross-node state
+"""
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Optional
+import time
+import uuid
+
+
+class SharedStateError(Exception):
+    """Raised when the shared state backend cannot be reached or rejects a command"""
+
+
+class LockTimeout(SharedStateError):
+    """Raised when a lock could not be acquired in time"""
+
+
+class SharedStateBackend(ABC):
+    """
+    Key/value store for state every node must agree on
+
+    Values are strings; every key can expire. Only atomic primitives are
+    abstract, locks and dedupe windows are built on top of them so all
+    backends behave the same.
+    """
+
+    # False for backends whose state other processes cannot see
+    cross_process = True
+
+    def __init__(self, key_prefix: str = ''):
+        """
+        Args:
+            key_prefix: Prepended to every key, to share one store between deployments
+        """
+        self.key_prefix = key_prefix
+
+    def key(self, key: str) -> str:
+        return self.key_prefix + key
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        """Value of a key, None if missing or expired"""
+
+    @abstractmethod
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        """Store a value, expiring after ``ttl`` seconds (None keeps it)"""
+
+    @abstractmethod
+    def add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        """Store a value only if the key does not exist; True if stored"""
+
+    @abstractmethod
+    def delete(self, key: str) -> bool:
+        """Remove a key; True if it existed"""
+
+    @abstractmethod
+    def delete_if_equal(self, key: str, value: str) -> bool:
+        """Remove a key only while it still holds ``value``; True if removed"""
+
+    @abstractmethod
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """
+        Atomically add to a counter, returning the new value
+
+        A missing or expired counter starts at 0 and gets the ``ttl``; the
+        expiry of an existing counter is left alone, so fixed windows work.
+        """
+
+    def close(self) -> None:
+        """Release connections held by this backend"""
+
+    def seen(self, key: str, ttl: float) -> bool:
+        """
+        Dedupe window: True if ``key`` was already recorded in the last ``ttl`` seconds
+
+        The first caller records it and gets False.
+        """
+        return not self.add(key, '1', ttl)
+
+    @contextmanager
+    def lock(self, name: str, ttl: float = 30.0, timeout: float = 10.0):
+        """
+        Hold a lock shared by every node
+
+        Args:
+            name: Lock key
+            ttl: Seconds after which a lock whose holder died is released
+            timeout: Seconds to wait for the lock
+
+        Raises:
+            LockTimeout: The lock is still held by someone else after ``timeout``
+        """
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        delay = 0.005
+        while not self.add(name, token, ttl):
+            if time.monotonic() >= deadline:
+                raise LockTimeout(f"Lock {name} not acquired within {timeout}s")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        try:
+            yield
+        finally:
+            # Never release a lock that expired and was taken over meanwhile
+            self.delete_if_equal(name, token)
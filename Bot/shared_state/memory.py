@@ -0,0 +1,85 @@
+"""
+In-memory shared state backend - one process only (development, single worker)
+"""
+from typing import Optional
+import threading
+import time
+
+from .base import SharedStateBackend
+
+# Expired keys are dropped every this many writes
+PURGE_INTERVAL = 1000
+
+
+class MemoryBackend(SharedStateBackend):
+    """Dict guarded by a lock; not shared between processes"""
+    cross_process = False
+
+    def __init__(self, key_prefix: str = ''):
+        super().__init__(key_prefix)
+        self._data = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _live(self, key: str, now: float):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= now:
+            del self._data[key]
+            return None
+        return item
+
+    def _store(self, key: str, value: str, ttl: Optional[float], now: float) -> None:
+        self._data[key] = (value, now + ttl if ttl is not None else None)
+        self._writes += 1
+        if self._writes % PURGE_INTERVAL == 0:
+            for expired in [k for k, (v, expires_at) in self._data.items() if expires_at is not None and expires_at <= now]:
+                del self._data[expired]
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._live(self.key(key), time.time())
+        return item[0] if item else None
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._store(self.key(key), value, ttl, time.time())
+
+    def add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        key = self.key(key)
+        now = time.time()
+        with self._lock:
+            if self._live(key, now) is not None:
+                return False
+            self._store(key, value, ttl, now)
+            return True
+
+    def delete(self, key: str) -> bool:
+        key = self.key(key)
+        with self._lock:
+            existed = self._live(key, time.time()) is not None
+            self._data.pop(key, None)
+        return existed
+
+    def delete_if_equal(self, key: str, value: str) -> bool:
+        key = self.key(key)
+        with self._lock:
+            item = self._live(key, time.time())
+            if item is None or item[0] != value:
+                return False
+            del self._data[key]
+            return True
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        key = self.key(key)
+        now = time.time()
+        with self._lock:
+            item = self._live(key, now)
+            if item is None:
+                value = amount
+                self._store(key, str(value), ttl, now)
+            else:
+                value = int(item[0]) + amount
+                self._data[key] = (str(value), item[1])
+        return value
@@ -0,0 +1,158 @@
+"""
+Redis shared state backend - every node of a deployment
+
+Speaks the Redis protocol (RESP2) directly over a socket, so any Redis
+compatible server works (Redis, Valkey, KeyDB, ``manage.py fake_redis``)
+without a client library dependency.
+"""
+from typing import List, Optional
+import socket
+import threading
+
+from .base import SharedStateBackend, SharedStateError
+
+# Atomic compare-and-delete used to release locks
+COMPARE_AND_DELETE = (
+    "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+)
+
+
+class RedisBackend(SharedStateBackend):
+    """Redis protocol client with one connection per thread"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 6379, db: int = 0, password: Optional[str] = None,
+                 key_prefix: str = '', socket_timeout: float = 5.0):
+        """
+        Args:
+            host: Server host
+            port: Server port
+            db: Database number selected on connect
+            password: Sent with AUTH on connect if set
+            key_prefix: Prepended to every key
+            socket_timeout: Seconds to wait for connects and replies
+        """
+        super().__init__(key_prefix)
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.socket_timeout = socket_timeout
+        self._local = threading.local()
+
+    # Protocol
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.socket_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._local.sock = sock
+        self._local.reader = sock.makefile('rb')
+        if self.password:
+            self._roundtrip([('AUTH', self.password)])
+        if self.db:
+            self._roundtrip([('SELECT', self.db)])
+
+    def _disconnect(self) -> None:
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            try:
+                self._local.reader.close()
+                sock.close()
+            except OSError:
+                pass
+        self._local.sock = None
+        self._local.reader = None
+
+    def _roundtrip(self, commands) -> List:
+        payload = bytearray()
+        for command in commands:
+            payload += b'*%d\r\n' % len(command)
+            for arg in command:
+                arg = arg if isinstance(arg, bytes) else str(arg).encode()
+                payload += b'$%d\r\n%s\r\n' % (len(arg), arg)
+        self._local.sock.sendall(payload)
+        return [self._read_reply() for _ in commands]
+
+    def _read_reply(self):
+        line = self._local.reader.readline()
+        if not line:
+            raise ConnectionError('Connection closed by server')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            return SharedStateError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._local.reader.read(length + 2)
+            return data[:-2].decode()
+        if kind == b'*':
+            length = int(rest)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise SharedStateError(f"Unexpected reply from {self.host}:{self.port}: {line!r}")
+
+    def pipeline(self, *commands) -> List:
+        """
+        Send commands in one round trip and return their replies
+
+        A broken connection is reopened and the commands retried once.
+        """
+        for attempt in range(2):
+            try:
+                if getattr(self._local, 'sock', None) is None:
+                    self._connect()
+                replies = self._roundtrip(commands)
+                break
+            except (OSError, ConnectionError) as e:
+                self._disconnect()
+                if attempt:
+                    raise SharedStateError(f"Redis at {self.host}:{self.port} unavailable: {e}") from e
+
+        for reply in replies:
+            if isinstance(reply, SharedStateError):
+                raise reply
+        return replies
+
+    def execute(self, *command):
+        return self.pipeline(command)[0]
+
+    # Backend interface
+
+    def get(self, key: str) -> Optional[str]:
+        return self.execute('GET', self.key(key))
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        if ttl is None:
+            self.execute('SET', self.key(key), value)
+        else:
+            self.execute('SET', self.key(key), value, 'PX', max(1, int(ttl * 1000)))
+
+    def add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        if ttl is None:
+            reply = self.execute('SET', self.key(key), value, 'NX')
+        else:
+            reply = self.execute('SET', self.key(key), value, 'NX', 'PX', max(1, int(ttl * 1000)))
+        return reply == 'OK'
+
+    def delete(self, key: str) -> bool:
+        return self.execute('DEL', self.key(key)) == 1
+
+    def delete_if_equal(self, key: str, value: str) -> bool:
+        return self.execute('EVAL', COMPARE_AND_DELETE, 1, self.key(key), value) == 1
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        key = self.key(key)
+        if ttl is None:
+            return self.execute('INCRBY', key, amount)
+        # Creating the counter with its expiry first keeps the window fixed
+        replies = self.pipeline(
+            ('SET', key, 0, 'NX', 'PX', max(1, int(ttl * 1000))),
+            ('INCRBY', key, amount),
+        )
+        return replies[1]
+
+    def close(self) -> None:
+        self._disconnect()
@@ -0,0 +1,136 @@
+"""
+SQLite shared state backend - every process on one host
+
+Uses its own database file (not the Django database) so state traffic
+never competes with the application's write lock. Each operation is a
+single autocommitted statement, which SQLite executes atomically.
+"""
+from typing import Optional
+import sqlite3
+import threading
+import time
+
+from .base import SharedStateBackend, SharedStateError
+
+# Expired rows are deleted every this many writes
+PURGE_INTERVAL = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shared_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL
+) WITHOUT ROWID
+"""
+
+# Condition under which an existing row counts as missing
+EXPIRED = "shared_state.expires_at IS NOT NULL AND shared_state.expires_at <= :now"
+
+
+class SQLiteBackend(SharedStateBackend):
+    """Key/value table in a WAL-mode SQLite file, one connection per thread"""
+
+    def __init__(self, path: str, key_prefix: str = '', timeout: float = 5.0):
+        """
+        Args:
+            path: Database file, created if missing
+            key_prefix: Prepended to every key
+            timeout: Seconds to wait for another process's write lock
+        """
+        super().__init__(key_prefix)
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._setup_lock = threading.Lock()
+        self._ready = False
+        self._writes = 0
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                         check_same_thread=False)
+            if not self._ready:
+                # WAL mode is stored in the file and the table outlives us: once per process
+                # is enough, and spares every new thread two writes under the file lock
+                with self._setup_lock:
+                    if not self._ready:
+                        connection.execute('PRAGMA journal_mode=WAL')
+                        connection.execute(SCHEMA)
+                        self._ready = True
+            # Per connection, but only a setting: no lock or I/O
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        try:
+            return self.connection.execute(sql, params)
+        except sqlite3.Error as e:
+            raise SharedStateError(f"SQLite shared state error: {e}") from e
+
+    def _written(self, now: float) -> None:
+        self._writes += 1
+        if self._writes % PURGE_INTERVAL == 0:
+            self.execute("DELETE FROM shared_state WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+
+    def get(self, key: str) -> Optional[str]:
+        row = self.execute(
+            "SELECT value FROM shared_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (self.key(key), time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        self.execute(
+            "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+            (self.key(key), value, now + ttl if ttl is not None else None),
+        )
+        self._written(now)
+
+    def add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        now = time.time()
+        cursor = self.execute(
+            "INSERT INTO shared_state (key, value, expires_at) VALUES (:key, :value, :expires_at) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+            f"WHERE {EXPIRED}",
+            {'key': self.key(key), 'value': value, 'expires_at': now + ttl if ttl is not None else None, 'now': now},
+        )
+        self._written(now)
+        return cursor.rowcount == 1
+
+    def delete(self, key: str) -> bool:
+        cursor = self.execute(
+            "DELETE FROM shared_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (self.key(key), time.time()),
+        )
+        return cursor.rowcount == 1
+
+    def delete_if_equal(self, key: str, value: str) -> bool:
+        cursor = self.execute(
+            "DELETE FROM shared_state WHERE key = ? AND value = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (self.key(key), value, time.time()),
+        )
+        return cursor.rowcount == 1
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        now = time.time()
+        row = self.execute(
+            "INSERT INTO shared_state (key, value, expires_at) VALUES (:key, :amount, :expires_at) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            f"value = CASE WHEN {EXPIRED} THEN excluded.value "
+            "ELSE CAST(shared_state.value AS INTEGER) + excluded.value END, "
+            f"expires_at = CASE WHEN {EXPIRED} THEN excluded.expires_at ELSE shared_state.expires_at END "
+            "RETURNING value",
+            {'key': self.key(key), 'amount': amount, 'expires_at': now + ttl if ttl is not None else None, 'now': now},
+        ).fetchone()
+        self._written(now)
+        return int(row[0])
+
+    def close(self) -> None:
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
@@ -1,56 +1,29 @@
 """
 Django signals for automatic webhook setup
 """
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from django.conf import settings
-from telegram import Bot as TelegramBotClient
-from telegram.request import HTTPXRequest
-import asyncio
 import logging
 
-from .models import TelegramBot
+from .models import BotFlow, BotUser, TelegramBot
 
 logger = logging.getLogger(__name__)
 
 
-def create_telegram_client(token: str) -> TelegramBotClient:
-    """
-    Create Telegram Bot client with proper configuration
-    Clears proxy environment variables to avoid proxy issues
-    """
-    import os
-    
-    # Save original proxy env vars
-    original_proxies = {}
-    proxy_vars = ['HTTP_PROXY', 'HTTPS_PROXY', 'ALL_PROXY', 'http_proxy', 'https_proxy', 'all_proxy', 
-                  'FTP_PROXY', 'ftp_proxy', 'NO_PROXY', 'no_proxy']
-    
-    # Temporarily clear proxy environment variables
-    for var in proxy_vars:
-        if var in os.environ:
-            original_proxies[var] = os.environ[var]
-            del os.environ[var]
-    
-    try:
-        # Create Telegram client - it will now not use any proxy
-        return TelegramBotClient(token=token)
-    finally:
-        # Restore original proxy env vars
-        for var, value in original_proxies.items():
-            os.environ[var] = value
-
-
 @receiver(post_save, sender=TelegramBot)
 def auto_setup_webhook(sender, instance, created, **kwargs):
     """
-    Automatically setup webhook when bot is saved
+    Queue webhook setup when bot is saved
     
     Triggers when:
     - New bot is created
     - Bot token is changed
     - Bot is activated (is_active=True)
     - auto_setup_webhook is enabled
+    
+    The Telegram call itself runs in the run_bot_tasks worker, so saving a
+    bot never waits on the network.
     """
     # Only setup webhook if auto_setup_webhook is enabled
     if not instance.auto_setup_webhook:
@@ -74,53 +47,63 @@ def auto_setup_webhook(sender, instance, created, **kwargs):
         logger.info(f"Webhook not set for bot: {instance.name} ({instance.id})")
     
     if should_setup:
-        try:
-            # Get base URL from settings
-            base_url = getattr(settings, 'BASE_URL', None)
-            
-            if not base_url:
-                logger.warning("BASE_URL not configured in settings. Skipping webhook setup.")
-                return
-            
-            # Construct webhook URL
-            webhook_url = f"{base_url}/api/webhook/{instance.id}"
-            
-            # Setup webhook with Telegram
-            bot_client = create_telegram_client(instance.token)
-            asyncio.run(bot_client.set_webhook(url=webhook_url))
-            
-            # Update bot instance
-            instance.webhook_url = webhook_url
-            instance.is_webhook_set = True
-            
-            # Use update() to avoid triggering signal again
-            TelegramBot.objects.filter(pk=instance.pk).update(
-                webhook_url=webhook_url,
-                is_webhook_set=True
-            )
-            
-            logger.info(f"Webhook set successfully for {instance.name}: {webhook_url}")
-            
-        except Exception as e:
-            logger.error(f"Failed to setup webhook for {instance.name}: {str(e)}")
+        from .tasks import enqueue_bot_task
+        
+        # Recorded in the same transaction as the bot save
+        if enqueue_bot_task(instance, 'setup_webhook'):
+            logger.info(f"Webhook setup queued for {instance.name}")
 
 
 @receiver(post_save, sender=TelegramBot)
 def fetch_bot_username(sender, instance, created, **kwargs):
     """
-    Automatically fetch bot username from Telegram if not set
+    Queue a username fetch from Telegram if not set
     """
     if not instance.username and instance.token:
-        try:
-            bot_client = create_telegram_client(instance.token)
-            bot_info = asyncio.run(bot_client.get_me())
-            
-            # Update username using update() to avoid triggering signal again
-            TelegramBot.objects.filter(pk=instance.pk).update(
-                username=bot_info.username
-            )
-            
-            logger.info(f"Username fetched for {instance.name}: @{bot_info.username}")
-            
-        except Exception as e:
-            logger.error(f"Failed to fetch username for {instance.name}: {str(e)}")
+        from .tasks import enqueue_bot_task
+        
+        if enqueue_bot_task(instance, 'fetch_username'):
+            logger.info(f"Username fetch queued for {instance.name}")
+
+
+@receiver(post_save, sender=TelegramBot)
+@receiver(post_delete, sender=TelegramBot)
+def refresh_active_bots(sender, instance, **kwargs):
+    """Have every process reload the bots its webhook accepts (once the change is committed)"""
+    from .webhooks import active_bots
+    
+    transaction.on_commit(active_bots.invalidate)
+
+
+@receiver(post_save, sender=TelegramBot)
+def reset_bot_breaker(sender, instance, **kwargs):
+    """A bot saved as active (e.g. reactivated with a new token) starts with a closed circuit"""
+    from .breaker import reset
+    
+    if instance.is_active:
+        transaction.on_commit(lambda: reset(instance.pk))
+
+
+@receiver(post_delete, sender=TelegramBot)
+@receiver(post_delete, sender=BotUser)
+def delete_sharded_messages(sender, instance, origin=None, **kwargs):
+    """Delete the messages of a deleted bot or user kept in message shards (the cascade only reaches 'default')"""
+    from .models import BotMessage
+    from .sharding import message_shards
+    
+    if sender is BotUser and (isinstance(origin, TelegramBot) or getattr(origin, 'model', None) is TelegramBot):
+        # Users deleted with their bot: the bot's own delete covers their messages
+        return
+    field = 'bot_id' if sender is TelegramBot else 'user_id'
+    for alias in message_shards():
+        BotMessage.objects.using(alias).filter(**{field: instance.pk}).delete()
+
+
+@receiver(post_delete, sender=BotFlow)
+def unlink_sharded_messages(sender, instance, **kwargs):
+    """Clear the flow of a deleted flow's messages kept in message shards"""
+    from .models import BotMessage
+    from .sharding import message_shards
+    
+    for alias in message_shards():
+        BotMessage.objects.using(alias).filter(flow_id=instance.pk).update(flow=None)
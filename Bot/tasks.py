@@ -0,0 +1,195 @@
+"""
+Background bot tasks - transactional outbox for TelegramBot side effects
+
+``post_save`` only records a BotTask row; the ``run_bot_tasks`` worker
+claims due rows, performs the Telegram calls concurrently and writes the
+results back, retrying transient failures with exponential backoff.
+"""
+from datetime import timedelta
+from typing import Dict, Any, List, Optional
+import asyncio
+import logging
+import random
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from telegram.error import BadRequest, Forbidden, InvalidToken, RetryAfter
+
+from .models import TelegramBot, BotTask
+from .client import create_telegram_client
+from .metrics import WORKER_BUSY
+from .webhooks import get_webhook_config
+
+logger = logging.getLogger(__name__)
+
+# Backoff schedule for transient failures: 5s, 10s, 20s ... capped at 1h
+RETRY_BASE_DELAY = 5
+RETRY_MAX_DELAY = 3600
+
+# A task left in 'running' for longer than this is considered abandoned
+# by a crashed worker and becomes claimable again
+TASK_LEASE = timedelta(minutes=5)
+
+# Errors that will not go away by retrying
+PERMANENT_ERRORS = (BadRequest, Forbidden, InvalidToken)
+
+
+class PermanentTaskError(Exception):
+    """Raised by task handlers when retrying cannot help"""
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with full jitter for the given attempt number"""
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** max(0, attempts - 1)))
+    return random.uniform(delay / 2, delay)
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Seconds Telegram asked us to wait (int or timedelta depending on PTB settings)"""
+    value = error.retry_after
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+def enqueue_bot_task(bot: TelegramBot, task_type: str) -> Optional[BotTask]:
+    """
+    Record a side effect for a bot unless an identical one is already queued
+
+    Args:
+        bot: TelegramBot model instance
+        task_type: One of BotTask.TASK_TYPE_CHOICES
+
+    Returns:
+        The new BotTask, or None if one is already pending
+    """
+    if BotTask.objects.filter(bot=bot, task_type=task_type, status__in=['pending', 'running']).exists():
+        return None
+    return BotTask.objects.create(bot=bot, task_type=task_type)
+
+
+async def setup_webhook(bot: TelegramBot) -> Dict[str, Any]:
+    """Register the bot's webhook with Telegram"""
+    config = get_webhook_config(bot)
+    if not config['url']:
+        raise PermanentTaskError("BASE_URL not configured in settings")
+
+    bot_client = create_telegram_client(bot.token)
+    await bot_client.set_webhook(**config)
+
+    return {'webhook_url': config['url'], 'is_webhook_set': True}
+
+
+async def fetch_username(bot: TelegramBot) -> Dict[str, Any]:
+    """Fetch the bot's username from Telegram"""
+    bot_client = create_telegram_client(bot.token)
+    bot_info = await bot_client.get_me()
+
+    return {'username': bot_info.username}
+
+
+# Task type -> async handler returning TelegramBot field updates
+TASK_HANDLERS = {
+    'setup_webhook': setup_webhook,
+    'fetch_username': fetch_username,
+}
+
+
+def claim_due_tasks(limit: int) -> List[BotTask]:
+    """
+    Claim up to ``limit`` due tasks for this worker
+
+    Each row is moved to 'running' with a conditional UPDATE, so several
+    workers can poll the same table without executing a task twice.
+    """
+    now = timezone.now()
+    candidates = (
+        BotTask.objects
+        .filter(
+            Q(status='pending', run_after__lte=now) |
+            Q(status='running', updated_at__lt=now - TASK_LEASE)
+        )
+        .select_related('bot')
+        .order_by('run_after')[:limit]
+    )
+
+    claimed = []
+    for task in candidates:
+        updated = BotTask.objects.filter(pk=task.pk, status=task.status, updated_at=task.updated_at).update(
+            status='running',
+            attempts=task.attempts + 1,
+            updated_at=now,
+        )
+        if updated:
+            task.status = 'running'
+            task.attempts += 1
+            claimed.append(task)
+
+    return claimed
+
+
+async def execute_task(task: BotTask):
+    """Run a single task, returning (field updates, error, retry delay)"""
+    handler = TASK_HANDLERS.get(task.task_type)
+    if handler is None:
+        return None, f"Unknown task type: {task.task_type}", None
+
+    try:
+        return await handler(task.bot), None, None
+    except RetryAfter as e:
+        return None, str(e), retry_after_seconds(e)
+    except (PermanentTaskError, *PERMANENT_ERRORS) as e:
+        return None, str(e), None
+    except Exception as e:
+        return None, str(e), retry_delay(task.attempts)
+
+
+async def execute_tasks(tasks: List[BotTask], concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(task):
+        async with semaphore:
+            with WORKER_BUSY.track_inprogress(('bot_tasks',)):
+                return await execute_task(task)
+
+    return await asyncio.gather(*(run(task) for task in tasks))
+
+
+def process_due_tasks(limit: int = 50, concurrency: int = 5) -> int:
+    """
+    Claim and execute due tasks
+
+    Returns:
+        Number of tasks processed
+    """
+    tasks = claim_due_tasks(limit)
+    if not tasks:
+        return 0
+
+    results = asyncio.run(execute_tasks(tasks, concurrency))
+    now = timezone.now()
+
+    for task, (updates, error, delay) in zip(tasks, results):
+        with transaction.atomic():
+            if error is None:
+                # Use update() to avoid triggering post_save signals again
+                TelegramBot.objects.filter(pk=task.bot_id).update(**updates)
+                BotTask.objects.filter(pk=task.pk).update(status='done', last_error=None, updated_at=now)
+                logger.info(f"Task {task.task_type} done for {task.bot.name}: {updates}")
+            elif delay is not None and task.attempts < task.max_attempts:
+                BotTask.objects.filter(pk=task.pk).update(
+                    status='pending',
+                    last_error=error,
+                    run_after=now + timedelta(seconds=delay),
+                    updated_at=now,
+                )
+                logger.warning(
+                    f"Task {task.task_type} failed for {task.bot.name} "
+                    f"(attempt {task.attempts}), retrying in {delay:.0f}s: {error}"
+                )
+            else:
+                BotTask.objects.filter(pk=task.pk).update(status='failed', last_error=error, updated_at=now)
+                logger.error(f"Task {task.task_type} failed for {task.bot.name}: {error}")
+
+    return len(tasks)
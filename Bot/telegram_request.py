@@ -0,0 +1,31 @@
+"""
+Instrumented HTTP transport for the Telegram Bot API client
+
+Kept apart from ``client`` so that importing the client factory does not
+import the Telegram library; ``create_telegram_client`` imports this on
+first use.
+"""
+import time
+
+from telegram.request import HTTPXRequest
+
+from .metrics import TELEGRAM_API_DURATION, TELEGRAM_API_ERRORS
+
+
+class InstrumentedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest recording latency and error codes of every Bot API call"""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        endpoint = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            TELEGRAM_API_ERRORS.inc((endpoint, 'network'))
+            raise
+        finally:
+            TELEGRAM_API_DURATION.observe(time.perf_counter() - started, (endpoint,))
+
+        if not 200 <= code <= 299:
+            TELEGRAM_API_ERRORS.inc((endpoint, str(code)))
+        return code, payload
@@ -0,0 +1,160 @@
+"""
+Message templates - bot and flow texts with user variables
+
+Texts can reference the user and their conversation state::
+
+    Welcome back {first_name|friend}! Your last rating: {state.q1_satisfaction|none yet}
+
+- ``{first_name}``, ``{last_name}``, ``{username}``, ``{phone_number}``,
+  ``{chat_id}``, ``{language_code}``, ``{user_state}``: user fields
+- ``{state.key}`` (``{state.key.nested}``): values in ``BotUser.state_data``
+- ``{bot.name}``, ``{bot.username}``: the bot
+- ``{name|default}``: shown when the value is missing or empty
+- ``{{`` and ``}}``: literal braces
+
+Services may pass further variables (``render(text, user, bot, ticket=...)``).
+Placeholders naming nothing known are left in the text as written, so
+existing texts with braces keep working.
+
+A text is compiled once into a Python render function; compiled
+templates are cached by text, so an edited text compiles anew and
+rendering a known one is a single call.
+"""
+from functools import lru_cache
+from typing import Any, Optional, Tuple
+import re
+
+# Placeholders, and the escaped braces that are not placeholders
+TOKEN_PATTERN = re.compile(r'\{\{|\}\}|\{([^{}\n]*)\}')
+VARIABLE_PATTERN = re.compile(r'^\s*([A-Za-z_]\w*(?:\.\w+)*)\s*(?:\|(.*))?$', re.DOTALL)
+
+USER_FIELDS = frozenset({
+    'first_name', 'last_name', 'username', 'phone_number', 'chat_id', 'language_code', 'user_state',
+})
+BOT_FIELDS = frozenset({'name', 'username'})
+
+# Distinct texts kept compiled
+CACHE_SIZE = 4096
+
+
+def lookup(value: Any, key: str) -> Any:
+    """One step of a dotted path, through dicts or attributes"""
+    if isinstance(value, dict):
+        return value.get(key)
+    return getattr(value, key, None) if value is not None else None
+
+
+def value_expression(root: str, path: Tuple[str, ...], token: int) -> str:
+    """
+    Python expression reading one placeholder's value in a render function
+
+    Only identifiers matched by VARIABLE_PATTERN reach the generated code;
+    text and defaults are passed as constants (``C[token]`` is the
+    placeholder as written, kept when nothing knows its name).
+    """
+    if root in USER_FIELDS and not path:
+        return f"getattr(user, {root!r}, None)"
+    if root == 'bot' and len(path) == 1 and path[0] in BOT_FIELDS:
+        return f"getattr(bot, {path[0]!r}, None)"
+    if root == 'state' and path:
+        expression = "getattr(user, 'state_data', None)"
+        for key in path:
+            expression = f"lookup({expression}, {key!r})"
+        return expression
+
+    expression = f"extra[{root!r}]"
+    for key in path:
+        expression = f"lookup({expression}, {key!r})"
+    return f"({expression} if {root!r} in extra else C[{token}])"
+
+
+class Template:
+    """A text compiled into a render function"""
+
+    __slots__ = ('source', 'function')
+
+    def __init__(self, source: str):
+        """
+        Args:
+            source: Template text
+        """
+        self.source = source
+        constants = []
+        parts = []
+        lines = []
+        literal = []
+        position = 0
+
+        def constant(value):
+            constants.append(value)
+            return f"C[{len(constants) - 1}]"
+
+        for match in TOKEN_PATTERN.finditer(source):
+            literal.append(source[position:match.start()])
+            position = match.end()
+
+            token = match.group(0)
+            variable = VARIABLE_PATTERN.match(match.group(1)) if token not in ('{{', '}}') else None
+            if variable is None:
+                # Escaped braces stand for one brace, unknown syntax for itself
+                literal.append(token[0] if token in ('{{', '}}') else token)
+                continue
+
+            if literal:
+                parts.append(constant(''.join(literal)))
+                literal = []
+            root, *path = variable.group(1).split('.')
+            name = f"v{len(lines) // 2}"
+            constant(token)
+            lines.append(f"    {name} = {value_expression(root, tuple(path), len(constants) - 1)}")
+            default = constant((variable.group(2) or '').strip())
+            lines.append(f"    {name} = {default} if {name} is None or {name} == '' else str({name})")
+            parts.append(name)
+        literal.append(source[position:])
+        parts.append(constant(''.join(literal)))
+
+        code = "def render(user, bot, extra):\n"
+        code += "".join(line + "\n" for line in lines)
+        code += f"    return {' + '.join(parts)}\n"
+        namespace = {'C': tuple(constants), 'lookup': lookup}
+        exec(compile(code, '<template>', 'exec'), namespace)
+        self.function = namespace['render']
+
+    def render(self, user=None, bot=None, **extra) -> str:
+        """
+        Render for a user
+
+        Args:
+            user: BotUser model instance
+            bot: TelegramBot model instance
+            **extra: Further variables
+
+        Returns:
+            Rendered text
+        """
+        return self.function(user, bot, extra)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def compile_template(source: str) -> Template:
+    """Compiled template for a text, cached"""
+    return Template(source)
+
+
+def render(source: Optional[str], user=None, bot=None, **extra) -> str:
+    """
+    Render a template text (empty for None)
+
+    Args:
+        source: Template text
+        user: BotUser model instance
+        bot: TelegramBot model instance
+        **extra: Further variables
+
+    Returns:
+        Rendered text
+    """
+    if not source:
+        return source or ''
+    return compile_template(source).function(user, bot, extra)
+
@@ -1,3 +1,899 @@
-from django.test import TestCase
+from datetime import timedelta
+import json
+import os
+import subprocess
+import sys
 
-# Create your tests here.
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+
+# Milliseconds django.setup() plus importing the API may take, on top of
+# the interpreter's own start-up imports (IMPORT_TIME_BUDGET_MS overrides)
+IMPORT_TIME_BUDGET_MS = int(os.getenv('IMPORT_TIME_BUDGET_MS', '1000'))
+
+API_IMPORT = "import django; django.setup(); import Bot.views"
+
+
+def make_bot(**fields):
+    """A bot whose saves queue no webhook or username tasks"""
+    from Bot.models import TelegramBot
+
+    fields = dict({'name': 'Test bot', 'token': '1:test', 'username': 'test_bot', 'auto_setup_webhook': False}, **fields)
+    return TelegramBot.objects.create(**fields)
+
+
+class FakeTelegramTestCase(TestCase):
+    """TestCase whose Telegram calls go to a fake Bot API"""
+
+    @classmethod
+    def setUpClass(cls):
+        from django.test import override_settings
+        from Bot.fake_telegram import FakeTelegramAPI
+
+        super().setUpClass()
+        cls.api = FakeTelegramAPI().start()
+        cls.addClassCleanup(cls.api.stop)
+        cls.enterClassContext(override_settings(TELEGRAM_API_BASE_URL=cls.api.url))
+
+    def setUp(self):
+        self.api.rate_limit_ratio = 0.0
+        self.api.revoked_tokens.clear()
+        self.api.blocked_chats.clear()
+        self.api.calls.clear()
+
+
+def import_times(code: str):
+    """
+    Run code in a fresh interpreter under ``-X importtime``
+
+    Returns:
+        (total microseconds of top-level imports, names of imported modules)
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'MAIN.settings'))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    total = 0
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        modules.add(name.strip())
+        # Nested imports are indented and already counted in their parent
+        if len(name) - len(name.lstrip()) <= 1:
+            total += int(cumulative)
+    return total, modules
+
+
+class ImportTimeTests(SimpleTestCase):
+    """Worker and server start-up must not pay for code only used by some updates"""
+
+    def test_api_import_within_budget(self):
+        startup, _ = import_times("pass")
+        total, _ = import_times(API_IMPORT)
+        elapsed_ms = (total - startup) / 1000
+        self.assertLess(
+            elapsed_ms, IMPORT_TIME_BUDGET_MS,
+            f"django.setup() and importing the API took {elapsed_ms:.0f}ms "
+            f"(budget {IMPORT_TIME_BUDGET_MS}ms); see python -X importtime",
+        )
+
+    def test_api_import_is_lazy(self):
+        _, modules = import_times(API_IMPORT)
+        for module in ('telegram', 'Bot.services.base', 'Bot.services.custom_bot'):
+            self.assertNotIn(module, modules, f"{module} is imported at start-up")
+
+
+class MetricsTests(SimpleTestCase):
+
+    def test_thread_shards_are_bounded(self):
+        import threading
+        from Bot.metrics import Counter, REGISTRY
+
+        counter = Counter('test_shards_total', 'Test counter', ['kind'])
+        self.addCleanup(REGISTRY.remove, counter)
+        for _ in range(50):
+            thread = threading.Thread(target=counter.inc, args=(('a',),))
+            thread.start()
+            thread.join()
+        # Registering a thread folds the finished ones, without a scrape
+        self.assertLessEqual(len(counter._shards), 2)
+        self.assertEqual(counter.collect(), {('a',): 50})
+
+    def test_render_skips_stray_snapshot_files(self):
+        import json
+        import tempfile
+        from django.test import override_settings
+        from Bot import metrics
+
+        with tempfile.TemporaryDirectory() as directory:
+            for filename, content in (('tmp.json', '{}'), ('999999.json.tmp', '{'), ('1.json', '{}')):
+                with open(os.path.join(directory, filename), 'w') as f:
+                    f.write(content)
+            with override_settings(METRICS_MULTIPROCESS_DIR=directory):
+                self.assertIn('# TYPE', metrics.render())
+
+
+class SchedulerTests(TestCase):
+
+    def setUp(self):
+        self.bot = make_bot()
+        self.user = self.bot.users.create(chat_id=100)
+
+    def test_timer_wheel_fires_items_once_when_due(self):
+        from Bot.scheduler import TimerWheel
+
+        wheel = TimerWheel(tick=1, bits=2, levels=3, now=0)
+        # Within level 0, in a higher level, and beyond the wheel's span
+        for when in (2, 37, 100):
+            wheel.add(when, when)
+        self.assertEqual(wheel.advance(1), [])
+        self.assertEqual(wheel.advance(2), [2])
+        self.assertEqual(wheel.advance(36), [])
+        self.assertEqual(wheel.advance(40), [37])
+        self.assertEqual(wheel.advance(100), [100])
+        self.assertEqual(len(wheel), 0)
+
+    def test_fire_jobs_queues_message_and_reschedules_recurring_job(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from Bot.models import OutgoingMessage
+        from Bot.scheduler import fire_jobs, schedule
+
+        now = timezone.now()
+        job = schedule(self.user, 'reminder', now - timedelta(seconds=250), text='hi', interval=100)
+
+        result = fire_jobs([job.pk], now=now)
+
+        job.refresh_from_db()
+        self.assertEqual(result['sent'], 1)
+        self.assertEqual(job.status, 'pending')
+        self.assertEqual(job.runs, 1)
+        # Missed runs are skipped, not sent
+        self.assertEqual(job.run_at, now + timedelta(seconds=50))
+        self.assertEqual(result['reschedule'], [(job.pk, job.run_at)])
+        message = OutgoingMessage.objects.get()
+        self.assertEqual((message.chat_id, message.idempotency_key), (100, f"job:{job.pk}:1"))
+
+        # A second scheduler holding the old run_at changes nothing
+        fire_jobs([job.pk], now=now)
+        self.assertEqual(OutgoingMessage.objects.count(), 1)
+
+    def test_fire_jobs_skips_blocked_users_and_other_states(self):
+        from django.utils import timezone
+        from Bot.models import OutgoingMessage
+        from Bot.scheduler import fire_jobs, schedule
+
+        now = timezone.now()
+        in_state = schedule(self.user, 'in_state', now, text='hi', only_in_state='waiting')
+        self.user.is_blocked = True
+        self.user.save()
+        blocked = schedule(self.user, 'blocked', now, text='hi')
+
+        result = fire_jobs([in_state.pk, blocked.pk], now=now)
+
+        self.assertEqual((result['sent'], result['skipped']), (0, 2))
+        self.assertFalse(OutgoingMessage.objects.exists())
+        in_state.refresh_from_db()
+        self.assertEqual(in_state.status, 'skipped')
+
+
+class UpdateUserTests(TestCase):
+
+    def test_non_message_update_counts_as_interaction(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from Bot.models import BotUser
+        from Bot.views import record_update_user
+
+        bot = make_bot()
+        user = bot.users.create(chat_id=100)
+        idle_since = timezone.now() - timedelta(days=30)
+        BotUser.objects.filter(pk=user.pk).update(last_interaction=idle_since)
+
+        record_update_user(bot, 100, {'id': 100})
+
+        user.refresh_from_db()
+        self.assertGreater(user.last_interaction, idle_since)
+
+
+class WebhookGuardTests(TestCase):
+
+    def setUp(self):
+        from Bot.webhooks import active_bots
+
+        self.bot = make_bot(webhook_secret='s3cret')
+        self.url = f'/api/webhook/{self.bot.pk}'
+        active_bots.invalidate()
+        self.addCleanup(active_bots.invalidate)
+
+    def reject(self, headers=None, body=b'{}', bot_id=None):
+        from django.test import RequestFactory
+        from Bot.webhooks import reject_webhook_request
+
+        request = RequestFactory().post(self.url, body, content_type='application/json', headers=headers)
+        return reject_webhook_request(request, bot_id or str(self.bot.pk))
+
+    def test_secret_is_required_and_checked(self):
+        self.assertEqual(self.reject(), (403, 'missing_secret'))
+        self.assertEqual(self.reject({'X-Telegram-Bot-Api-Secret-Token': 'wrong'}), (403, 'bad_secret'))
+        self.assertIsNone(self.reject({'X-Telegram-Bot-Api-Secret-Token': 's3cret'}))
+
+    def test_legacy_webhooks_accepted_while_not_required(self):
+        from django.test import override_settings
+
+        with override_settings(WEBHOOK_REQUIRE_SECRET=False):
+            self.assertIsNone(self.reject())
+            self.assertEqual(self.reject({'X-Telegram-Bot-Api-Secret-Token': 'wrong'}), (403, 'bad_secret'))
+
+    def test_unknown_inactive_and_oversized_requests(self):
+        from django.test import override_settings
+        from Bot.webhooks import active_bots
+
+        self.assertEqual(self.reject(bot_id='not-a-uuid'), (404, 'unknown_bot'))
+        with override_settings(WEBHOOK_MAX_BODY_BYTES=10):
+            self.assertEqual(self.reject(body=b'{"update_id": 1}'), (413, 'too_large'))
+        self.bot.is_active = False
+        self.bot.save()
+        active_bots.invalidate()
+        self.assertEqual(self.reject({'X-Telegram-Bot-Api-Secret-Token': 's3cret'}), (404, 'unknown_bot'))
+
+    def test_rejected_request_answers_with_status(self):
+        response = self.client.post(self.url, b'{}', content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+
+class SQLiteSharedStateTests(SimpleTestCase):
+
+    def test_threads_share_the_file(self):
+        import tempfile
+        import threading
+        from Bot.shared_state.sqlite import SQLiteBackend
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        backend = SQLiteBackend(os.path.join(directory.name, 'state.sqlite3'))
+        threads = [threading.Thread(target=backend.incr, args=('count',)) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(backend._ready)
+        self.assertEqual(backend.get('count'), '20')
+        self.assertEqual(backend.connection.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+
+class ShardingTests(TestCase):
+
+    def test_router_places_messages_on_their_bots_shard(self):
+        import uuid
+        from django.test import override_settings
+        from Bot.models import BotMessage, BotUser, TelegramBot
+        from Bot.sharding import MessageShardRouter, shard_for
+
+        shards = ['messages_0', 'messages_1', 'messages_2']
+        pinned = uuid.uuid4()
+        bot_ids = [uuid.uuid4() for _ in range(30)]
+        with override_settings(MESSAGE_SHARD_DATABASES=shards, MESSAGE_SHARD_PINS={str(pinned): 'messages_2'}):
+            placement = {bot_id: shard_for(bot_id) for bot_id in bot_ids}
+            self.assertEqual(set(placement.values()), set(shards))
+            self.assertEqual(shard_for(pinned), 'messages_2')
+            # Adding a shard only moves bots onto it
+            with override_settings(MESSAGE_SHARD_DATABASES=[*shards, 'messages_3']):
+                for bot_id, shard in placement.items():
+                    self.assertIn(shard_for(bot_id), (shard, 'messages_3'))
+
+            router = MessageShardRouter()
+            bot = TelegramBot(id=bot_ids[0])
+            self.assertEqual(router.db_for_write(BotMessage, instance=BotMessage(bot=bot)), placement[bot.pk])
+            self.assertEqual(router.db_for_read(BotMessage, instance=bot), placement[bot.pk])
+            user = BotUser(bot=bot)
+            user._state.db = 'messages_1'
+            self.assertEqual(router.db_for_read(TelegramBot, instance=user), 'default')
+            self.assertIsNone(router.db_for_read(TelegramBot))
+
+    def test_bot_delete_skips_per_user_shard_deletes(self):
+        from unittest import mock
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        bot = make_bot()
+        for chat_id in range(5):
+            bot.users.create(chat_id=chat_id)
+
+        with mock.patch('Bot.sharding.message_shards', return_value=['default']), \
+                CaptureQueriesContext(connection) as queries:
+            bot.delete()
+        shard_deletes = [
+            query['sql'] for query in queries
+            if query['sql'].startswith('DELETE FROM "Bot_botmessage"') and '"bot_id" =' in query['sql']
+        ]
+        per_user = [
+            query['sql'] for query in queries
+            if query['sql'].startswith('DELETE FROM "Bot_botmessage"') and '"user_id" =' in query['sql']
+        ]
+        self.assertEqual(len(shard_deletes), 1)
+        self.assertEqual(per_user, [])
+
+    def test_user_delete_deletes_their_shard_messages(self):
+        from unittest import mock
+        from Bot.models import BotMessage
+
+        bot = make_bot()
+        user, other = bot.users.create(chat_id=1), bot.users.create(chat_id=2)
+        for sender in (user, other):
+            BotMessage.objects.create(bot=bot, user=sender, direction='incoming', telegram_message_id=1)
+
+        with mock.patch('Bot.sharding.message_shards', return_value=['default']):
+            user.delete()
+        self.assertEqual(list(BotMessage.objects.values_list('user_id', flat=True)), [other.pk])
+
+    def test_sharded_incoming_message_waits_for_the_user_commit(self):
+        from unittest import mock
+        from Bot.models import BotMessage
+        from Bot.views import record_incoming_message
+
+        bot = make_bot()
+        with mock.patch('Bot.views.shard_for', return_value='messages_0'), \
+                self.captureOnCommitCallbacks() as callbacks:
+            user = record_incoming_message(bot, 100, {'id': 100}, 'text', 'hi', None, 1)
+            self.assertFalse(BotMessage.objects.exists())
+        for callback in callbacks:
+            callback()
+        self.assertEqual(BotMessage.objects.get().user_id, user.pk)
+
+
+class OutboxTests(FakeTelegramTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.bot = make_bot()
+
+    def test_messages_are_delivered_in_order(self):
+        from Bot.models import OutgoingMessage
+        from Bot.outbox import enqueue, process_outbox
+
+        for text in ('one', 'two'):
+            enqueue(self.bot, 100, text=text)
+        enqueue(self.bot, 100, idempotency_key='same', text='three')
+        enqueue(self.bot, 100, idempotency_key='same', text='three')
+
+        self.assertEqual(process_outbox(), 3)
+        sent = OutgoingMessage.objects.order_by('id')
+        self.assertEqual([message.status for message in sent], ['sent'] * 3)
+        self.assertEqual(
+            [message.telegram_message_id for message in sent],
+            sorted(message.telegram_message_id for message in sent),
+        )
+
+    def test_retry_after_delays_every_pending_message_of_the_bot(self):
+        from django.utils import timezone
+        from Bot.models import OutgoingMessage
+        from Bot.outbox import enqueue, process_outbox
+
+        self.api.rate_limit_ratio = 1.0
+        self.api.retry_after = 30
+        first, _ = enqueue(self.bot, 100, text='one')
+        second, _ = enqueue(self.bot, 100, text='two')
+        other_chat, _ = enqueue(self.bot, 200, text='not claimed yet')
+
+        process_outbox(limit=2)
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        other_chat.refresh_from_db()
+        # A flood wait is not a failed attempt; the second message was never tried
+        self.assertEqual((first.status, first.attempts, first.error_code), ('pending', 0, 429))
+        self.assertEqual((second.status, second.attempts), ('pending', 0))
+        self.assertEqual(self.api.calls['sendMessage'], 1)
+        for message in (first, other_chat):
+            self.assertGreater(message.run_after, timezone.now() + timedelta(seconds=25))
+        # The second message stays queued behind the first
+        self.assertEqual(process_outbox(), 0)
+        self.assertFalse(OutgoingMessage.objects.exclude(status='pending').exists())
+
+    def test_chat_waiting_for_a_retry_is_not_overtaken(self):
+        from django.test import override_settings
+        from django.utils import timezone
+        from Bot.outbox import enqueue, process_outbox
+
+        first, _ = enqueue(self.bot, 100, text='one')
+        # Nothing listens there: a network error, retried with backoff
+        with override_settings(TELEGRAM_API_BASE_URL='http://127.0.0.1:9'):
+            self.assertEqual(process_outbox(), 1)
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.attempts), ('pending', 1))
+        self.assertGreater(first.run_after, timezone.now())
+
+        second, _ = enqueue(self.bot, 100, text='two')
+        other_chat, _ = enqueue(self.bot, 200, text='other')
+        self.assertEqual(process_outbox(), 1)
+        second.refresh_from_db()
+        other_chat.refresh_from_db()
+        self.assertEqual((second.status, other_chat.status), ('pending', 'sent'))
+
+
+class BotTaskTests(FakeTelegramTestCase):
+
+    def test_saving_a_bot_queues_its_telegram_calls_once(self):
+        from Bot.models import BotTask
+
+        bot = make_bot(username='', auto_setup_webhook=True)
+        bot.save()
+        self.assertEqual(
+            sorted(BotTask.objects.values_list('task_type', flat=True)), ['fetch_username', 'setup_webhook']
+        )
+
+    def test_tasks_update_the_bot_without_signals(self):
+        from django.test import override_settings
+        from Bot.models import BotTask
+        from Bot.tasks import process_due_tasks
+
+        bot = make_bot(username='', auto_setup_webhook=True)
+        with override_settings(BASE_URL='https://bots.example.com'):
+            self.assertEqual(process_due_tasks(), 2)
+
+        bot.refresh_from_db()
+        self.assertTrue(bot.is_webhook_set)
+        self.assertTrue(bot.username.startswith('fake_'))
+        self.assertEqual(self.api.webhooks[bot.token]['secret_token'], bot.webhook_secret)
+        self.assertEqual(set(BotTask.objects.values_list('status', flat=True)), {'done'})
+
+    def test_flood_wait_is_retried_and_revoked_token_fails(self):
+        from django.utils import timezone
+        from Bot.models import BotTask
+        from Bot.tasks import enqueue_bot_task, process_due_tasks
+
+        flooded = make_bot()
+        revoked = make_bot(token='2:revoked')
+        self.api.revoked_tokens.add(revoked.token)
+        self.api.rate_limit_ratio = 1.0
+        self.api.retry_after = 30
+        enqueue_bot_task(flooded, 'fetch_username')
+        process_due_tasks()
+        self.api.rate_limit_ratio = 0.0
+        enqueue_bot_task(revoked, 'fetch_username')
+        process_due_tasks()
+
+        retried = BotTask.objects.get(bot=flooded)
+        self.assertEqual(retried.status, 'pending')
+        self.assertGreater(retried.run_after, timezone.now() + timedelta(seconds=25))
+        self.assertEqual(BotTask.objects.get(bot=revoked).status, 'failed')
+
+
+class UserStateTests(TransactionTestCase):
+    """Handlers get their own connection inside the event loop, so test data must be committed"""
+
+    def setUp(self):
+        self.bot = make_bot()
+        self.user = self.bot.users.create(chat_id=100)
+
+    def test_save_state_fails_on_a_stale_version(self):
+        from Bot.models import BotUser, StaleUserState
+
+        first, second = BotUser.objects.get(pk=self.user.pk), BotUser.objects.get(pk=self.user.pk)
+        first.user_state = 'welcomed'
+        first.save_state(['user_state'])
+        second.user_state = 'registered'
+        with self.assertRaises(StaleUserState):
+            second.save_state(['user_state'])
+
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.user_state, self.user.version), ('welcomed', 1))
+
+    def test_handler_reruns_on_current_state_after_a_conflict(self):
+        import asyncio
+        from unittest import mock
+        from Bot.models import BotUser, OutgoingMessage
+        from Bot.services.base import BaseBotService
+        from Bot.views import run_service_handler
+
+        runs = []
+
+        class CountingService(BaseBotService):
+            async def handle_text(self, text, message_data):
+                runs.append(self.bot_user.version)
+                count = self.bot_user.state_data.get('count', 0) + 1
+                await self.send_message(f"count {count}")
+                if len(runs) == 1:
+                    # Another update saves the same user meanwhile
+                    concurrent = BotUser.objects.get(pk=self.bot_user.pk)
+                    concurrent.state_data = {'count': 10}
+                    concurrent.save_state(['state_data'])
+                self.bot_user.state_data = {'count': count}
+                self.save_state('state_data')
+
+        service = CountingService(self.bot, self.user, update_id=1)
+        with mock.patch.dict(os.environ, {'DJANGO_ALLOW_ASYNC_UNSAFE': 'true'}):
+            asyncio.run(run_service_handler(service, 'handle_message', {'text': 'hi'}))
+
+        self.user.refresh_from_db()
+        self.assertEqual(runs, [0, 1])
+        self.assertEqual(self.user.state_data, {'count': 11})
+        # The interrupted run queued nothing
+        self.assertEqual(
+            [message.payload['text'] for message in OutgoingMessage.objects.all()], ['count 11']
+        )
+
+
+class AdmissionTests(TestCase):
+
+    def test_priorities(self):
+        from Bot.admission import update_priority
+        from Bot.updates import decode_update
+
+        def priority(**fields):
+            return update_priority(decode_update(dict({'update_id': 1}, **fields)))
+
+        chat = {'chat': {'id': 1, 'type': 'private'}, 'from': {'id': 1}, 'message_id': 1, 'date': 0}
+        self.assertEqual(priority(message=dict(chat, text='/start')), 'high')
+        self.assertEqual(priority(message=dict(chat, contact={'phone_number': '1', 'first_name': 'a'})), 'high')
+        self.assertEqual(priority(message=dict(chat, text='hello')), 'normal')
+        self.assertEqual(priority(callback_query={'id': '1', 'from': {'id': 1}, 'data': 'x', 'message': chat}), 'normal')
+        self.assertEqual(priority(edited_message=dict(chat, text='hello')), 'low')
+
+    def test_full_queue_and_timeout_are_refused(self):
+        from Bot.admission import AdmissionController, Overloaded
+
+        controller = AdmissionController(1, {'high': 1, 'normal': 0}, queue_timeout=0.05)
+        slot = controller.admit('normal')
+        with self.assertRaisesMessage(Overloaded, 'queue_full'):
+            controller.admit('normal')
+        with self.assertRaisesMessage(Overloaded, 'timeout'):
+            controller.admit('high')
+        slot.release()
+        slot.release()
+        self.assertEqual(controller.running, 0)
+        controller.admit('normal').release()
+        controller.close()
+        with self.assertRaisesMessage(Overloaded, 'shutting_down'):
+            controller.admit('high')
+
+    def test_freed_slot_goes_to_the_highest_priority(self):
+        import threading
+        import time
+        from Bot.admission import AdmissionController
+
+        controller = AdmissionController(1, {'high': 1, 'low': 1}, queue_timeout=5)
+        slot = controller.admit('high')
+        order = []
+
+        def wait(priority):
+            controller.admit(priority).release()
+            order.append(priority)
+
+        # The low priority update queues first
+        threads = []
+        for priority in ('low', 'high'):
+            threads.append(threading.Thread(target=wait, args=(priority,)))
+            threads[-1].start()
+            while controller.waiting() < len(threads):
+                time.sleep(0.001)
+        slot.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, ['high', 'low'])
+
+    def test_overloaded_webhook_asks_telegram_to_retry(self):
+        from unittest import mock
+        from django.test import override_settings
+        from Bot.admission import AdmissionController
+        from Bot.webhooks import active_bots
+
+        bot = make_bot(webhook_secret='s3cret')
+        active_bots.invalidate()
+        self.addCleanup(active_bots.invalidate)
+        full = AdmissionController(0, {}, queue_timeout=0)
+
+        with mock.patch('Bot.admission._controller', full), override_settings(WEBHOOK_RETRY_AFTER=7):
+            response = self.client.post(
+                f'/api/webhook/{bot.pk}', {'update_id': 1, 'message': {
+                    'message_id': 1, 'date': 0, 'chat': {'id': 1, 'type': 'private'}, 'from': {'id': 1}, 'text': 'hi'
+                }},
+                content_type='application/json', headers={'X-Telegram-Bot-Api-Secret-Token': 's3cret'},
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '7')
+
+
+class FakeClock:
+    """Stands in for the time module of flood protection and the memory shared state"""
+
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+def text_update(chat_id: int, text: str = 'hi', update_id: int = 1):
+    from Bot.updates import decode_update
+
+    return decode_update({'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 0, 'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id}, 'text': text,
+    }})
+
+
+class FloodTests(TestCase):
+
+    def setUp(self):
+        from unittest import mock
+        from django.test import override_settings
+        from Bot.shared_state import reset_backend
+
+        self.clock = FakeClock(1000.0)
+        for target in ('Bot.flood.time', 'Bot.shared_state.memory.time'):
+            patcher = mock.patch(target, self.clock)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        settings_override = override_settings(
+            SHARED_STATE_URL='memory://', FLOOD_STRIKE_HOURS=1, FLOOD_BLOCK_HOURS=24
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        reset_backend()
+        self.addCleanup(reset_backend)
+        self.bot = make_bot(flood_limit=3, flood_window=10, flood_block_after=2, flood_warning_text='Slow down')
+
+    def check(self, count: int = 1):
+        from Bot.flood import check_flood
+
+        return [check_flood(self.bot, text_update(100)) for _ in range(count)]
+
+    def test_window_slides(self):
+        # Never blocked
+        self.bot.flood_block_after = 0
+        self.assertEqual(self.check(4), ['allow', 'allow', 'allow', 'warn'])
+        # Halfway through the next window, half of the previous one still counts
+        self.clock.now = 1015.0
+        self.assertEqual(self.check(2), ['allow', 'drop'])
+
+    def test_strikes_block_until_the_block_expires(self):
+        from Bot.models import BotUser
+
+        user = self.bot.users.create(chat_id=100)
+        self.assertEqual(self.check(5), ['allow'] * 3 + ['warn', 'drop'])
+        self.clock.now = 1010.0
+        self.assertEqual(self.check(2), ['block', 'blocked'])
+
+        self.clock.now = 1010.0 + 24 * 3600 + 1
+        self.assertEqual(self.check(), ['allow'])
+        user.refresh_from_db()
+        self.assertFalse(user.is_blocked)
+
+    def test_first_strike_queues_the_warning_once(self):
+        from Bot.flood import handle_flood
+        from Bot.models import OutgoingMessage
+
+        dropped = [handle_flood(self.bot, text_update(100)) for _ in range(6)]
+
+        self.assertEqual(dropped, [False] * 3 + [True] * 3)
+        self.assertEqual(
+            list(OutgoingMessage.objects.values_list('chat_id', 'payload')), [(100, {'text': 'Slow down'})]
+        )
+        # Other chats have their own limit
+        self.assertFalse(handle_flood(self.bot, text_update(200)))
+
+
+class BreakerTests(FakeTelegramTestCase):
+
+    def setUp(self):
+        from Bot.shared_state import reset_backend
+
+        super().setUp()
+        reset_backend()
+        self.addCleanup(reset_backend)
+        self.bot = make_bot()
+
+    def test_revoked_token_opens_the_circuit_then_probes(self):
+        from django.utils import timezone
+        from Bot.models import OutgoingMessage
+        from Bot.outbox import enqueue, process_outbox
+
+        self.api.revoked_tokens.add(self.bot.token)
+        for chat_id in (100, 200, 300):
+            enqueue(self.bot, chat_id, text='hi')
+
+        with self.settings(BOT_BREAKER_THRESHOLD=3, BOT_BREAKER_COOLDOWN=60):
+            process_outbox(concurrency=1)
+        # Only the first call is made; every message waits out the cooldown, none used an attempt
+        self.assertEqual(self.api.calls['sendMessage'], 1)
+        pending = OutgoingMessage.objects.filter(status='pending', attempts=0)
+        self.assertEqual(pending.filter(run_after__gt=timezone.now() + timedelta(seconds=50)).count(), 3)
+
+        # After the cooldown one message probes the token
+        self.api.revoked_tokens.clear()
+        OutgoingMessage.objects.update(run_after=timezone.now())
+        self.assertEqual(process_outbox(), 1)
+        self.assertEqual(process_outbox(), 2)
+        self.assertEqual(OutgoingMessage.objects.filter(status='sent').count(), 3)
+
+    def test_repeated_trips_deactivate_the_bot(self):
+        from django.core import mail
+        from Bot.models import OutgoingMessage
+        from Bot.outbox import enqueue, process_outbox
+
+        self.api.revoked_tokens.add(self.bot.token)
+        enqueue(self.bot, 100, text='hi')
+        enqueue(self.bot, 200, text='hi')
+
+        with self.settings(BOT_BREAKER_THRESHOLD=1, ADMINS=[('Admin', 'admin@example.com')]):
+            process_outbox()
+
+        self.bot.refresh_from_db()
+        self.assertFalse(self.bot.is_active)
+        self.assertEqual(set(OutgoingMessage.objects.values_list('status', 'error_code')), {('failed', 401)})
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(self.bot.name, mail.outbox[0].subject)
+
+    def test_user_who_blocked_the_bot_gets_nothing_more(self):
+        from Bot.outbox import enqueue, process_outbox
+
+        user = self.bot.users.create(chat_id=100)
+        self.api.blocked_chats.add(100)
+        first, _ = enqueue(self.bot, 100, user=user, text='one')
+        process_outbox()
+
+        user.refresh_from_db()
+        first.refresh_from_db()
+        self.assertTrue(user.is_blocked)
+        self.assertEqual((first.status, first.error_code), ('failed', 403))
+
+        second, _ = enqueue(self.bot, 100, user=user, text='two')
+        process_outbox()
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'failed')
+        self.assertEqual(self.api.calls['sendMessage'], 1)
+
+
+class TemplateTests(SimpleTestCase):
+
+    def setUp(self):
+        from Bot.models import BotUser, TelegramBot
+
+        self.bot = TelegramBot(name='Shop', username='shop_bot')
+        self.user = BotUser(
+            chat_id=42, first_name='Ann', last_name='', user_state='registered',
+            state_data={'q1': 5, 'address': {'city': 'Oslo'}, 'empty': ''},
+        )
+
+    def render(self, text, **extra):
+        from Bot.templating import render
+
+        return render(text, self.user, self.bot, **extra)
+
+    def test_variables_and_defaults(self):
+        self.assertEqual(self.render("Hi {first_name} {last_name|-} ({chat_id})"), "Hi Ann - (42)")
+        self.assertEqual(
+            self.render("{state.q1}/{state.address.city}/{state.empty|none}/{state.missing|?}"), "5/Oslo/none/?"
+        )
+        self.assertEqual(self.render("{ bot.name } @{bot.username}, {user_state}"), "Shop @shop_bot, registered")
+        self.assertEqual(self.render("Ticket {ticket.id|new}", ticket={'id': 7}), "Ticket 7")
+        self.assertEqual(self.render("Ticket {ticket.id|new}", ticket={}), "Ticket new")
+
+    def test_other_braces_are_kept(self):
+        self.assertEqual(
+            self.render("{{first_name}} {unknown} {not a name} {}"), "{first_name} {unknown} {not a name} {}"
+        )
+        self.assertEqual(self.render("{__import__('os').getcwd()}"), "{__import__('os').getcwd()}")
+        self.assertEqual(self.render("{a|'); import os; ('}"), "{a|'); import os; ('}")
+        self.assertEqual(self.render(None), '')
+
+    def test_compiled_once_per_text(self):
+        from Bot.templating import compile_template
+
+        self.assertIs(compile_template("Hi {first_name}"), compile_template("Hi {first_name}"))
+        self.assertEqual(compile_template("Hi {first_name|there}").render(), "Hi there")
+
+
+class UpdateDecodingTests(SimpleTestCase):
+
+    def message(self, **fields):
+        from Bot.updates import decode_update
+
+        raw = dict({'message_id': 5, 'date': 0, 'chat': {'id': 42, 'type': 'private'}, 'from': {'id': 42}}, **fields)
+        return decode_update(json.dumps({'update_id': 9, 'message': raw}).encode()).message
+
+    def test_message_kinds(self):
+        text = self.message(text='hello')
+        self.assertEqual((text.message_type, text.text, text.chat_id, text.message_id), ('text', 'hello', 42, 5))
+        photo = self.message(photo=[{'file_id': 'small'}, {'file_id': 'large'}], caption='look')
+        self.assertEqual((photo.message_type, photo.file_id, photo.text), ('photo', 'large', 'look'))
+        location = self.message(location={'latitude': 1.5, 'longitude': 2})
+        self.assertEqual((location.message_type, location.text), ('location', '1.5,2'))
+        # The first kind in the table wins
+        contact = self.message(contact={'phone_number': '+1'}, document={'file_id': 'd'})
+        self.assertEqual((contact.message_type, contact.contact), ('contact', {'phone_number': '+1'}))
+
+    def test_update_types_and_chats(self):
+        from Bot.updates import decode_update
+
+        press = decode_update({'update_id': 1, 'callback_query': {
+            'id': 'q', 'data': 'menu', 'from': {'id': 42}, 'message': {'message_id': 3, 'chat': {'id': 42}},
+        }})
+        self.assertEqual((press.type, press.chat_id, press.callback_query.data), ('callback_query', 42, 'menu'))
+        self.assertEqual(press.callback_query.message_id, 3)
+
+        member = decode_update({'update_id': 2, 'my_chat_member': {
+            'chat': {'id': 42}, 'from': {'id': 42}, 'new_chat_member': {'status': 'kicked'},
+        }})
+        self.assertEqual((member.type, member.my_chat_member.status), ('my_chat_member', 'kicked'))
+
+        # Inline mode has no chat; unknown types are not decoded
+        inline = decode_update({'update_id': 3, 'callback_query': {'id': 'q', 'inline_message_id': 'i'}})
+        self.assertEqual((inline.type, inline.callback_query, inline.chat_id), ('callback_query', None, None))
+        poll = decode_update({'update_id': 4, 'poll': {'id': 'p'}})
+        self.assertEqual((poll.type, poll.chat_id), ('poll', None))
+
+    def test_body_must_be_an_object(self):
+        from Bot.updates import decode_update
+
+        for body in (b'[]', b'"text"', b'{'):
+            with self.assertRaises(ValueError):
+                decode_update(body)
+
+
+class UpdateRoutingTests(TestCase):
+
+    def test_allowed_updates_follow_the_handlers(self):
+        from Bot.models import TelegramBot
+        from Bot.services.base import BaseBotService
+        from Bot.webhooks import get_webhook_config
+
+        class EditingService(BaseBotService):
+            async def handle_text(self, text, message_data):
+                pass
+
+            async def handle_edited_message(self, message_data):
+                pass
+
+        self.assertEqual(EditingService.handled_update_types(), ('message', 'edited_message', 'my_chat_member'))
+        simple = TelegramBot(bot_type='simple', webhook_secret='s')
+        support = TelegramBot(bot_type='support', webhook_secret='s')
+        self.assertEqual(get_webhook_config(simple, 'https://x')['allowed_updates'], ['message', 'my_chat_member'])
+        self.assertIn('callback_query', get_webhook_config(support, 'https://x')['allowed_updates'])
+        with self.settings(TELEGRAM_WEBHOOK_ALLOWED_UPDATES=['message']):
+            self.assertEqual(get_webhook_config(support, 'https://x')['allowed_updates'], ['message'])
+
+    def test_route_update(self):
+        from Bot.services.factory import BotServiceFactory
+        from Bot.updates import decode_update
+        from Bot.views import record_incoming_message, record_update_user, route_update
+
+        simple = BotServiceFactory.get_service_class('simple')
+        support = BotServiceFactory.get_service_class('support')
+        chat = {'message_id': 1, 'date': 0, 'chat': {'id': 42}, 'from': {'id': 42}}
+        press = decode_update({'update_id': 1, 'callback_query': {
+            'id': 'q', 'data': 'menu', 'from': {'id': 42}, 'message': chat,
+        }})
+        contact = decode_update({'update_id': 2, 'message': dict(chat, contact={'phone_number': '+1'})})
+        edit = decode_update({'update_id': 3, 'edited_message': dict(chat, text='hi')})
+
+        # Types the service does not handle are neither stored nor dispatched
+        self.assertIsNone(route_update(press, simple))
+        self.assertIsNone(route_update(edit, support))
+        (record, *_), handler, _ = route_update(press, support)
+        self.assertEqual((record, handler), (record_update_user, 'handle_callback_query'))
+        (record, *_), handler, argument = route_update(contact, simple)
+        self.assertEqual(
+            (record, handler, argument), (record_incoming_message, 'handle_contact', {'phone_number': '+1'})
+        )
+
+    def test_unhandled_update_is_acknowledged_without_writes(self):
+        from Bot.models import BotUser
+        from Bot.webhooks import active_bots
+
+        bot = make_bot(bot_type='simple', webhook_secret='s3cret')
+        active_bots.invalidate()
+        self.addCleanup(active_bots.invalidate)
+        response = self.client.post(
+            f'/api/webhook/{bot.pk}',
+            {'update_id': 1, 'edited_message': {'message_id': 1, 'date': 0, 'chat': {'id': 42}, 'from': {'id': 42}}},
+            content_type='application/json', headers={'X-Telegram-Bot-Api-Secret-Token': 's3cret'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(BotUser.objects.exists())
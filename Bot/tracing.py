@@ -0,0 +1,241 @@
+"""
+Per-update tracing spans
+
+A trace is started for a sampled fraction of webhook updates
+(TRACING_SAMPLE_RATE); ``span()`` blocks anywhere below it record how long
+each stage took. The current span lives in a context variable, so spans
+follow the update into the service thread, its event loop tasks and the
+serialized DB writer. Outside a sampled trace ``span()`` costs one context
+variable lookup.
+
+Finished traces are:
+
+- appended to TRACING_EXPORT_PATH in the Chrome trace event format (open it
+  in chrome://tracing or https://ui.perfetto.dev)
+- kept in a per-process buffer of the slowest TRACING_SLOWEST_COUNT updates,
+  shown on the "Slow Updates" admin page
+"""
+from contextlib import contextmanager
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+
+_current_span = contextvars.ContextVar('tracing_current_span', default=None)
+
+
+class Span:
+    """One timed stage of a trace"""
+    __slots__ = ('trace', 'name', 'parent', 'depth', 'start', 'end', 'thread_id', 'attributes')
+
+    def __init__(self, trace, name: str, parent=None, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.start = time.perf_counter()
+        self.end = None
+        self.thread_id = threading.get_ident()
+        self.attributes = attributes or {}
+
+    @property
+    def duration(self) -> float:
+        """Seconds, up to now while the span is still open"""
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    @property
+    def offset(self) -> float:
+        """Seconds since the trace started"""
+        return self.start - self.trace.root.start
+
+    @property
+    def duration_ms(self) -> float:
+        return round(self.duration * 1000, 2)
+
+    @property
+    def offset_ms(self) -> float:
+        return round(self.offset * 1000, 2)
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+
+class Trace:
+    """All spans recorded while handling one update"""
+
+    def __init__(self, name: str, attributes=None):
+        self.trace_id = uuid.uuid4().hex
+        self.started_at = time.time()
+        self.spans = []
+        self.root = self.add_span(name, None, attributes)
+
+    def add_span(self, name: str, parent, attributes=None) -> Span:
+        span = Span(self, name, parent, attributes)
+        # list.append is atomic, spans may come from several threads
+        self.spans.append(span)
+        return span
+
+    @property
+    def name(self) -> str:
+        return self.root.name
+
+    @property
+    def duration(self) -> float:
+        return self.root.duration
+
+    @property
+    def duration_ms(self) -> float:
+        return self.root.duration_ms
+
+    @property
+    def attributes(self) -> dict:
+        return self.root.attributes
+
+    def ordered_spans(self):
+        """Spans in tree order, for display"""
+        children = {}
+        for span in self.spans:
+            children.setdefault(id(span.parent), []).append(span)
+
+        ordered = []
+        stack = [self.root]
+        while stack:
+            span = stack.pop()
+            ordered.append(span)
+            stack.extend(sorted(children.get(id(span), []), key=lambda child: child.start, reverse=True))
+        return ordered
+
+    def to_events(self) -> list:
+        """Chrome trace event format ("complete" events, microseconds)"""
+        pid = os.getpid()
+        events = []
+        for span in self.spans:
+            args = {key: str(value) for key, value in span.attributes.items()}
+            args['trace_id'] = self.trace_id
+            events.append({
+                'name': span.name,
+                'cat': 'update',
+                'ph': 'X',
+                'ts': round((self.started_at + span.offset) * 1e6),
+                'dur': round(span.duration * 1e6),
+                'pid': pid,
+                'tid': span.thread_id,
+                'args': args,
+            })
+        return events
+
+
+class SlowestTraces:
+    """Keeps the N slowest traces seen by this process"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._heap = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def add(self, trace: Trace) -> None:
+        item = (trace.duration, next(self._counter), trace)
+        with self._lock:
+            if len(self._heap) < self.size:
+                heapq.heappush(self._heap, item)
+            elif item[0] > self._heap[0][0]:
+                heapq.heapreplace(self._heap, item)
+
+    def traces(self) -> list:
+        """Slowest first"""
+        with self._lock:
+            items = list(self._heap)
+        return [trace for duration, counter, trace in sorted(items, reverse=True)]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._heap.clear()
+
+
+slowest_traces = SlowestTraces(getattr(settings, 'TRACING_SLOWEST_COUNT', 50))
+
+_export_lock = threading.Lock()
+
+
+def export_trace(trace: Trace, path: str) -> None:
+    """
+    Append a trace to a Chrome trace event file
+
+    The JSON array format allows the closing bracket to be missing, so the
+    file stays valid while it is being appended to.
+    """
+    lines = ''.join(json.dumps(event) + ',\n' for event in trace.to_events())
+    with _export_lock:
+        with open(path, 'a') as f:
+            if f.tell() == 0:
+                f.write('[\n')
+            f.write(lines)
+
+
+def finish_trace(trace: Trace) -> None:
+    slowest_traces.add(trace)
+
+    path = getattr(settings, 'TRACING_EXPORT_PATH', None)
+    if path:
+        try:
+            export_trace(trace, path)
+        except OSError:
+            pass
+
+
+def should_sample() -> bool:
+    rate = getattr(settings, 'TRACING_SAMPLE_RATE', 0)
+    return rate > 0 and (rate >= 1 or random.random() < rate)
+
+
+@contextmanager
+def start_trace(name: str, **attributes):
+    """
+    Start a trace for one update if it is sampled
+
+    Yields:
+        The root Span, or None when the update is not sampled
+    """
+    if not should_sample():
+        yield None
+        return
+
+    trace = Trace(name, attributes)
+    token = _current_span.set(trace.root)
+    try:
+        yield trace.root
+    finally:
+        trace.root.end = time.perf_counter()
+        _current_span.reset(token)
+        finish_trace(trace)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time a stage of the current trace; does nothing outside a sampled trace
+
+    Yields:
+        The Span, or None when no trace is active
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    current = parent.trace.add_span(name, parent, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    finally:
+        current.end = time.perf_counter()
+        _current_span.reset(token)
@@ -0,0 +1,161 @@
+"""
+Telegram update decoding
+
+``decode_update`` turns a raw webhook body into small slotted structs that
+carry only the fields the pipeline uses. Messages are classified by a
+table (``MESSAGE_KINDS``) covering every BotMessage.MESSAGE_TYPE_CHOICES
+entry. A single set check against the message keys recognises plain text
+messages - the common case - without walking the table.
+
+``Update.type`` names the kind of update (``message``, ``callback_query``,
+...); the bot services route each type to a handler (see
+``BaseBotService.UPDATE_HANDLERS``).
+"""
+from typing import Any, Dict, Optional
+import json
+
+
+def _file_id(value) -> Optional[str]:
+    return value.get('file_id')
+
+
+def _largest_photo(value) -> Optional[str]:
+    # Photos come as a list of sizes, smallest first
+    return value[-1].get('file_id') if value else None
+
+
+def _location_text(value) -> str:
+    return f"{value.get('latitude')},{value.get('longitude')}"
+
+
+# Message key -> (message type, file ID getter, text getter), in priority
+# order: the first key present in a message decides its type
+MESSAGE_KINDS = {
+    'contact': ('contact', None, None),
+    'photo': ('photo', _largest_photo, None),
+    'video': ('video', _file_id, None),
+    'document': ('document', _file_id, None),
+    'audio': ('audio', _file_id, None),
+    'voice': ('voice', _file_id, None),
+    'sticker': ('sticker', _file_id, None),
+    'location': ('location', None, _location_text),
+}
+MESSAGE_KIND_KEYS = frozenset(MESSAGE_KINDS)
+
+
+class IncomingMessage:
+    """The parts of a Telegram message the pipeline uses"""
+    __slots__ = ('message_id', 'chat_id', 'from_user', 'message_type', 'text', 'file_id', 'contact', 'raw')
+
+    def __init__(self, raw: Dict[str, Any]):
+        """
+        Args:
+            raw: Decoded "message" object, kept for the bot services
+        """
+        self.raw = raw
+        self.message_id = raw.get('message_id')
+        self.chat_id = (raw.get('chat') or {}).get('id')
+        self.from_user = raw.get('from') or {}
+        self.contact = raw.get('contact')
+        # Media messages carry their text as a caption
+        self.text = raw.get('text') or raw.get('caption') or ''
+        self.message_type = 'text'
+        self.file_id = None
+
+        if MESSAGE_KIND_KEYS.isdisjoint(raw):
+            return
+        for key, (message_type, get_file_id, get_text) in MESSAGE_KINDS.items():
+            if key in raw:
+                self.message_type = message_type
+                if get_file_id is not None:
+                    self.file_id = get_file_id(raw[key])
+                if get_text is not None:
+                    self.text = get_text(raw[key])
+                return
+
+
+class CallbackQuery:
+    """A pressed inline keyboard button"""
+    __slots__ = ('id', 'data', 'chat_id', 'message_id', 'from_user', 'raw')
+
+    def __init__(self, raw: Dict[str, Any]):
+        """
+        Args:
+            raw: Decoded "callback_query" object, kept for the bot services
+        """
+        self.raw = raw
+        self.id = raw.get('id')
+        self.data = raw.get('data') or ''
+        self.from_user = raw.get('from') or {}
+        # The message carrying the keyboard, edited in place when navigating
+        message = raw.get('message') or {}
+        self.message_id = message.get('message_id')
+        self.chat_id = (message.get('chat') or {}).get('id')
+
+
+class ChatMemberUpdate:
+    """The bot's membership in a chat changed (e.g. the user blocked or restarted it)"""
+    __slots__ = ('chat_id', 'from_user', 'status', 'raw')
+
+    def __init__(self, raw: Dict[str, Any]):
+        """
+        Args:
+            raw: Decoded "my_chat_member" object, kept for the bot services
+        """
+        self.raw = raw
+        self.chat_id = (raw.get('chat') or {}).get('id')
+        self.from_user = raw.get('from') or {}
+        # member, kicked, left, ...
+        self.status = (raw.get('new_chat_member') or {}).get('status')
+
+
+class Update:
+    """A decoded webhook update"""
+    __slots__ = ('update_id', 'type', 'message', 'edited_message', 'callback_query', 'my_chat_member',
+                 'chat_id', 'raw')
+
+    def __init__(self, raw: Dict[str, Any]):
+        """
+        Args:
+            raw: Decoded update object
+        """
+        self.raw = raw
+        self.update_id = raw.get('update_id')
+        self.message = self.edited_message = self.callback_query = self.my_chat_member = None
+        # Telegram puts exactly one kind of object in an update, next to update_id
+        self.type = next((key for key in raw if key != 'update_id'), None)
+        value = raw.get(self.type) if self.type in UPDATE_TYPES else None
+
+        if value:
+            source = UPDATE_TYPES[self.type](value)
+            # Updates without a chat (inline mode, ...) cannot be answered
+            if source.chat_id:
+                setattr(self, self.type, source)
+        source = self.message or self.edited_message or self.callback_query or self.my_chat_member
+        # Chat the update belongs to, None for updates without one
+        self.chat_id = source.chat_id if source is not None else None
+
+
+# Update type -> struct decoding it; other types are not decoded
+UPDATE_TYPES = {
+    'message': IncomingMessage,
+    'edited_message': IncomingMessage,
+    'callback_query': CallbackQuery,
+    'my_chat_member': ChatMemberUpdate,
+}
+
+
+def decode_update(body) -> Update:
+    """
+    Decode a webhook request body
+
+    Args:
+        body: Raw request body (bytes or str), or an already decoded dict
+
+    Raises:
+        ValueError: The body is not a JSON object
+    """
+    data = body if isinstance(body, dict) else json.loads(body)
+    if not isinstance(data, dict):
+        raise ValueError('Update must be a JSON object')
+    return Update(data)
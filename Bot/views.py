@@ -1,52 +1,33 @@
 from ninja import NinjaAPI, Schema
 from django.shortcuts import get_object_or_404
+from django.conf import settings
 from django.http import JsonResponse
-from .models import TelegramBot, BotUser, BotFlow, BotMessage
-from telegram import Update, Bot as TelegramBotClient
-from telegram.request import HTTPXRequest
-from telegram.ext import Application
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import TelegramBot, BotUser, BotFlow, BotMessage, StaleUserState
+from .webhooks import get_webhook_config, reject_webhook_request
+from .db_writer import write
+from .client import create_telegram_client
+from .shared_state import LockTimeout, SharedStateError, get_backend as get_shared_state
+from . import metrics, tracing
+from .log import event
+from .updates import Update, decode_update
+from .admission import Overloaded, admitted
+from .flood import handle_flood
+from .sharding import shard_for
+from contextlib import nullcontext
 import asyncio
-from typing import Optional, Dict, Any
-import json
+import contextvars
+from typing import Any, Optional, Tuple, Union
 
 api = NinjaAPI(urls_namespace='bot_api')
 
-
-def create_telegram_client(token: str) -> TelegramBotClient:
-    """
-    Create Telegram Bot client with proper configuration
-    Clears proxy environment variables to avoid proxy issues
-    """
-    import os
-    
-    # Save original proxy env vars
-    original_proxies = {}
-    proxy_vars = ['HTTP_PROXY', 'HTTPS_PROXY', 'ALL_PROXY', 'http_proxy', 'https_proxy', 'all_proxy',
-                  'FTP_PROXY', 'ftp_proxy', 'NO_PROXY', 'no_proxy']
-    
-    # Temporarily clear proxy environment variables
-    for var in proxy_vars:
-        if var in os.environ:
-            original_proxies[var] = os.environ[var]
-            del os.environ[var]
-    
-    try:
-        # Create Telegram client - it will now not use any proxy
-        return TelegramBotClient(token=token)
-    finally:
-        # Restore original proxy env vars
-        for var, value in original_proxies.items():
-            os.environ[var] = value
+# Per-chat locks outlive the time the webhook waits for a service thread (UPDATE_HANDLER_TIMEOUT, 30s)
+CHAT_LOCK_TTL = 60
 
 
 # Schemas
-class WebhookUpdateSchema(Schema):
-    update_id: int
-    message: Optional[Dict[str, Any]] = None
-    edited_message: Optional[Dict[str, Any]] = None
-    callback_query: Optional[Dict[str, Any]] = None
-
-
 class BotCreateSchema(Schema):
     name: str
     token: str
@@ -110,12 +91,13 @@ def setup_webhook(request, bot_id: str, payload: WebhookSetupSchema):
     bot = get_object_or_404(TelegramBot, id=bot_id)
     
     try:
-        # Construct webhook URL with bot UUID
-        webhook_url = f"{payload.webhook_url}/api/webhook/{bot.id}"
+        # Construct webhook configuration with bot UUID
+        config = get_webhook_config(bot, base_url=payload.webhook_url)
+        webhook_url = config['url']
         
         # Set webhook with Telegram
         bot_client = create_telegram_client(bot.token)
-        asyncio.run(bot_client.set_webhook(url=webhook_url))
+        asyncio.run(bot_client.set_webhook(**config))
         
         # Update bot
         bot.webhook_url = webhook_url
@@ -158,122 +140,253 @@ def delete_webhook(request, bot_id: str):
 def webhook_handler(request, bot_id: str):
     """Handle incoming webhook updates from Telegram"""
     import logging
+    import time
     logger = logging.getLogger(__name__)
     
+    # Junk and stale requests are refused before any query or JSON parsing
+    rejected = reject_webhook_request(request, bot_id)
+    if rejected is not None:
+        status_code, reason = rejected
+        metrics.WEBHOOK_REJECTS.inc((reason,))
+        return api.create_response(request, {"error": reason}, status=status_code)
+    
+    started = time.perf_counter()
+    query_stats = metrics.QueryStats()
+    # Only known bots get their own label, junk IDs must not create series
+    bot_label = 'unknown'
+    bot_type = 'unknown'
+    status = 'error'
+    dedupe_key = None
+    
     try:
-        bot = get_object_or_404(TelegramBot, id=bot_id)
-        
-        # Parse update
-        update_data = json.loads(request.body)
-        logger.info(f"Received webhook update for bot {bot.name}: {update_data}")
-        
-        # Increment request count
-        bot.increment_request_count()
-        
-        # Process the update synchronously (services handle async Telegram calls internally)
-        process_telegram_update_sync(bot, update_data)
+        with metrics.track_queries(query_stats), tracing.start_trace('webhook', bot_id=bot_id) as trace:
+            # Parse update
+            update = decode_update(request.body)
+            
+            # Beyond capacity, Telegram is asked to come back later - before any database work
+            with admitted(update) as slot:
+                with tracing.span('load_bot'):
+                    bot = get_object_or_404(TelegramBot, id=bot_id)
+                bot_label = str(bot.id)
+                bot_type = bot.bot_type
+                
+                logger.info(event('webhook_update', bot_id=bot.id, bot=bot.name, update=update.raw))
+                if trace is not None:
+                    trace.set(bot=bot.name, bot_type=bot_type, update_id=update.update_id)
+                
+                # Telegram redelivers updates it considers failed; on any node, process each once
+                if update.update_id is not None:
+                    dedupe_key = f"update:{bot.id}:{update.update_id}"
+                    if get_shared_state().seen(dedupe_key, settings.UPDATE_DEDUPE_TTL):
+                        status = 'duplicate'
+                        return {"ok": True}
+                
+                # Users flooding the bot are cut off before anything is stored
+                with tracing.span('flood_check'):
+                    if handle_flood(bot, update):
+                        status = 'flood'
+                        return {"ok": True}
+                
+                # Increment request count
+                with tracing.span('increment_request_count'):
+                    write(bot.increment_request_count)
+                
+                # Process the update synchronously (services handle async Telegram calls internally)
+                with metrics.UPDATES_IN_PROGRESS.track_inprogress((bot_type,)), chat_lock(bot, update):
+                    process_telegram_update_sync(bot, update, query_stats=query_stats, slot=slot)
+            
+            if trace is not None:
+                trace.set(db_queries=query_stats.count)
         
+        status = 'ok'
         return {"ok": True}
+    except (Overloaded, LockTimeout) as e:
+        # Retryable: Telegram keeps the update and delivers it again later
+        if isinstance(e, LockTimeout):
+            metrics.STAGE_DEADLINES_EXCEEDED.inc(('chat_lock',))
+        status = 'overloaded'
+        forget_update(dedupe_key)
+        response = api.create_response(request, {"error": str(e)}, status=503)
+        response['Retry-After'] = str(settings.WEBHOOK_RETRY_AFTER)
+        return response
     except Exception as e:
         logger.error(f"Webhook error for bot_id {bot_id}: {str(e)}", exc_info=True)
+        # Let Telegram's retry of the failed update through
+        forget_update(dedupe_key)
         return api.create_response(
             request,
             {"error": str(e)},
             status=400
         )
+    finally:
+        metrics.WEBHOOK_REQUESTS.inc((bot_label, status))
+        metrics.WEBHOOK_DURATION.observe(time.perf_counter() - started, (bot_label,))
+        metrics.UPDATE_DB_QUERIES.observe(query_stats.count, (bot_type,))
+        metrics.UPDATE_DB_TIME.observe(query_stats.time, (bot_type,))
 
 
-def process_telegram_update_sync(bot: TelegramBot, update_data: dict):
-    """Process incoming Telegram update using Factory Pattern (synchronous version)"""
-    from .services.factory import BotServiceFactory
-    
-    message = update_data.get('message')
-    contact = update_data.get('contact')
-    
-    if not message:
-        return
-    
-    # Extract user data
-    from_user = message.get('from', {})
-    chat_id = message.get('chat', {}).get('id')
-    
-    if not chat_id:
+def forget_update(dedupe_key: Optional[str]) -> None:
+    """Drop an update's dedupe mark, so Telegram's redelivery is processed"""
+    if dedupe_key is None:
         return
-    
-    # Get or create bot user
-    bot_user, created = BotUser.objects.get_or_create(
-        bot=bot,
-        chat_id=chat_id,
-        defaults={
-            'username': from_user.get('username'),
-            'first_name': from_user.get('first_name'),
-            'last_name': from_user.get('last_name'),
-            'language_code': from_user.get('language_code'),
-        }
+    try:
+        get_shared_state().delete(dedupe_key)
+    except SharedStateError:
+        pass
+
+
+def chat_lock(bot: TelegramBot, update: Update):
+    """Serialize the updates of one chat across threads, processes and nodes (CHAT_LOCKS)"""
+    if not settings.CHAT_LOCKS or update.chat_id is None:
+        return nullcontext()
+    return get_shared_state().lock(
+        f"chat:{bot.id}:{update.chat_id}", ttl=CHAT_LOCK_TTL, timeout=settings.CHAT_LOCK_TIMEOUT
     )
+
+
+def get_or_create_bot_user(bot: TelegramBot, chat_id: int, from_user: dict) -> Tuple[BotUser, bool]:
+    """Get the sender's BotUser, creating it (and counting it on the bot) on first contact"""
+    with tracing.span('get_or_create_user'):
+        bot_user, created = BotUser.objects.get_or_create(
+            bot=bot,
+            chat_id=chat_id,
+            defaults={
+                'username': from_user.get('username'),
+                'first_name': from_user.get('first_name'),
+                'last_name': from_user.get('last_name'),
+                'language_code': from_user.get('language_code'),
+            }
+        )
     
-    # Update user count if new user
     if created:
+        TelegramBot.objects.filter(pk=bot.pk).update(user_count=F('user_count') + 1)
         bot.user_count += 1
-        bot.save(update_fields=['user_count'])
-    else:
-        # Update user info
-        bot_user.username = from_user.get('username') or bot_user.username
-        bot_user.first_name = from_user.get('first_name') or bot_user.first_name
-        bot_user.last_name = from_user.get('last_name') or bot_user.last_name
-        bot_user.save()
     
-    # Determine message type
-    import logging
-    logger = logging.getLogger(__name__)
+    return bot_user, created
+
+
+def record_update_user(bot: TelegramBot, chat_id: int, from_user: dict) -> BotUser:
+    """
+    Load the user of an update that is not a new message
+    
+    Button presses, edits and membership changes are not messages: no
+    BotMessage row is stored. They still count as interaction, so a user
+    only pressing buttons is not swept as idle.
+    """
+    bot_user, created = get_or_create_bot_user(bot, chat_id, from_user)
+    if not created:
+        bot_user.last_interaction = timezone.now()
+        # Only this column, so a concurrent state save is never overwritten
+        BotUser.objects.filter(pk=bot_user.pk).update(last_interaction=bot_user.last_interaction)
+    return bot_user
+
+
+def record_incoming_message(bot: TelegramBot, chat_id: int, from_user: dict, message_type: str,
+                            text: str, file_url: Optional[str], telegram_message_id: int) -> BotUser:
+    """
+    Store the sender and the incoming message
+    
+    All writes of an incoming update in one unit, so the serialized writer
+    can commit them together with other updates. A message kept in a shard
+    database is inserted once the user is committed: a rolled back update
+    then leaves no message of a user that does not exist, and a failed
+    insert only loses the log row.
+    """
+    bot_user, created = get_or_create_bot_user(bot, chat_id, from_user)
     
-    message_type = 'text'
-    text = message.get('text', '')
-    file_url = None
-    
-    logger.info(f"Processing message: {message.keys()}")
-    
-    if 'contact' in message:
-        message_type = 'contact'
-        contact = message['contact']
-        logger.info(f"Contact detected! Phone: {contact.get('phone_number')}")
-    elif 'photo' in message:
-        message_type = 'photo'
-        file_url = message['photo'][-1].get('file_id') if message['photo'] else None
-    elif 'video' in message:
-        message_type = 'video'
-        file_url = message['video'].get('file_id')
-    elif 'document' in message:
-        message_type = 'document'
-        file_url = message['document'].get('file_id')
-    elif 'audio' in message:
-        message_type = 'audio'
-        file_url = message['audio'].get('file_id')
-    elif 'voice' in message:
-        message_type = 'voice'
-        file_url = message['voice'].get('file_id')
+    with tracing.span('update_user', created=created):
+        if not created:
+            # Update user info; only these columns, so a concurrent state save is never overwritten
+            bot_user.username = from_user.get('username') or bot_user.username
+            bot_user.first_name = from_user.get('first_name') or bot_user.first_name
+            bot_user.last_name = from_user.get('last_name') or bot_user.last_name
+            bot_user.save(update_fields=['username', 'first_name', 'last_name', 'last_interaction'])
     
     # Save incoming message
-    BotMessage.objects.create(
+    message = BotMessage(
         bot=bot,
         user=bot_user,
         message_type=message_type,
         direction='incoming',
         text=text,
         file_url=file_url,
-        telegram_message_id=message.get('message_id')
+        telegram_message_id=telegram_message_id
     )
+    if shard_for(bot.pk) == DEFAULT_DB_ALIAS:
+        insert_message(message)
+    else:
+        # Logged, not raised, if it fails: the update itself was handled
+        transaction.on_commit(lambda: insert_message(message), robust=True)
     
-    # Create Telegram client
-    bot_client = create_telegram_client(bot.token)
+    return bot_user
+
+
+def insert_message(message: BotMessage) -> None:
+    with tracing.span('insert_message'):
+        message.save(force_insert=True)
+
+
+def route_update(update: Update, service_class) -> Optional[Tuple[tuple, str, Any]]:
+    """
+    Where an update goes: the write recording it and the service handler
     
-    # Use Factory Pattern to get appropriate service
-    bot_service = BotServiceFactory.create_service(bot, bot_user, bot_client)
+    Args:
+        update: Decoded update
+        service_class: The bot's service class
+    
+    Returns:
+        ((write function, *its arguments after the bot), handler, handler argument),
+        None for updates the service does not handle
+    """
+    if update.type not in service_class.handled_update_types():
+        return None
+    source = getattr(update, update.type, None)
+    if source is None:
+        return None
+    
+    handler = service_class.UPDATE_HANDLERS[update.type]
+    if update.type == 'message':
+        record = (
+            record_incoming_message,
+            source.chat_id, source.from_user, source.message_type, source.text, source.file_id, source.message_id,
+        )
+        if source.message_type == 'contact':
+            return record, 'handle_contact', source.contact
+        return record, handler, source.raw
+    return (record_update_user, source.chat_id, source.from_user), handler, source.raw
+
+
+def process_telegram_update_sync(bot: TelegramBot, update: Union[Update, dict],
+                                 query_stats: Optional[metrics.QueryStats] = None, slot=None):
+    """
+    Process incoming Telegram update using Factory Pattern (synchronous version)
+    
+    The admission slot, if given, is held until the service handler really
+    finishes, even when the webhook stops waiting for it.
+    """
+    from .services.factory import BotServiceFactory
+    
+    if isinstance(update, dict):
+        update = decode_update(update)
+    
+    route = route_update(update, BotServiceFactory.get_service_class(bot.bot_type))
+    if route is None:
+        metrics.UPDATES_IGNORED.inc((bot.bot_type, str(update.type)))
+        return
+    (record, *record_args), handler, argument = route
+    
+    # Store the user (and incoming message)
+    with tracing.span(record.__name__, update_type=update.type):
+        bot_user = write(record, bot, *record_args)
+    
+    # Use Factory Pattern to get appropriate service (replies are queued in the outbox,
+    # a Telegram client is only created if a handler calls the API directly)
+    bot_service = BotServiceFactory.create_service(bot, bot_user, update_id=update.update_id)
     
     # Handle contact sharing or regular message
     # Use a new thread with proper Django async setup
     import threading
-    from django.db import close_old_connections
+    from django.db import close_old_connections, connections
     
     def run_service():
         # Close any existing database connections in this thread
@@ -287,124 +400,96 @@ def process_telegram_update_sync(bot: TelegramBot, update_data: dict):
         import os
         os.environ['DJANGO_ALLOW_ASYNC_UNSAFE'] = 'true'
         
+        async def run_handler():
+            # Inside the event loop the ORM uses its own connection: count
+            # its queries and close it when the handler is done
+            try:
+                with metrics.track_queries(query_stats or metrics.QueryStats()):
+                    await run_service_handler(bot_service, handler, argument)
+            finally:
+                connections.close_all()
+        
         try:
-            if message_type == 'contact':
-                loop.run_until_complete(bot_service.handle_contact(message['contact']))
-            else:
-                loop.run_until_complete(bot_service.handle_message(message))
+            with metrics.SERVICE_HANDLER_DURATION.time((bot.bot_type, handler)), \
+                    tracing.span('service', service=type(bot_service).__name__):
+                loop.run_until_complete(run_handler())
         finally:
             loop.close()
             close_old_connections()
+            if slot is not None:
+                slot.release()
     
-    thread = threading.Thread(target=run_service)
+    # Run in a copy of this context so the service's spans join the update's trace
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(run_service,))
+    if slot is not None:
+        slot.handed_off = True
     thread.start()
-    thread.join(timeout=30)  # Wait max 30 seconds
+    thread.join(timeout=settings.UPDATE_HANDLER_TIMEOUT)
+    if thread.is_alive():
+        import logging
+        metrics.STAGE_DEADLINES_EXCEEDED.inc(('handler',))
+        logging.getLogger(__name__).warning(event(
+            'handler_deadline_exceeded', bot_id=bot.id, update_id=update.update_id,
+            timeout=settings.UPDATE_HANDLER_TIMEOUT
+        ))
+
 
+async def run_service_handler(bot_service, handler: str, argument) -> None:
+    """
+    Run a service handler, re-running it on the user's current state when
+    another update saved the same user first (at most USER_STATE_MAX_RETRIES times)
+    """
+    import logging
+    logger = logging.getLogger(__name__)
+    
+    for attempt in range(settings.USER_STATE_MAX_RETRIES + 1):
+        try:
+            await bot_service.dispatch(handler, argument)
+            return
+        except StaleUserState:
+            bot_type = bot_service.bot.bot_type
+            if attempt == settings.USER_STATE_MAX_RETRIES:
+                metrics.SERVICE_HANDLER_RETRIES.inc((bot_type, 'gave_up'))
+                logger.warning(event(
+                    'state_conflict_gave_up', bot_id=bot_service.bot.id,
+                    chat_id=bot_service.bot_user.chat_id, attempts=attempt + 1
+                ))
+                raise
+            metrics.SERVICE_HANDLER_RETRIES.inc((bot_type, 'retried'))
+            bot_service = bot_service.reloaded()
 
-async def process_telegram_update(bot: TelegramBot, update_data: dict):
+
+async def process_telegram_update(bot: TelegramBot, update: Union[Update, dict]):
     """Process incoming Telegram update using Factory Pattern"""
     from asgiref.sync import sync_to_async
     from .services.factory import BotServiceFactory
     
-    message = update_data.get('message')
-    contact = update_data.get('contact')
+    if isinstance(update, dict):
+        update = decode_update(update)
     
-    if not message:
+    route = route_update(update, BotServiceFactory.get_service_class(bot.bot_type))
+    if route is None:
+        metrics.UPDATES_IGNORED.inc((bot.bot_type, str(update.type)))
         return
+    (record, *record_args), handler, argument = route
     
-    # Extract user data
-    from_user = message.get('from', {})
-    chat_id = message.get('chat', {}).get('id')
-    
-    if not chat_id:
-        return
-    
-    # Get or create bot user (sync operation wrapped in async)
-    @sync_to_async
-    def get_or_create_user():
-        return BotUser.objects.get_or_create(
-            bot=bot,
-            chat_id=chat_id,
-            defaults={
-                'username': from_user.get('username'),
-                'first_name': from_user.get('first_name'),
-                'last_name': from_user.get('last_name'),
-                'language_code': from_user.get('language_code'),
-            }
-        )
-    
-    bot_user, created = await get_or_create_user()
-    
-    # Update user count if new user
-    if created:
-        @sync_to_async
-        def update_user_count():
-            bot.user_count += 1
-            bot.save(update_fields=['user_count'])
-        
-        await update_user_count()
-    else:
-        # Update user info
-        @sync_to_async
-        def update_user_info():
-            bot_user.username = from_user.get('username') or bot_user.username
-            bot_user.first_name = from_user.get('first_name') or bot_user.first_name
-            bot_user.last_name = from_user.get('last_name') or bot_user.last_name
-            bot_user.save()
-        
-        await update_user_info()
-    
-    # Determine message type
-    message_type = 'text'
-    text = message.get('text', '')
-    file_url = None
-    
-    if 'contact' in message:
-        message_type = 'contact'
-        contact = message['contact']
-    elif 'photo' in message:
-        message_type = 'photo'
-        file_url = message['photo'][-1].get('file_id') if message['photo'] else None
-    elif 'video' in message:
-        message_type = 'video'
-        file_url = message['video'].get('file_id')
-    elif 'document' in message:
-        message_type = 'document'
-        file_url = message['document'].get('file_id')
-    elif 'audio' in message:
-        message_type = 'audio'
-        file_url = message['audio'].get('file_id')
-    elif 'voice' in message:
-        message_type = 'voice'
-        file_url = message['voice'].get('file_id')
-    
-    # Save incoming message
-    @sync_to_async
-    def save_message():
-        return BotMessage.objects.create(
-            bot=bot,
-            user=bot_user,
-            message_type=message_type,
-            direction='incoming',
-            text=text,
-            file_url=file_url,
-            telegram_message_id=message.get('message_id')
-        )
-    
-    await save_message()
+    # Store the user and incoming message (sync operation wrapped in async)
+    bot_user = await sync_to_async(write)(record, bot, *record_args)
     
-    # Create Telegram client
-    bot_client = create_telegram_client(bot.token)
+    # Use Factory Pattern to get appropriate service (replies are queued in the outbox,
+    # a Telegram client is only created if a handler calls the API directly)
+    bot_service = BotServiceFactory.create_service(bot, bot_user, update_id=update.update_id)
     
-    # Use Factory Pattern to get appropriate service
-    bot_service = BotServiceFactory.create_service(bot, bot_user, bot_client)
+    await run_service_handler(bot_service, handler, argument)
+
+
+# Metrics Endpoint
+@api.get("/metrics")
+def metrics_endpoint(request):
+    """Prometheus metrics for the update pipeline"""
+    from django.http import HttpResponse
     
-    # Handle contact sharing
-    if message_type == 'contact':
-        await bot_service.handle_contact(message['contact'])
-    else:
-        # Handle regular message
-        await bot_service.handle_message(message)
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 
 # Health Check Endpoint
@@ -439,15 +524,62 @@ def get_bot_stats(request, bot_id: str):
     """Get bot statistics"""
     bot = get_object_or_404(TelegramBot, id=bot_id)
     
-    total_messages = BotMessage.objects.filter(bot=bot).count()
-    incoming_messages = BotMessage.objects.filter(bot=bot, direction='incoming').count()
-    outgoing_messages = BotMessage.objects.filter(bot=bot, direction='outgoing').count()
+    from django.db.models import Count, Q
+    from .sharding import aggregate
+    
+    # Summed over every message database, so rows not yet rebalanced are counted too
+    counts = aggregate(
+        BotMessage.objects.filter(bot=bot),
+        total=Count('id'),
+        incoming=Count('id', filter=Q(direction='incoming')),
+        outgoing=Count('id', filter=Q(direction='outgoing')),
+    )
     
     return {
         "bot_id": str(bot.id),
         "user_count": bot.user_count,
         "request_count": bot.request_count,
-        "total_messages": total_messages,
-        "incoming_messages": incoming_messages,
-        "outgoing_messages": outgoing_messages,
+        "total_messages": counts['total'],
+        "incoming_messages": counts['incoming'],
+        "outgoing_messages": counts['outgoing'],
     }
+
+
+# Columns of the message export
+EXPORT_FIELDS = ('created_at', 'direction', 'message_type', 'user_id', 'telegram_message_id', 'text', 'file_url')
+
+
+@api.get("/bots/{bot_id}/messages/export")
+def export_bot_messages(request, bot_id: str):
+    """Export a bot's message log as CSV, oldest first"""
+    from asgiref.sync import sync_to_async
+    from django.http import StreamingHttpResponse
+    from .sharding import message_databases
+    from itertools import islice
+    import csv
+    import heapq
+    
+    bot = get_object_or_404(TelegramBot, id=bot_id)
+    queryset = BotMessage.objects.filter(bot=bot).order_by('created_at', 'id').values_list(*EXPORT_FIELDS)
+    
+    class Echo:
+        def write(self, value):
+            return value
+    
+    def rows():
+        writer = csv.writer(Echo())
+        yield writer.writerow(EXPORT_FIELDS)
+        # Each database's rows are in order; merge them into one ordered log
+        shards = (queryset.using(alias).iterator(chunk_size=2000) for alias in message_databases())
+        for row in heapq.merge(*shards, key=lambda row: row[0]):
+            yield writer.writerow(row)
+    
+    async def chunks():
+        # Queries run on the sync thread, a chunk of lines at a time, so the server streams the file
+        lines = rows()
+        while chunk := await sync_to_async(lambda: ''.join(islice(lines, 1000)))():
+            yield chunk
+    
+    response = StreamingHttpResponse(chunks(), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="messages-{bot.id}.csv"'
+    return response
@@ -0,0 +1,219 @@
+"""
+Webhook configuration helpers
+
+Single place that describes how a bot's webhook should be registered with
+Telegram, so signals, admin actions, API endpoints and management commands
+all push (and compare against) the same configuration.
+
+Also the webhook's cheap early-reject path: each process keeps the IDs and
+secret tokens of the active bots in memory, so a request for an unknown or
+inactive bot, or with the wrong secret, is refused without a database query
+or parsing its body. Saving or deleting a bot bumps a version in shared
+state; processes reload the set when they see a new version. With a
+process-local shared state (memory://), or while the version is missing,
+the set is reloaded every WEBHOOK_BOTS_REFRESH_INTERVAL instead, and it is
+never older than ACTIVE_BOTS_MAX_AGE either way.
+"""
+from typing import Dict, Any, List, Optional
+import hmac
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Header Telegram sends the secret token in (as found in request.META)
+SECRET_HEADER = 'HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN'
+
+# Shared state key bumped whenever the active bots may have changed
+ACTIVE_BOTS_VERSION_KEY = 'webhook:active_bots'
+
+# Seconds after which the active bots are reloaded even if no change was announced
+ACTIVE_BOTS_MAX_AGE = 60
+
+
+def get_webhook_url(bot, base_url: Optional[str] = None) -> Optional[str]:
+    """
+    Build the webhook URL for a bot
+
+    Args:
+        bot: TelegramBot model instance
+        base_url: Public base URL, defaults to settings.BASE_URL
+
+    Returns:
+        Full webhook URL or None if no base URL is configured
+    """
+    base_url = base_url or getattr(settings, 'BASE_URL', None)
+    if not base_url:
+        return None
+    return f"{base_url.rstrip('/')}/api/webhook/{bot.id}"
+
+
+def get_allowed_updates(bot) -> List[str]:
+    """Update types the bot's service handles: Telegram sends no others"""
+    from .services.factory import BotServiceFactory
+
+    return list(BotServiceFactory.get_service_class(bot.bot_type).handled_update_types())
+
+
+def get_webhook_config(bot, base_url: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Desired webhook configuration for a bot
+
+    Returns the keyword arguments for ``Bot.set_webhook``. Options left as
+    None in settings are omitted, which keeps Telegram's current value;
+    allowed_updates defaults to the update types the bot's service handles.
+    """
+    config = {'url': get_webhook_url(bot, base_url)}
+
+    max_connections = getattr(settings, 'TELEGRAM_WEBHOOK_MAX_CONNECTIONS', None)
+    if max_connections is not None:
+        config['max_connections'] = max_connections
+
+    allowed_updates = getattr(settings, 'TELEGRAM_WEBHOOK_ALLOWED_UPDATES', None)
+    if allowed_updates is None:
+        allowed_updates = get_allowed_updates(bot)
+    config['allowed_updates'] = list(allowed_updates)
+
+    # Telegram does not report the secret back, so diff_webhook_info cannot
+    # see a changed one: register again with sync_webhooks --force
+    if bot.webhook_secret:
+        config['secret_token'] = bot.webhook_secret
+
+    return config
+
+
+def diff_webhook_info(webhook_info, config: Dict[str, Any]) -> List[str]:
+    """
+    Compare Telegram's webhook info against the desired configuration
+
+    Args:
+        webhook_info: telegram.WebhookInfo returned by get_webhook_info
+        config: Desired configuration from get_webhook_config
+
+    Returns:
+        Human readable list of drifted fields (empty when in sync)
+    """
+    drift = []
+
+    if (webhook_info.url or None) != config['url']:
+        drift.append(f"url: {webhook_info.url or 'not set'} -> {config['url']}")
+
+    if 'max_connections' in config and webhook_info.max_connections != config['max_connections']:
+        drift.append(
+            f"max_connections: {webhook_info.max_connections} -> {config['max_connections']}"
+        )
+
+    if 'allowed_updates' in config:
+        current = sorted(webhook_info.allowed_updates or [])
+        desired = sorted(config['allowed_updates'])
+        if current != desired:
+            drift.append(f"allowed_updates: {current or 'default'} -> {desired or 'default'}")
+
+    return drift
+
+
+class ActiveBots:
+    """Active bot ID -> webhook secret, reloaded when another process changed a bot"""
+
+    def __init__(self):
+        self._secrets: Optional[Dict[str, str]] = None
+        self._version = None
+        self._checked_at = 0.0
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def secret(self, bot_id: str) -> Optional[str]:
+        """
+        Webhook secret of an active bot
+
+        Returns:
+            The secret ('' when the bot has none), None for unknown or inactive bots
+        """
+        # A local reference: invalidate() may reset the attribute meanwhile
+        secrets = self._secrets
+        if secrets is None or time.monotonic() - self._checked_at >= settings.WEBHOOK_BOTS_REFRESH_INTERVAL:
+            secrets = self._refresh()
+        return secrets.get(bot_id)
+
+    def _refresh(self) -> Dict[str, str]:
+        from .models import TelegramBot
+        from .shared_state import SharedStateError, get_backend
+
+        with self._lock:
+            now = time.monotonic()
+            if self._secrets is not None and now - self._checked_at < settings.WEBHOOK_BOTS_REFRESH_INTERVAL:
+                return self._secrets
+            try:
+                backend = get_backend()
+                # Other processes' changes are only announced through a cross-process store
+                version = backend.get(ACTIVE_BOTS_VERSION_KEY) if backend.cross_process else None
+            except SharedStateError as e:
+                logger.warning(f"Active bots version unavailable: {e}")
+                version = None
+            if (self._secrets is None or version is None or version != self._version
+                    or now - self._loaded_at >= ACTIVE_BOTS_MAX_AGE):
+                self._secrets = {
+                    str(bot_id): secret or ''
+                    for bot_id, secret in TelegramBot.objects.filter(is_active=True).values_list('id', 'webhook_secret')
+                }
+                self._version = version
+                self._loaded_at = now
+            self._checked_at = now
+            return self._secrets
+
+    def invalidate(self) -> None:
+        """Reload on the next request here, and on the next check everywhere else"""
+        from .shared_state import SharedStateError, get_backend
+
+        with self._lock:
+            self._secrets = None
+        try:
+            get_backend().incr(ACTIVE_BOTS_VERSION_KEY)
+        except SharedStateError as e:
+            logger.warning(f"Could not announce changed bots: {e}")
+
+
+active_bots = ActiveBots()
+
+
+def reject_webhook_request(request, bot_id: str) -> Optional[tuple]:
+    """
+    Cheap checks run before a webhook request touches the database
+
+    Args:
+        request: Django HttpRequest
+        bot_id: Bot ID from the URL
+
+    Returns:
+        (status code, reason) to refuse the request with, None to accept it
+    """
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    if length > settings.WEBHOOK_MAX_BODY_BYTES:
+        return 413, 'too_large'
+
+    try:
+        bot_id = str(uuid.UUID(bot_id))
+    except ValueError:
+        return 404, 'unknown_bot'
+    secret = active_bots.secret(bot_id)
+    if secret is None:
+        return 404, 'unknown_bot'
+
+    token = request.META.get(SECRET_HEADER)
+    if token is None:
+        if secret and settings.WEBHOOK_REQUIRE_SECRET:
+            return 403, 'missing_secret'
+    elif secret and not hmac.compare_digest(token.encode(), secret.encode()):
+        return 403, 'bad_secret'
+
+    if len(request.body) > settings.WEBHOOK_MAX_BODY_BYTES:
+        # No or a wrong Content-Length
+        return 413, 'too_large'
+    return None
@@ -88,10 +88,56 @@ WSGI_APPLICATION = 'MAIN.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
+# SQLite production mode: WAL journaling (readers never block the writer),
+# synchronous=NORMAL (fsync on checkpoint only, safe with WAL), a busy
+# timeout instead of immediate "database is locked" errors, persistent
+# connections, and hot-path writes grouped by a single writer thread.
+SQLITE_PRODUCTION_MODE = os.getenv('SQLITE_PRODUCTION_MODE', '0') == '1'
+
+if SQLITE_PRODUCTION_MODE:
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': int(os.getenv('SQLITE_CONN_MAX_AGE', '600')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', '20')),
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA temp_store=MEMORY;'
+                'PRAGMA cache_size=-20000;'
+                'PRAGMA mmap_size=134217728;'
+            ),
+        },
+    })
+
+# Message log sharding: BotMessage rows go to MESSAGE_SHARDS extra SQLite files
+# (messages_0.sqlite3 ... in MESSAGE_SHARD_DIR), one per group of bots chosen by
+# consistent hashing on the bot id, so a busy bot's log does not slow the others.
+# MESSAGE_SHARD_PINS places given bots on a given database: "<bot id>=messages_1,...".
+# Run `migrate --database messages_<n>` for each shard and `rebalance_messages`
+# after changing the shards. Bots, users and other state stay in 'default'.
+MESSAGE_SHARDS = int(os.getenv('MESSAGE_SHARDS', '0'))
+MESSAGE_SHARD_DIR = os.getenv('MESSAGE_SHARD_DIR', str(BASE_DIR))
+MESSAGE_SHARD_PINS = dict(
+    pin.strip().split('=', 1) for pin in os.getenv('MESSAGE_SHARD_PINS', '').split(',') if pin.strip()
+)
+MESSAGE_SHARD_DATABASES = [f'messages_{index}' for index in range(MESSAGE_SHARDS)]
+
+for alias in MESSAGE_SHARD_DATABASES:
+    DATABASES[alias] = dict(DATABASES['default'], NAME=os.path.join(MESSAGE_SHARD_DIR, f'{alias}.sqlite3'))
+
+DATABASE_ROUTERS = ['Bot.sharding.MessageShardRouter']
+
+# Route hot-path writes through Bot.db_writer (one writer thread per process)
+SQLITE_SERIALIZED_WRITER = SQLITE_PRODUCTION_MODE
+SQLITE_WRITER_MAX_BATCH = int(os.getenv('SQLITE_WRITER_MAX_BATCH', '100'))
+SQLITE_WRITER_MAX_DELAY = float(os.getenv('SQLITE_WRITER_MAX_DELAY', '0.002'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -139,6 +185,101 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 import os
 BASE_URL = os.getenv('BASE_URL', 'https://3559f12d6e93.ngrok-free.app')
 
+# Bot API server; None means https://api.telegram.org. Point it at a local
+# Bot API server, or at `manage.py fake_telegram_api` for load tests.
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL') or None
+
+# Desired webhook configuration, enforced by the sync_webhooks command.
+# Leave a value as None to keep whatever Telegram currently has.
+TELEGRAM_WEBHOOK_MAX_CONNECTIONS = int(os.getenv('TELEGRAM_WEBHOOK_MAX_CONNECTIONS', '40'))
+# None: each bot gets the update types its service handles (message,
+# callback_query, ...); a list here is registered for every bot instead
+TELEGRAM_WEBHOOK_ALLOWED_UPDATES = None
+
+# Pending update count above which sync_webhooks flags a bot as backlogged
+TELEGRAM_WEBHOOK_BACKLOG_WARNING = int(os.getenv('TELEGRAM_WEBHOOK_BACKLOG_WARNING', '100'))
+
+# Webhook requests are rejected before any database query when the body is
+# larger than WEBHOOK_MAX_BODY_BYTES, the bot is unknown or inactive, or the
+# secret token Telegram sends is missing or does not match. Webhooks registered
+# before bots had secrets send none: when upgrading, set WEBHOOK_REQUIRE_SECRET=0
+# until `sync_webhooks --force` re-registered them all.
+WEBHOOK_MAX_BODY_BYTES = int(os.getenv('WEBHOOK_MAX_BODY_BYTES', str(256 * 1024)))
+WEBHOOK_REQUIRE_SECRET = os.getenv('WEBHOOK_REQUIRE_SECRET', '1') == '1'
+# Seconds between checks whether another process changed the active bots
+# (between reloads from the database with SHARED_STATE_URL=memory://)
+WEBHOOK_BOTS_REFRESH_INTERVAL = float(os.getenv('WEBHOOK_BOTS_REFRESH_INTERVAL', '2'))
+
+# Admission control: updates one process handles at once, and how many may
+# wait for a slot (per priority: commands and contacts, chatter, the rest)
+# and for how long. Beyond that the webhook answers 503 with Retry-After and
+# Telegram redelivers the update later.
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv('WEBHOOK_MAX_CONCURRENCY', '32'))
+WEBHOOK_QUEUE_LIMITS = {
+    'high': int(os.getenv('WEBHOOK_QUEUE_LIMIT_HIGH', '128')),
+    'normal': int(os.getenv('WEBHOOK_QUEUE_LIMIT_NORMAL', '64')),
+    'low': int(os.getenv('WEBHOOK_QUEUE_LIMIT_LOW', '16')),
+}
+WEBHOOK_QUEUE_TIMEOUT = float(os.getenv('WEBHOOK_QUEUE_TIMEOUT', '5'))
+WEBHOOK_RETRY_AFTER = int(os.getenv('WEBHOOK_RETRY_AFTER', '5'))
+# Seconds the webhook waits for an update's service handler
+UPDATE_HANDLER_TIMEOUT = float(os.getenv('UPDATE_HANDLER_TIMEOUT', '30'))
+
+# Shared state (update dedupe, per-chat locks, counters): memory:// is per
+# process; use sqlite:///path for several processes on one host and
+# redis://host:port/db when several nodes serve the same bots.
+SHARED_STATE_URL = os.getenv('SHARED_STATE_URL', 'memory://')
+SHARED_STATE_KEY_PREFIX = os.getenv('SHARED_STATE_KEY_PREFIX', 'bot:')
+
+# Seconds an update ID is remembered to drop Telegram redeliveries
+UPDATE_DEDUPE_TTL = int(os.getenv('UPDATE_DEDUPE_TTL', '600'))
+
+# BotUser state saves are versioned: a handler whose save conflicts with a
+# concurrent update is re-run on the current state up to this many times
+USER_STATE_MAX_RETRIES = int(os.getenv('USER_STATE_MAX_RETRIES', '3'))
+
+# Optionally also process each chat's updates one at a time across nodes
+# (strict ordering), waiting up to CHAT_LOCK_TIMEOUT seconds for the lock
+CHAT_LOCKS = os.getenv('CHAT_LOCKS', '0') == '1'
+CHAT_LOCK_TIMEOUT = float(os.getenv('CHAT_LOCK_TIMEOUT', '10'))
+
+# Incoming flood protection (per bot in the admin): a user sending more than
+# FLOOD_LIMIT updates in FLOOD_WINDOW seconds (sliding window) has the excess
+# dropped; exceeding it FLOOD_BLOCK_AFTER times within FLOOD_STRIKE_HOURS
+# blocks them for FLOOD_BLOCK_HOURS. Counters live in shared state: with the
+# default memory:// each serve worker counts separately (the effective limit is
+# FLOOD_LIMIT x workers); use a Redis or SQLite SHARED_STATE_URL for one limit.
+FLOOD_LIMIT = int(os.getenv('FLOOD_LIMIT', '20'))
+FLOOD_WINDOW = int(os.getenv('FLOOD_WINDOW', '10'))
+FLOOD_BLOCK_AFTER = int(os.getenv('FLOOD_BLOCK_AFTER', '10'))
+FLOOD_STRIKE_HOURS = float(os.getenv('FLOOD_STRIKE_HOURS', '1'))
+FLOOD_BLOCK_HOURS = float(os.getenv('FLOOD_BLOCK_HOURS', '24'))
+
+# Per-token circuit breaker: after a 401 Unauthorized a bot's outgoing messages
+# wait BOT_BREAKER_COOLDOWN seconds; BOT_BREAKER_THRESHOLD such trips (within
+# a day) deactivate the bot and email ADMINS (see Bot/breaker.py)
+BOT_BREAKER_THRESHOLD = int(os.getenv('BOT_BREAKER_THRESHOLD', '3'))
+BOT_BREAKER_COOLDOWN = int(os.getenv('BOT_BREAKER_COOLDOWN', '60'))
+
+# Hours without interaction after which sweep_sessions resets a user's
+# unfinished conversation (per bot: TelegramBot.session_idle_hours; 0 disables)
+SESSION_IDLE_HOURS = int(os.getenv('SESSION_IDLE_HOURS', '72'))
+
+# Directory flow steps' media paths (photo, document, ...) are relative to.
+# Each file is uploaded to Telegram once per bot and content, then sent by file_id.
+BOT_MEDIA_ROOT = os.getenv('BOT_MEDIA_ROOT', str(BASE_DIR / 'media'))
+
+# Metrics (/api/metrics). Set a shared directory when running several
+# processes (serve workers, run_outbox, run_bot_tasks) so values are summed.
+METRICS_MULTIPROCESS_DIR = os.getenv('METRICS_MULTIPROCESS_DIR') or None
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+
+# Tracing: fraction of webhook updates traced (0 disables), optional Chrome
+# trace event file, and number of slowest traces kept for the admin page
+TRACING_SAMPLE_RATE = float(os.getenv('TRACING_SAMPLE_RATE', '0.01'))
+TRACING_EXPORT_PATH = os.getenv('TRACING_EXPORT_PATH') or None
+TRACING_SLOWEST_COUNT = int(os.getenv('TRACING_SLOWEST_COUNT', '50'))
+
 # Logging Configuration
 LOGGING = {
     'version': 1,
@@ -149,15 +290,36 @@ LOGGING = {
             'style': '{',
         },
     },
+    'filters': {
+        # Share of INFO/DEBUG records kept; bot_rates overrides it per bot ID
+        'sampling': {
+            '()': 'Bot.log.SamplingFilter',
+            'rate': float(os.getenv('LOG_SAMPLE_RATE', '1.0')),
+            'bot_rates': {},
+        },
+        # Masked event fields (also inside logged updates)
+        'redaction': {
+            '()': 'Bot.log.RedactionFilter',
+            'fields': ['phone_number', 'text', 'caption'],
+        },
+    },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
             'formatter': 'verbose',
+            'filters': ['redaction'],
+        },
+        # Request threads only enqueue; 'console' runs on a listener thread
+        'queue': {
+            'class': 'Bot.log.QueueHandler',
+            'handlers': ['console'],
+            'respect_handler_level': True,
+            'filters': ['sampling'],
         },
     },
     'loggers': {
         'Bot': {
-            'handlers': ['console'],
+            'handlers': ['queue'],
             'level': 'INFO',
             'propagate': False,
         },